@@ -1,7 +1,12 @@
+import argparse
 import random
+import subprocess
 import sys
 from pathlib import Path
 
+import numpy as np
+
+import lm
 import metadata
 from metadata import DataSet
 
@@ -9,28 +14,136 @@ random.seed(0)
 
 HELP = """
 === Dataset generator ===
-Possible arguments:
-    data - generate huggingface dataset
-    sent - generate clean sentences for the n-gram model
 """
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(prog="asr-project", description=HELP.strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--primock", type=Path, default=Path("./primock57"), help="path to the primock57 repository")
+    parser.add_argument("--profile-startup", action="store_true", help="report the import time of every module")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    data = commands.add_parser("data", help="generate huggingface dataset")
+    data.add_argument("-j", "--workers", type=int, default=None, help="export processes (default: all cores)")
+    data.add_argument("--shard-size", type=int, default=256, help="max size of one tar shard in MiB")
+    data.add_argument("--compress", action="store_true", help="gzip the shards (PCM barely compresses)")
+    data.add_argument("--clean", action="store_true", help="rebuild everything instead of only what changed")
+    data.add_argument("--features", type=Path, default=Path("cache") / "features",
+                      help="store of the resampled recordings, shared with the evaluation")
+    data.add_argument("--normalize", choices=metadata.NORMALIZATIONS, default="none",
+                      help="recording level normalization applied before the export")
+    data.add_argument("--no-vad", action="store_true", help="export the intervals without trimming their silence")
+    data.add_argument("--vad-margin", type=float, default=0.1, help="seconds of silence kept around the speech")
+    data.add_argument("--vad-threshold", type=float, default=12.0,
+                      help="dB above the noise floor of an interval for a frame to be speech")
+    data.add_argument("--min-speech", type=float, default=0.1,
+                      help="seconds of speech below which an interval is exported untrimmed")
+
+    commands.add_parser("sent", help="generate clean sentences for the n-gram model")
+
+    train = commands.add_parser("lm", help="train modified Kneser-Ney n-gram models and write them as ARPA")
+    train.add_argument("-n", "--order", type=int, nargs="+", default=[2, 3, 4],
+                       help="orders to write, from 2 on (KenLM cannot load a 1-gram model)")
+    train.add_argument("--name", default="context", help="models are written to <out-dir>/<n>gram_<name>_lm.arpa")
+    train.add_argument("--split", default="train", choices=["train", "test", "eval"],
+                       help="dataset split to train on, intervals with empty text are skipped")
+    train.add_argument("--corpus", type=Path, nargs="+",
+                       help="train on text files (one sentence per line) instead of a dataset split")
+    train.add_argument("--out-dir", type=Path, default=Path("models"))
+
+    interp = commands.add_parser("interp", help="find the interpolation weight of two ARPA models with the lowest "
+                                                "perplexity and write the mixed model")
+    interp.add_argument("models", type=Path, nargs=2,
+                        help="e.g. models/3gram_context_lm.arpa models/3gram_background_lm.arpa, "
+                             "the weight is the weight of the first one")
+    interp.add_argument("--method", choices=lm.METHODS, nargs="+", default=lm.METHODS)
+    interp.add_argument("--steps", type=int, default=101, help="number of weights between 0 and 1 to try")
+    interp.add_argument("--split", default="eval", choices=["train", "test", "eval"],
+                        help="dataset split to compute the perplexity on")
+    interp.add_argument("--corpus", type=Path, nargs="+",
+                        help="compute the perplexity on text files (one sentence per line) instead of a dataset split")
+    interp.add_argument("--name", default="adapted",
+                        help="models are written to <out-dir>/<n>gram_<name>_lm.arpa (log_<name> for log-linear)")
+    interp.add_argument("--out-dir", type=Path, default=Path("models"))
+
+    prune = commands.add_parser("prune", help="restrict an ARPA model to the in-domain vocabulary of the train split "
+                                              "and prune its n-grams down to target sizes")
+    prune.add_argument("model", type=Path, help="e.g. models/3gram_background_lm.arpa")
+    prune.add_argument("-s", "--size", type=int, nargs="+", required=True,
+                       help="number of n-grams (all orders) of every pruned model")
+    prune.add_argument("--wordlist", type=Path, help="extra in-domain words, e.g. a medical wordlist, one per line")
+    prune.add_argument("--labels", type=Path, default=Path("vocab.json"),
+                       help="vocab.json of the acoustic model, words it cannot spell are dropped (skipped if missing)")
+    prune.add_argument("--name", default="pruned",
+                       help="models are written to <out-dir>/<n>gram_<name>_lm.arpa (<name>_<size> for several sizes)")
+    prune.add_argument("--out-dir", type=Path, default=Path("models"))
+    commands.add_parser("test", help="load the generated huggingface dataset")
+    return parser, parser.parse_args()
+
+
+def profile_startup(top: int = 25) -> int:
+    """
+    Run the same command again with -X importtime and report the most expensive imports
+    """
+    argv = [a for a in sys.argv[1:] if a != "--profile-startup"]
+    proc = subprocess.run([sys.executable, "-X", "importtime", sys.argv[0], *argv], stderr=subprocess.PIPE, text=True)
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            print(line, file=sys.stderr)
+            continue
+        fields = line.removeprefix("import time:").split("|")
+        if not fields[0].strip().isdigit():
+            # the header of the report
+            continue
+        rows.append((int(fields[0]), int(fields[1]), fields[2].rstrip()))
+
+    print(f"\n=== Startup imports: {len(rows)} modules, {sum(r[0] for r in rows) / 1000:.1f} ms ===")
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for self_us, cumulative_us, name in sorted(rows, key=lambda r: r[1], reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:10.1f}ms {self_us / 1000:8.1f}ms {name}")
+    return proc.returncode
+
+
+def interpolate(args, sentences):
+    lm.interpolate(*args.models, sentences, methods=args.method, steps=args.steps, name=args.name,
+                   out_dir=args.out_dir)
+
+
 def main():
-    if len(sys.argv) < 2:
-        print(HELP.strip())
+    parser, args = parse_args()
+    if args.profile_startup:
+        exit(profile_startup())
+
+    if args.command is None:
+        parser.print_help()
         exit()
 
-    if sys.argv[1] == "test":
+    if args.command == "test":
         metadata.test()
         exit()
 
-    ds = DataSet(Path("./primock57"))  # give the primock57 path
-    intervals = []
-    for tr in ds.transcripts:
-        # print(tr, len(tr.intervals))
-        intervals.extend(tr.intervals)
+    if args.command == "lm" and min(args.order) < 2:
+        parser.error("the lowest order is 2, KenLM cannot load a 1-gram model")
+
+    if args.command == "lm" and args.corpus:
+        # e.g. a background corpus, streamed from disk without loading the dataset
+        lm.train(lm.read_corpus(args.corpus), args.order, args.name, args.out_dir)
+        exit()
+
+    if args.command == "interp" and args.corpus:
+        interpolate(args, [s.strip() for s in lm.read_corpus(args.corpus)])
+        exit()
+
+    ds = DataSet(args.primock)  # give the primock57 path
+    intervals = ds.table
 
-    random.shuffle(intervals)
+    # shuffling the row indices gives the same permutation as shuffling a list of the intervals
+    order = list(range(len(intervals)))
+    random.shuffle(order)
+    intervals = intervals[np.asarray(order, dtype=np.int64)]
     n_total = len(intervals)
     n_test = n_eval = int(n_total * 0.1)
     n_train = n_total - n_test - n_eval
@@ -46,12 +159,22 @@ def main():
         "eval": intervals[n_train + n_test:]
     }
 
-    if sys.argv[1] == "data":
-        metadata.generate(dct)
-    elif sys.argv[1] == "sent":
+    if args.command == "data":
+        metadata.generate({k: v.non_empty().intervals() for k, v in dct.items()}, workers=args.workers,
+                          shard_size=args.shard_size * 2 ** 20, compress=args.compress, clean=args.clean,
+                          vad=None if args.no_vad else metadata.VAD(args.vad_margin, args.vad_threshold,
+                                                                     min_speech=args.min_speech),
+                          features=metadata.FeatureStore(args.features, normalization=args.normalize))
+    elif args.command == "sent":
         metadata.sentences(dct)
-    else:
-        raise ValueError(f"Unknown argument '{sys.argv[1]}'")
+    elif args.command == "lm":
+        lm.train(dct[args.split].non_empty().texts(), args.order, args.name, args.out_dir)
+    elif args.command == "prune":
+        lm.prune_model(args.model, dct["train"].non_empty().texts(), list(dct["eval"].non_empty().texts()),
+                       args.size, wordlist=args.wordlist, labels=args.labels if args.labels.exists() else None,
+                       name=args.name, out_dir=args.out_dir)
+    elif args.command == "interp":
+        interpolate(args, list(dct[args.split].non_empty().texts()))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,6 @@
+from .arpa import ArpaModel, recompute_backoffs, write_arpa
+from .counts import NgramCounter
+from .interpolate import METHODS, interpolate
+from .kneser_ney import estimate
+from .prune import prune, prune_model, restrict_vocabulary
+from .util import read_corpus, train
@@ -0,0 +1,176 @@
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .counts import BOS, EOS, UNK, lookup
+from .kneser_ney import LOG_ZERO
+
+
+def write_arpa(path: Path, words: Sequence[str], tables: List[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]):
+    """
+    Write (n-grams, log10 probabilities, log10 backoffs) tables of word ids as an ARPA file,
+    zero backoffs are left out
+    """
+    with Path(path).open("w") as f:
+        f.write("\\data\\\n")
+        for n, (grams, _, _) in enumerate(tables, 1):
+            f.write(f"ngram {n}={len(grams)}\n")
+
+        for n, (grams, logp, logbow) in enumerate(tables, 1):
+            f.write(f"\n\\{n}-grams:\n")
+            text = [" ".join(words[i] for i in g) for g in grams.tolist()]
+            if logbow is None:
+                f.writelines(f"{p:.6f}\t{t}\n" for p, t in zip(logp.tolist(), text))
+            else:
+                f.writelines(f"{p:.6f}\t{t}\t{b:.6f}\n" if b else f"{p:.6f}\t{t}\n"
+                             for p, t, b in zip(logp.tolist(), text, logbow.tolist()))
+
+        f.write("\n\\end\\\n")
+
+
+def queries(vocab: Dict[str, int], order: int, sentences: Iterable[str]) -> np.ndarray:
+    """
+    One row [h..., w] of word ids per predicted token of the sentences (every word and </s>),
+    with histories shorter than order - 1 words left-padded with -1
+    """
+    unk = vocab[UNK]
+    rows = []
+    for s in sentences:
+        ids = [-1] * (order - 1) + [vocab[BOS]] + [vocab.get(w, unk) for w in s.split()] + [vocab[EOS]]
+        rows.extend(ids[i - order + 1:i + 1] for i in range(order, len(ids)))
+    return np.asarray(rows, dtype=np.int32).reshape(-1, order)
+
+
+def recompute_backoffs(tables: List[Tuple[np.ndarray, np.ndarray, np.ndarray]]) \
+        -> List[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]:
+    """
+    Backoff weights which make every history sum to one given the probabilities of the tables,
+    bow(h) = (1 - sum of p(w | h) over the n-grams hw) / (1 - sum of p(w | h') over the same words)
+    """
+    tables = list(tables)
+    for n in range(1, len(tables)):
+        grams, logp = tables[n][:2]
+        histories, lower_logp = tables[n - 1][:2]
+        idx = lookup(histories, grams[:, :-1])
+        suffix = lookup(histories, grams[:, 1:])
+        # both are in the lower order table of a well-formed model
+        keep = (idx >= 0) & (suffix >= 0)
+        idx = idx[keep]
+        numerator = 1 - np.bincount(idx, weights=np.power(10.0, logp[keep]), minlength=len(histories))
+        denominator = 1 - np.bincount(idx, weights=np.power(10.0, lower_logp[suffix[keep]]), minlength=len(histories))
+        has = np.bincount(idx, minlength=len(histories)) > 0
+        logbow = np.log10(np.clip(numerator, 1e-12, None) / np.clip(denominator, 1e-12, None))
+        tables[n - 1] = (histories, lower_logp, np.where(has, logbow, 0.0))
+    return [(g, p, b if n < len(tables) else None) for n, (g, p, b) in enumerate(tables, 1)]
+
+
+class ArpaModel:
+    """
+    Backoff n-gram model read from an ARPA file, the n-grams of every order are kept as a table
+    of word ids with parallel arrays of log10 probabilities and backoffs
+    """
+
+    def __init__(self, words: List[str], tables: List[Tuple[np.ndarray, np.ndarray, np.ndarray]]):
+        self.words = words
+        self.vocab = {w: i for i, w in enumerate(words)}
+        self.grams = [t[0] for t in tables]
+        self.logp = [t[1] for t in tables]
+        self.logbow = [t[2] for t in tables]
+
+    @property
+    def order(self) -> int:
+        return len(self.grams)
+
+    @property
+    def unk(self) -> int:
+        return self.vocab[UNK]
+
+    @classmethod
+    def from_file(cls, path: Path) -> "ArpaModel":
+        words = []
+        vocab = {}
+        rows = []
+        n = 0
+        with Path(path).open(encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("ngram ") or line == "\\data\\":
+                    continue
+                if line == "\\end\\":
+                    break
+                if line.startswith("\\") and line.endswith("-grams:"):
+                    n = int(line[1:-len("-grams:")])
+                    rows.append(([], [], []))
+                    continue
+
+                fields = line.split()
+                gram = fields[1:n + 1]
+                if n == 1:
+                    vocab[gram[0]] = len(words)
+                    words.append(gram[0])
+                rows[-1][0].append([vocab[w] for w in gram])
+                rows[-1][1].append(float(fields[0]))
+                rows[-1][2].append(float(fields[n + 1]) if len(fields) > n + 1 else 0.0)
+
+        if UNK not in vocab:
+            # KenLM adds <unk> with probability zero to models without it
+            vocab[UNK] = len(words)
+            words.append(UNK)
+            rows[0][0].append([vocab[UNK]])
+            rows[0][1].append(LOG_ZERO)
+            rows[0][2].append(0.0)
+
+        tables = []
+        for n, (grams, logp, logbow) in enumerate(rows, 1):
+            grams = np.asarray(grams, dtype=np.int32).reshape(-1, n)
+            order = np.lexsort(grams.T[::-1])
+            tables.append((grams[order], np.asarray(logp)[order], np.asarray(logbow)[order]))
+        return cls(words, tables)
+
+    def tables(self) -> List[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]]:
+        return [(g, p, b if n < self.order else None)
+                for n, (g, p, b) in enumerate(zip(self.grams, self.logp, self.logbow), 1)]
+
+    def encode(self, words: Sequence[str]) -> np.ndarray:
+        return np.asarray([self.vocab.get(w, self.unk) for w in words], dtype=np.int32)
+
+    def logprob(self, grams: np.ndarray) -> np.ndarray:
+        """
+        log10 p(w | h) of every row [h..., w] of word ids, rows may be left-padded with -1
+        when the history is shorter than the array
+        """
+        grams = np.asarray(grams, dtype=np.int32)
+        if grams.shape[1] > self.order:
+            grams = grams[:, -self.order:]
+        width = grams.shape[1]
+        # number of trailing valid ids of every row
+        length = width - np.maximum.accumulate(np.where(grams < 0, np.arange(1, width + 1), 0), axis=1)[:, -1]
+
+        result = np.zeros(len(grams))
+        pending = np.ones(len(grams), dtype=bool)
+        for m in range(width, 0, -1):
+            active = np.flatnonzero(pending & (length >= m))
+            if len(active) == 0:
+                continue
+            idx = lookup(self.grams[m - 1], grams[active, width - m:])
+            hit = idx >= 0
+            result[active[hit]] += self.logp[m - 1][idx[hit]]
+            pending[active[hit]] = False
+
+            miss = active[~hit]
+            if m > 1 and len(miss):
+                # back off from h to h', paying the backoff weight of h when h is known
+                ctx = lookup(self.grams[m - 2], grams[miss, width - m:width - 1])
+                result[miss] += np.where(ctx >= 0, self.logbow[m - 2][np.maximum(ctx, 0)], 0.0)
+
+        # words outside of the vocabulary
+        result[pending] += self.logp[0][lookup(self.grams[0], np.asarray([[self.unk]], dtype=np.int32))[0]]
+        return result
+
+    def queries(self, sentences: Iterable[str]) -> np.ndarray:
+        return queries(self.vocab, self.order, sentences)
+
+    def perplexity(self, sentences: Iterable[str]) -> float:
+        logp = self.logprob(self.queries(sentences))
+        return float(10 ** (-logp.mean())) if len(logp) else float("nan")
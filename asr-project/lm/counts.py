@@ -0,0 +1,149 @@
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+BOS = "<s>"
+EOS = "</s>"
+UNK = "<unk>"
+
+
+def merge_counts(grams: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum the counts of equal n-grams, the result is sorted lexicographically
+    """
+    uniq, inverse = np.unique(grams, axis=0, return_inverse=True)
+    return uniq, np.bincount(inverse.reshape(-1), weights=counts, minlength=len(uniq)).astype(np.int64)
+
+
+def _keys(table: np.ndarray, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    One sortable element per n-gram of the table and of the queries, which compare like the rows
+    """
+    n = table.shape[1]
+    low = min(int(table.min()), int(queries.min()))
+    base = max(int(table.max()), int(queries.max())) + 2
+    if low >= -1 and base ** n < 2 ** 63:
+        # the ids (from -1 for padding) as digits of a single integer, much faster to search
+        keys = []
+        for grams in (table, queries):
+            k = np.zeros(len(grams), dtype=np.int64)
+            for i in range(n):
+                k = k * base + grams[:, i] + 1
+            keys.append(k)
+        return keys[0], keys[1]
+    # structured elements comparing field by field (views unless the arrays are not contiguous)
+    fields = [(f"w{i}", np.int32) for i in range(n)]
+    return tuple(np.ascontiguousarray(g, dtype=np.int32).view(fields).reshape(-1) for g in (table, queries))
+
+
+def lookup(table: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    Row index of every query in a lexicographically sorted table of unique n-grams (as written by
+    merge_counts or np.unique(axis=0)), -1 where the query is not in the table
+    """
+    if len(queries) == 0 or len(table) == 0:
+        return np.full(len(queries), -1, dtype=np.int64)
+    keys, wanted = _keys(table, queries)
+    # sorted queries walk the table in order, which is a lot kinder to the cache
+    order = np.argsort(wanted, kind="stable")
+    pos = np.empty(len(wanted), dtype=np.int64)
+    pos[order] = np.minimum(np.searchsorted(keys, wanted[order]), len(keys) - 1)
+    return np.where(keys[pos] == wanted, pos, -1)
+
+
+class NgramCounter:
+    """
+    Streaming n-gram counter for orders 1 to `order`
+
+    Words are encoded as integers, sentences are buffered as one flat id array and counted
+    chunk by chunk, the counts of every order are kept as sorted runs of n-grams
+    (an int32 array of shape (M, n)) with a parallel array of counts, which are merged into
+    one sorted table when the counts are read
+    """
+
+    def __init__(self, order: int, chunk_size: int = 2 ** 20):
+        self.order = order
+        self.chunk_size = chunk_size
+        self.words = [UNK, BOS, EOS]
+        self.vocab = {w: i for i, w in enumerate(self.words)}
+        self._ids = []
+        self._lengths = []
+        self._runs: List[List[Tuple[np.ndarray, np.ndarray]]] = [[] for _ in range(order)]
+
+    @property
+    def bos(self) -> int:
+        return self.vocab[BOS]
+
+    def add(self, sentence: str):
+        words = sentence.split()
+        # sentences may already be wrapped in markers, e.g. the *.s files of metadata.sentences
+        if words and words[0] == BOS:
+            words = words[1:]
+        if words and words[-1] == EOS:
+            words = words[:-1]
+
+        vocab = self.vocab
+        for w in words:
+            if w not in vocab:
+                vocab[w] = len(self.words)
+                self.words.append(w)
+        self._ids.append(vocab[BOS])
+        self._ids.extend(vocab[w] for w in words)
+        self._ids.append(vocab[EOS])
+        self._lengths.append(len(words) + 2)
+
+        if len(self._ids) >= self.chunk_size:
+            self.flush()
+
+    def add_all(self, sentences: Iterable[str]) -> "NgramCounter":
+        for s in sentences:
+            self.add(s)
+        self.flush()
+        return self
+
+    def flush(self):
+        """
+        Count the buffered sentences and merge them into the count tables
+        """
+        if not self._ids:
+            return
+
+        ids = np.asarray(self._ids, dtype=np.int32)
+        sentence = np.repeat(np.arange(len(self._lengths)), self._lengths)
+        self._ids = []
+        self._lengths = []
+
+        for n in range(1, self.order + 1):
+            if len(ids) < n:
+                break
+            windows = np.lib.stride_tricks.sliding_window_view(ids, n)
+            # windows must not cross sentence boundaries and <s> is never predicted
+            valid = (sentence[:len(windows)] == sentence[n - 1:]) & (windows[:, -1] != self.bos)
+            # only the chunk is sorted here, not everything counted so far
+            self._push(self._runs[n - 1], merge_counts(windows[valid], np.ones(valid.sum(), dtype=np.int64)))
+
+    @staticmethod
+    def _push(runs: List[Tuple[np.ndarray, np.ndarray]], run: Tuple[np.ndarray, np.ndarray]):
+        """
+        Add a sorted run, runs of similar size are merged like the digits of a binary counter,
+        so that every n-gram goes through O(log chunks) merges rather than one per chunk
+        """
+        runs.append(run)
+        while len(runs) > 1 and len(runs[-2][0]) <= 2 * len(runs[-1][0]):
+            (grams, counts), (last_grams, last_counts) = runs[-2:]
+            runs[-2:] = [merge_counts(np.concatenate([grams, last_grams]), np.concatenate([counts, last_counts]))]
+
+    def counts(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sorted table of all n-grams of order n and their counts
+        """
+        self.flush()
+        runs = self._runs[n - 1]
+        if not runs:
+            return np.zeros((0, n), dtype=np.int32), np.zeros(0, dtype=np.int64)
+        if len(runs) > 1:
+            runs[:] = [merge_counts(np.concatenate([g for g, _ in runs]), np.concatenate([c for _, c in runs]))]
+        return runs[0]
+
+    def decode(self, gram: np.ndarray) -> List[str]:
+        return [self.words[i] for i in gram]
@@ -0,0 +1,231 @@
+import hashlib
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from . import arpa
+from .arpa import ArpaModel, recompute_backoffs, write_arpa
+from .counts import BOS, lookup
+from .kneser_ney import LOG_ZERO
+
+METHODS = ["linear", "loglinear"]
+LN10 = np.log(10)
+
+# (rows x vocabulary) log-probabilities evaluated at once when normalizing log-linear mixtures
+BATCH_CELLS = 2 ** 21
+
+
+def _logsumexp10(x: np.ndarray, axis: int = -1) -> np.ndarray:
+    top = x.max(axis=axis, keepdims=True)
+    return (top + np.log10(np.power(10.0, x - top).sum(axis=axis, keepdims=True))).squeeze(axis)
+
+
+def _linear(first: np.ndarray, second: np.ndarray, weight) -> np.ndarray:
+    """
+    log10(l * 10^a + (1 - l) * 10^b), without leaving the log domain
+    """
+    with np.errstate(divide="ignore"):
+        return np.logaddexp(np.log(weight) + first * LN10, np.log1p(-weight) + second * LN10) / LN10
+
+
+def _union(*tables: np.ndarray) -> np.ndarray:
+    grams = np.concatenate(tables)
+    return np.unique(grams, axis=0) if len(grams) else grams
+
+
+class Mixture:
+    """
+    Two backoff models over the union of their vocabularies, the probability of a word
+    missing from one model is the probability of <unk> in that model
+    """
+
+    def __init__(self, first: ArpaModel, second: ArpaModel):
+        self.models = (first, second)
+        self.words = list(first.words) + [w for w in second.words if w not in first.vocab]
+        self.vocab = {w: i for i, w in enumerate(self.words)}
+        self.order = max(first.order, second.order)
+        # union word id -> word id of every model
+        self._ids = [m.encode(self.words) for m in self.models]
+        # the words a log-linear mixture normalizes over, <s> is never predicted
+        self.targets = np.asarray([i for i, w in enumerate(self.words) if w != BOS], dtype=np.int32)
+        # log normalizers computed so far, weight -> sorted histories (left-padded to order - 1 with -1)
+        # and their normalizers, weights computed together share the array of histories
+        self._normalizers: Dict[float, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def logprob(self, grams: np.ndarray) -> np.ndarray:
+        """
+        (2, rows) log10 p(w | h) of both models for rows [h..., w] of union word ids padded with -1
+        """
+        out = []
+        for model, ids in zip(self.models, self._ids):
+            out.append(model.logprob(np.where(grams >= 0, ids[np.maximum(grams, 0)], -1)))
+        return np.stack(out)
+
+    def log_normalizers(self, histories: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """
+        (weights, histories) log10 of sum_w p1(w | h) ** l * p2(w | h) ** (1 - l) for every weight l,
+        every history is evaluated once per weight, e.g. the sweep and mix() share their normalizers
+        """
+        width = self.order - 1
+        padded = np.full((len(histories), width), -1, dtype=np.int32)
+        padded[:, width - histories.shape[1]:] = histories
+        weights = [float(w) for w in weights]
+
+        out = np.full((len(weights), len(histories)), np.nan)
+        found = {}
+        for j, w in enumerate(weights):
+            if w in self._normalizers:
+                table, values = self._normalizers[w]
+                if id(table) not in found:
+                    found[id(table)] = lookup(table, padded)
+                idx = found[id(table)]
+                out[j, idx >= 0] = values[idx[idx >= 0]]
+        missing = np.flatnonzero(np.isnan(out).any(axis=0))
+        if len(missing) == 0:
+            return out
+        computed = self._log_normalizers(padded[missing], weights)
+        out[:, missing] = computed
+
+        new, first = np.unique(padded[missing], axis=0, return_index=True)
+        for j, w in enumerate(weights):
+            if w not in self._normalizers:
+                self._normalizers[w] = (new, computed[j, first])
+                continue
+            table, values = self._normalizers[w]
+            table, inverse = np.unique(np.concatenate([table, new]), axis=0, return_inverse=True)
+            merged = np.empty(len(table))
+            merged[inverse.reshape(-1)] = np.concatenate([values, computed[j, first]])
+            self._normalizers[w] = (table, merged)
+        return out
+
+    def _log_normalizers(self, histories: np.ndarray, weights: List[float]) -> np.ndarray:
+        width = histories.shape[1]
+        out = np.zeros((len(weights), len(histories)))
+        step = max(1, BATCH_CELLS // len(self.targets))
+        for i in range(0, len(histories), step):
+            batch = histories[i:i + step]
+            grams = np.empty((len(batch), len(self.targets), width + 1), dtype=np.int32)
+            grams[:, :, :width] = batch[:, None, :]
+            grams[:, :, width] = self.targets[None, :]
+            first, second = self.logprob(grams.reshape(-1, width + 1)).reshape(2, len(batch), -1)
+            for j, w in enumerate(weights):
+                out[j, i:i + step] = _logsumexp10(w * first + (1 - w) * second)
+        return out
+
+
+class TokenScores:
+    """
+    Per-token log10 probabilities of a text under both models of a mixture,
+    cached on disk by the hash of the models and of the text
+    """
+
+    def __init__(self, mixture: Mixture, sentences: List[str], paths: Tuple[Path, Path], cache_dir: Path):
+        h = hashlib.sha1()
+        for p in paths:
+            with Path(p).open("rb") as f:
+                while chunk := f.read(2 ** 20):
+                    h.update(chunk)
+        h.update("\n".join(sentences).encode())
+        self.path = Path(cache_dir) / f"{h.hexdigest()}.npz"
+
+        if self.path.exists():
+            with np.load(self.path) as cached:
+                self.histories = cached["histories"]
+                self.history = cached["history"]
+                self.scores = cached["scores"]
+            return
+
+        queries = arpa.queries(mixture.vocab, mixture.order, sentences)
+        # tokens sharing a history share the normalizer of a log-linear mixture
+        self.histories, self.history = np.unique(queries[:, :-1], axis=0, return_inverse=True)
+        self.history = self.history.reshape(-1)
+        self.scores = mixture.logprob(queries)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}")
+        with tmp.open("wb") as f:
+            np.savez(f, histories=self.histories, history=self.history, scores=self.scores)
+        tmp.replace(self.path)
+
+    def __len__(self):
+        return self.scores.shape[1]
+
+
+def sweep(mixture: Mixture, tokens: TokenScores, method: str, weights: np.ndarray) -> np.ndarray:
+    """
+    Perplexity of the mixture for every weight of the first model
+    """
+    first, second = tokens.scores
+    w = weights[:, None]
+    if method == "linear":
+        logp = _linear(first, second, w)
+    else:
+        logz = mixture.log_normalizers(tokens.histories, weights)
+        logp = w * first + (1 - w) * second - logz[:, tokens.history]
+    return np.power(10.0, -logp.mean(axis=1))
+
+
+def mix(mixture: Mixture, method: str, weight: float) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Backoff model of the mixture, with the n-grams of both models and backoffs
+    renormalized so that every history sums to one
+    """
+    tables = []
+    for n in range(1, mixture.order + 1):
+        grams = []
+        for model, ids in zip(mixture.models, mixture._ids):
+            if n <= model.order:
+                # model word id -> union word id
+                to_union = np.empty(len(model.words), dtype=np.int32)
+                to_union[ids] = np.arange(len(ids), dtype=np.int32)
+                grams.append(to_union[model.grams[n - 1]])
+        grams = _union(*grams)
+
+        first, second = mixture.logprob(grams)
+        if method == "linear":
+            logp = _linear(first, second, weight)
+        else:
+            histories, inverse = np.unique(grams[:, :-1], axis=0, return_inverse=True)
+            logz = mixture.log_normalizers(histories, np.asarray([weight]))[0]
+            logp = weight * first + (1 - weight) * second - logz[inverse.reshape(-1)]
+        if n == 1:
+            logp[grams[:, 0] == mixture.vocab[BOS]] = LOG_ZERO
+        tables.append((grams, np.maximum(logp, LOG_ZERO), np.zeros(len(grams))))
+
+    return recompute_backoffs(tables)
+
+
+def interpolate(first: Path, second: Path, sentences: List[str], methods: List[str] = None, steps: int = 101,
+                name: str = "adapted", out_dir: Path = Path("models"),
+                cache_dir: Path = Path("cache") / "interpolate") -> List[Path]:
+    """
+    Find the weight of the first model with the lowest perplexity on the sentences for every method,
+    and write the best mixture of the two models to <out_dir>/<n>gram_<name>_lm.arpa
+    (log-linear mixtures are named log_<name>)
+    """
+    methods = methods or METHODS
+    mixture = Mixture(ArpaModel.from_file(first), ArpaModel.from_file(second))
+
+    start = time.perf_counter()
+    tokens = TokenScores(mixture, sentences, (first, second), cache_dir)
+    print(f"{len(tokens)} tokens, {len(tokens.histories)} histories scored in {time.perf_counter() - start:.2f}s")
+    for model, path, ppl in zip(mixture.models, (first, second), np.power(10.0, -tokens.scores.mean(axis=1))):
+        print(f"{path}: perplexity {ppl:.2f}")
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for method in methods:
+        start = time.perf_counter()
+        weights = np.linspace(0, 1, steps)
+        ppl = sweep(mixture, tokens, method, weights)
+        best = int(np.argmin(ppl))
+        print(f"{method}: weight {weights[best]:.3f}, perplexity {ppl[best]:.2f} "
+              f"({steps} weights in {time.perf_counter() - start:.2f}s)")
+
+        path = out_dir / f"{mixture.order}gram_{'log_' if method == 'loglinear' else ''}{name}_lm.arpa"
+        write_arpa(path, mixture.words, mix(mixture, method, float(weights[best])))
+        print(f"[DONE] {path}")
+        paths.append(path)
+    return paths
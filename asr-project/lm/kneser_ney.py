@@ -0,0 +1,104 @@
+from typing import List, Tuple
+
+import numpy as np
+
+from .counts import UNK, NgramCounter, lookup
+
+# log10 probability written for events which never happen, e.g. predicting <s>
+LOG_ZERO = -99.0
+
+
+def discounts(adjusted: np.ndarray) -> np.ndarray:
+    """
+    Modified Kneser-Ney discounts D1, D2 and D3+ estimated from the count-of-counts (Chen & Goodman),
+    a discount is clipped to [0, r] when there are too few n-grams for a sensible estimate
+    """
+    n = [np.count_nonzero(adjusted == r) for r in range(1, 5)]
+    y = n[0] / (n[0] + 2 * n[1]) if n[0] + n[1] else 0.0
+    d = [r - (r + 1) * y * n[r] / n[r - 1] if n[r - 1] else 0.0 for r in range(1, 4)]
+    return np.clip(d, 0.0, [1.0, 2.0, 3.0])
+
+
+def _log10(x: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore"):
+        return np.maximum(np.log10(x), LOG_ZERO)
+
+
+def estimate(counter: NgramCounter, order: int) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Estimate an interpolated modified Kneser-Ney model of the given order from the counts,
+    returns a (n-grams, log10 probabilities, log10 backoffs) table for every order, the backoffs
+    of the highest order are None
+    """
+    bos = counter.bos
+    raw = [counter.counts(n) for n in range(1, order + 1)]
+
+    # adjusted counts: raw counts for the highest order and for n-grams starting with <s>,
+    # the number of distinct left extensions for everything else
+    adjusted = []
+    for n in range(1, order + 1):
+        grams, counts = raw[n - 1]
+        if n == order:
+            adjusted.append(counts.astype(np.float64))
+            continue
+        suffixes, extensions = np.unique(raw[n][0][:, 1:], axis=0, return_counts=True)
+        idx = lookup(suffixes, grams)
+        cont = np.where(idx >= 0, extensions[np.maximum(idx, 0)], 0)
+        adjusted.append(np.where(grams[:, 0] == bos, counts, cont).astype(np.float64))
+
+    unk = counter.vocab[UNK]
+    unk_seen = bool(np.any(raw[0][0][:, 0] == unk))
+    # the unigrams are interpolated with the uniform distribution over the vocabulary, <s> excluded
+    vocab_size = len(raw[0][0]) + (0 if unk_seen else 1)
+
+    probs = []
+    gammas = []
+    for n in range(1, order + 1):
+        grams = raw[n - 1][0]
+        a = adjusted[n - 1]
+        d = discounts(a)
+        bucket = np.minimum(a, 3).astype(np.int64) - 1
+        if n == 1:
+            contexts = np.zeros((1, 0), dtype=np.int32)
+            ctx = np.zeros(len(grams), dtype=np.int64)
+        else:
+            contexts, ctx = np.unique(grams[:, :-1], axis=0, return_inverse=True)
+            ctx = ctx.reshape(-1)
+
+        total = np.bincount(ctx, weights=a, minlength=len(contexts))
+        discounted = np.bincount(ctx, weights=d[bucket], minlength=len(contexts))
+        gamma = discounted / total
+
+        if n == 1:
+            lower = np.full(len(grams), 1.0 / vocab_size)
+        else:
+            lower = probs[n - 2][lookup(raw[n - 2][0], grams[:, 1:])]
+        probs.append((a - d[bucket]) / total[ctx] + gamma[ctx] * lower)
+        gammas.append((contexts, gamma))
+
+    tables = []
+    for n in range(1, order + 1):
+        grams = raw[n - 1][0]
+        logp = _log10(probs[n - 1])
+        logbow = None
+        if n < order:
+            contexts, gamma = gammas[n]
+            idx = lookup(contexts, grams)
+            logbow = np.where(idx >= 0, _log10(gamma[np.maximum(idx, 0)]), 0.0)
+        if n == 1:
+            # <s> is never predicted but keeps the backoff of its context, <unk> takes its share
+            # of the uniform distribution when it was not seen
+            extra = [bos] + ([] if unk_seen else [unk])
+            extra_p = [LOG_ZERO] + ([] if unk_seen else [_log10(gammas[0][1][0] / vocab_size)])
+            grams = np.concatenate([grams, np.asarray(extra, dtype=np.int32)[:, None]])
+            logp = np.concatenate([logp, extra_p])
+            if logbow is not None:
+                idx = lookup(gammas[1][0], np.asarray([[bos]], dtype=np.int32))[0]
+                extra_bow = [_log10(gammas[1][1][idx]) if idx >= 0 else 0.0] + ([] if unk_seen else [0.0])
+                logbow = np.concatenate([logbow, extra_bow])
+            # back in order, the tables are looked up by binary search
+            rank = np.argsort(grams[:, 0], kind="stable")
+            grams, logp = grams[rank], logp[rank]
+            logbow = logbow[rank] if logbow is not None else None
+        tables.append((grams, logp, logbow))
+    return tables
@@ -0,0 +1,179 @@
+import json
+from pathlib import Path
+from typing import Iterable, List, Optional, Set
+
+import numpy as np
+
+from .arpa import ArpaModel, recompute_backoffs, write_arpa
+from .counts import BOS, EOS, UNK, lookup
+
+# tokens of the acoustic model vocabulary which are not characters of words
+WORD_DELIMITER = "|"
+SPECIAL = {"<pad>", "<s>", "</s>", "<unk>"}
+
+
+def decoder_charset(vocab_json: Path) -> Set[str]:
+    """
+    Characters the CTC decoder can emit, from the vocab.json written by the evaluator's tokenizer
+    """
+    with Path(vocab_json).open() as f:
+        labels = json.load(f)
+    return {c for c in labels if c not in SPECIAL and c != WORD_DELIMITER}
+
+
+def in_domain_words(sentences: Iterable[str], wordlist: Optional[Path] = None,
+                    charset: Optional[Set[str]] = None) -> Set[str]:
+    """
+    Words of the sentences and of the optional wordlist (one word per line), without
+    the words the decoder cannot spell
+    """
+    words = {w for s in sentences for w in s.split()}
+    if wordlist is not None:
+        with Path(wordlist).open() as f:
+            words.update(w.strip().lower() for w in f if w.strip())
+    if charset is not None:
+        words = {w for w in words if set(w) <= charset}
+    return words - {BOS, EOS, UNK}
+
+
+def restrict_vocabulary(model: ArpaModel, keep: Set[str]) -> ArpaModel:
+    """
+    Drop every n-gram with a word outside of keep, the unigram probability of the dropped words
+    goes to <unk> and the backoffs are recomputed
+    """
+    kept = np.asarray([w in keep or w in (BOS, EOS, UNK) for w in model.words])
+    words = [w for w, k in zip(model.words, kept) if k]
+    remap = np.where(kept, np.cumsum(kept) - 1, -1).astype(np.int32)
+
+    tables = []
+    for grams, logp, logbow in zip(model.grams, model.logp, model.logbow):
+        rows = np.all(kept[grams], axis=1)
+        tables.append((remap[grams[rows]], logp[rows].copy(), logbow[rows]))
+
+    unigrams, logp, _ = tables[0]
+    unk = lookup(unigrams, np.asarray([[words.index(UNK)]], dtype=np.int32))[0]
+    dropped = np.power(10.0, model.logp[0][~kept[model.grams[0][:, 0]]]).sum()
+    logp[unk] = np.log10(np.power(10.0, logp[unk]) + dropped)
+    return ArpaModel(words, [(g, p, b if b is not None else np.zeros(len(g)))
+                             for g, p, b in recompute_backoffs(tables)])
+
+
+def log_history_probability(model: ArpaModel, histories: np.ndarray) -> np.ndarray:
+    """
+    log10 p(h) of every history by the chain rule, a leading <s> is given
+    """
+    result = np.zeros(len(histories))
+    bos = model.vocab[BOS]
+    width = histories.shape[1]
+    for i in range(width):
+        rows = np.full((len(histories), width), -1, dtype=np.int32)
+        rows[:, width - i - 1:] = histories[:, :i + 1]
+        given = (i == 0) & (histories[:, 0] == bos)
+        result += np.where(given, 0.0, model.logprob(rows))
+    return result
+
+
+def prune_scores(model: ArpaModel, n: int) -> np.ndarray:
+    """
+    Weighted difference of every n-gram hw (n >= 2), p(hw) * |log p(w | h) - log bow(h) p(w | h')|,
+    the loss of likelihood when the n-gram is replaced by its backoff estimate
+    """
+    grams, logp = model.grams[n - 1], model.logp[n - 1]
+    histories = lookup(model.grams[n - 2], grams[:, :-1])
+    logbow = np.where(histories >= 0, model.logbow[n - 2][np.maximum(histories, 0)], 0.0)
+    backed = logbow + model.logprob(grams[:, 1:])
+    joint = log_history_probability(model, grams[:, :-1]) + logp
+    return np.power(10.0, joint) * np.abs(logp - backed)
+
+
+def _closure(model: ArpaModel, keep: List[np.ndarray]) -> List[np.ndarray]:
+    """
+    The kept n-grams with the prefix and suffix of every kept n-gram
+    """
+    keep = [k.copy() for k in keep]
+    # highest order first, so that the contexts of kept n-grams propagate down
+    for n in range(model.order, 1, -1):
+        grams = model.grams[n - 1][keep[n - 1]]
+        for part in (grams[:, :-1], grams[:, 1:]):
+            idx = lookup(model.grams[n - 2], part)
+            keep[n - 2][idx[idx >= 0]] = True
+    return keep
+
+
+def prune(model: ArpaModel, size: int) -> ArpaModel:
+    """
+    Keep the n-grams of order >= 2 with the highest weighted difference, together with the prefix and
+    suffix of every kept n-gram, so that the model has at most size n-grams (unigrams are always kept)
+
+    Equal scores are ranked by order and then by row, so the same model is pruned the same way every time.
+    """
+    scores = [prune_scores(model, n) for n in range(2, model.order + 1)]
+    unigrams = len(model.grams[0])
+    flat = np.concatenate(scores) if scores else np.zeros(0)
+    orders = np.concatenate([np.full(len(s), n) for n, s in enumerate(scores, 2)]) if scores else np.zeros(0)
+    rows = np.concatenate([np.arange(len(s)) for s in scores]) if scores else np.zeros(0)
+    rank = np.lexsort((rows, orders, -flat))
+    offsets = np.cumsum([0] + [len(s) for s in scores])
+
+    def kept(k: int) -> List[np.ndarray]:
+        chosen = np.zeros(len(flat), dtype=bool)
+        chosen[rank[:k]] = True
+        return _closure(model, [np.ones(unigrams, dtype=bool)] +
+                        [chosen[offsets[i]:offsets[i + 1]] for i in range(len(scores))])
+
+    # the closure only adds n-grams, so the model grows with k, find the largest k which fits
+    low, high = 0, min(max(size - unigrams, 0), len(flat))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if sum(int(k.sum()) for k in kept(mid)) <= size:
+            low = mid
+        else:
+            high = mid - 1
+    keep = kept(low)
+    if unigrams > size:
+        print(f"{size} n-grams is less than the {unigrams} unigrams, only those are kept")
+
+    tables = [(g[k], p[k], b[k]) for g, p, b, k in zip(model.grams, model.logp, model.logbow, keep)]
+    return ArpaModel(model.words, [(g, p, b if b is not None else np.zeros(len(g)))
+                                   for g, p, b in recompute_backoffs(tables)])
+
+
+def _oov_rate(model: ArpaModel, sentences: List[str]) -> float:
+    words = [w for s in sentences for w in s.split()]
+    return sum(w not in model.vocab for w in words) / len(words) if words else 0.0
+
+
+def prune_model(path: Path, sentences: Iterable[str], heldout: List[str], sizes: List[int],
+                wordlist: Optional[Path] = None, labels: Optional[Path] = None, name: str = "pruned",
+                out_dir: Path = Path("models")) -> List[Path]:
+    """
+    Restrict an ARPA model to the in-domain vocabulary, prune it to every size and write the models
+    to <out_dir>/<n>gram_<name>_lm.arpa (<name>_<size> when there are several sizes),
+    reporting the perplexity on the held-out sentences against the number of n-grams
+    """
+    model = ArpaModel.from_file(path)
+    charset = decoder_charset(labels) if labels is not None else None
+    restricted = restrict_vocabulary(model, in_domain_words(sentences, wordlist, charset))
+
+    print(f"{'model':>40} {'n-grams':>10} {'size':>9} {'OOV':>6} {'perplexity':>11}")
+    base = model.perplexity(heldout)
+
+    def report(label, m, size=None):
+        ppl = m.perplexity(heldout)
+        size = f"{size / 2 ** 20:7.2f}MB" if size is not None else ""
+        print(f"{label:>40} {sum(map(len, m.grams)):>10} {size:>9} {100 * _oov_rate(m, heldout):5.1f}% "
+              f"{ppl:11.2f} ({100 * (ppl / base - 1):+.1f}%)")
+
+    report(str(path), model, Path(path).stat().st_size)
+    report("in-domain vocabulary", restricted)
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for size in sorted(sizes, reverse=True):
+        pruned = prune(restricted, size)
+        suffix = f"_{size}" if len(sizes) > 1 else ""
+        out = out_dir / f"{pruned.order}gram_{name}{suffix}_lm.arpa"
+        write_arpa(out, pruned.words, pruned.tables())
+        report(str(out), pruned, out.stat().st_size)
+        paths.append(out)
+    return paths
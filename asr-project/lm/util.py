@@ -0,0 +1,38 @@
+from pathlib import Path
+from typing import Iterable, Iterator, List
+
+from .arpa import write_arpa
+from .counts import NgramCounter
+from .kneser_ney import estimate
+
+
+def read_corpus(paths: Iterable[Path]) -> Iterator[str]:
+    """
+    Stream the lines of text files, one sentence per line
+    """
+    for p in paths:
+        with Path(p).open() as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+
+def train(sentences: Iterable[str], orders: List[int], name: str, out_dir: Path = Path("models")) -> List[Path]:
+    """
+    Count the sentences once and write a modified Kneser-Ney ARPA model of every requested order
+    to <out_dir>/<n>gram_<name>_lm.arpa
+    """
+    if min(orders) < 2:
+        # the unigrams are still estimated, as part of every higher order model
+        raise ValueError("KenLM (and so both decoders) cannot load a 1-gram model, the lowest order is 2")
+    counter = NgramCounter(max(orders)).add_all(sentences)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    paths = []
+    for n in sorted(orders):
+        path = out_dir / f"{n}gram_{name}_lm.arpa"
+        tables = estimate(counter, n)
+        write_arpa(path, counter.words, tables)
+        print(f"{path}: " + ", ".join(f"{len(t[0])} {i}-grams" for i, t in enumerate(tables, 1)))
+        paths.append(path)
+    return paths
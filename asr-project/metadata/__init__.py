@@ -1,3 +1,6 @@
 from .dataset import DataSet
+from .features import NORMALIZATIONS, FeatureStore
 from .interval import Interval
+from .table import IntervalTable
 from .util import generate, sentences, test
+from .vad import VAD
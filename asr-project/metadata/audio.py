@@ -0,0 +1,84 @@
+from functools import lru_cache
+from math import gcd
+from pathlib import Path
+
+import numpy as np
+
+SAMPLING_RATE = 16000
+
+
+def _mono(audio: np.ndarray) -> np.ndarray:
+    return audio.mean(axis=1) if audio.shape[1] > 1 else audio[:, 0]
+
+
+def _ratio(source_rate: int, target_rate: int) -> (int, int):
+    """
+    Reduced (up, down) factors of the polyphase resampler
+    """
+    div = gcd(source_rate, target_rate)
+    return target_rate // div, source_rate // div
+
+
+def read_frames(f, start: int, end: int, sampling_rate: int = SAMPLING_RATE) -> np.ndarray:
+    """
+    Samples [start:end) at sampling_rate of an open soundfile.SoundFile, only the frames of the range
+    and the context of the resampling filter are decoded, the result is the same slice of the whole
+    file resampled to sampling_rate
+    """
+    if f.samplerate == sampling_rate:
+        f.seek(min(start, f.frames))
+        return _mono(f.read(max(end - start, 0), dtype="float32", always_2d=True))
+
+    from scipy.signal import resample_poly
+
+    up, down = _ratio(f.samplerate, sampling_rate)
+    # read some context around the range for the resampling filter (resample_poly uses
+    # 10 zero crossings), and start on a multiple of `down` so that the output stays aligned
+    # with the resampled whole file
+    context = 10 * -(-max(up, down) // up) + down
+    src_start = max(start * down // up - context, 0) // down * down
+    src_end = min(-(-end * down // up) + context, f.frames)
+    f.seek(src_start)
+    audio = _mono(f.read(max(src_end - src_start, 0), dtype="float32", always_2d=True))
+
+    offset = src_start * up // down
+    return resample_poly(audio, up, down).astype(np.float32)[start - offset:end - offset]
+
+
+def read_audio(path: Path, start_time: float, end_time: float, sampling_rate: int = SAMPLING_RATE) -> np.ndarray:
+    """
+    Read the frames between start_time and end_time of an audio file without decoding the rest of it,
+    the returned frames are the same as the slice [int(start_time * sr):int(end_time * sr)] of the whole
+    file resampled to sampling_rate
+    """
+    # imported here, so that commands which never read audio do not pay for them
+    import soundfile
+
+    with soundfile.SoundFile(str(path)) as f:
+        return read_frames(f, int(start_time * sampling_rate), int(end_time * sampling_rate), sampling_rate)
+
+
+def decode_audio(file, sampling_rate: int = SAMPLING_RATE) -> np.ndarray:
+    """
+    Decode a whole audio file, a path or a file object (e.g. an upload in a BytesIO), to mono float32
+    at sampling_rate, resampled with the same polyphase filter as read_frames
+    """
+    import soundfile
+    from scipy.signal import resample_poly
+
+    audio, rate = soundfile.read(file if hasattr(file, "read") else str(file), dtype="float32", always_2d=True)
+    audio = _mono(audio)
+    if rate != sampling_rate:
+        audio = resample_poly(audio, *_ratio(rate, sampling_rate)).astype(np.float32)
+    return audio
+
+
+@lru_cache(maxsize=2)
+def load_audio(path: Path, sampling_rate: int = SAMPLING_RATE) -> np.ndarray:
+    """
+    Decode a whole audio file, only the most recently used files are kept in memory
+    """
+    audio = decode_audio(path, sampling_rate)
+    # the buffer is shared by every caller of the cache
+    audio.flags.writeable = False
+    return audio
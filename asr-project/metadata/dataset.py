@@ -1,30 +1,74 @@
+import multiprocessing
+import os
+import pickle
 from pathlib import Path
 from typing import List
 
+from .table import IntervalTable
 from .transcript import Transcript
 
 
+def _parse(path: Path) -> dict:
+    return Transcript.from_file(path).to_dict()
+
+
 class DataSet:
     """
     Represents the entire dataset, consisting of individual transcripts
+
+    Parsed transcripts are kept in a binary index, which is used instead of the TextGrid files
+    for as long as none of them and none of the audio files changed
     """
-    _transcripts = []
+    INDEX_VERSION = 1
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, workers: int = None, index: Path = Path("cache") / "transcripts.idx"):
         self._transcripts_path = path / "transcripts"
         self._audio_path = path / "audio"
+        self._index = index
 
-        for p in self._transcripts_path.glob("*.TextGrid"):
-            self._transcripts.append(Transcript.from_file(p))
-            # tr = Transcript.from_file(p)
-            # tr.save()
-            # del tr
+        paths = sorted(self._transcripts_path.glob("*.TextGrid"))
+        # the parsed transcripts hold the path of their audio, which changes with the audio files
+        audio = sorted(self._audio_path.glob("*.wav"))
+        signature = [(str(p.resolve()), p.stat().st_size, p.stat().st_mtime_ns) for p in paths + audio]
+
+        dcts = self.__load_index(signature)
+        if dcts is None:
+            with multiprocessing.Pool(workers) as pool:
+                dcts = pool.map(_parse, paths)
+            self.__save_index(signature, dcts)
+
+        self._transcripts = [Transcript.from_dict(d) for d in dcts]
 
         # audio_dataset = Dataset.from_dict({
         #     "audio": [str(p) for p in self._audio_path.glob("*.wav")]
         # }).cast_column("audio", Audio())
         # print(audio_dataset[0])
 
+    def __load_index(self, signature: list):
+        if self._index is None or not self._index.exists():
+            return None
+
+        with self._index.open("rb") as f:
+            index = pickle.load(f)
+        if index["version"] != self.INDEX_VERSION or index["signature"] != signature:
+            return None
+        return index["transcripts"]
+
+    def __save_index(self, signature: list, dcts: List[dict]):
+        if self._index is None:
+            return
+
+        self._index.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._index.with_suffix(".tmp")
+        with tmp.open("wb") as f:
+            pickle.dump({"version": self.INDEX_VERSION, "signature": signature, "transcripts": dcts}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._index)
+
     @property
     def transcripts(self) -> List[Transcript]:
         return self._transcripts
+
+    @property
+    def table(self) -> IntervalTable:
+        return IntervalTable.from_transcripts(self._transcripts)
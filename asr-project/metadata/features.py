@@ -0,0 +1,120 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+from .audio import SAMPLING_RATE, decode_audio
+from .manifest import file_digest
+
+NORMALIZATIONS = ["none", "dc", "peak"]
+
+
+def normalize(audio: np.ndarray, method: str = "none") -> np.ndarray:
+    """
+    Recording level normalization, dc removes the mean and peak also scales the loudest sample to 1
+    """
+    if method == "none":
+        return audio
+    if method not in NORMALIZATIONS:
+        raise ValueError(f"unknown normalization {method!r}, expected one of {', '.join(NORMALIZATIONS)}")
+    audio = audio - audio.mean(dtype=np.float64).astype(np.float32)
+    if method == "peak":
+        peak = np.abs(audio).max(initial=0.0)
+        if peak > 0:
+            audio /= peak
+    return audio
+
+
+class FeatureStore:
+    """
+    On-disk store of whole source recordings, resampled once and normalized, keyed by
+    (hash of the source file, sampling rate, normalization)
+
+    Every recording is one .npy file which is memory-mapped back, so intervals are zero-copy views
+    of it. index.json maps the stem of every ingested recording to its entry, which lets consumers
+    that only know the interval file names (e.g. the rows of the huggingface dataset) find the audio.
+    """
+
+    def __init__(self, root: Path = Path("cache") / "features", sampling_rate: int = SAMPLING_RATE,
+                 normalization: str = "none"):
+        if normalization not in NORMALIZATIONS:
+            raise ValueError(f"unknown normalization {normalization!r}, expected one of {', '.join(NORMALIZATIONS)}")
+        self.root = Path(root)
+        self.sampling_rate = sampling_rate
+        self.normalization = normalization
+        self._index = None
+
+    @property
+    def config(self) -> str:
+        return f"{self.sampling_rate}-{self.normalization}"
+
+    def path(self, digest: str) -> Path:
+        return self.root / f"{digest[:16]}-{self.config}.npy"
+
+    def _load_index(self) -> Dict[str, dict]:
+        try:
+            with (self.root / "index.json").open() as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @property
+    def index(self) -> Dict[str, str]:
+        """
+        Stem -> entry file name of the recordings ingested with this configuration
+        """
+        if self._index is None:
+            self._index = self._load_index().get(self.config, {})
+        return self._index
+
+    def ingest(self, path: Path, digest: Optional[str] = None) -> Path:
+        """
+        Resample a recording with the polyphase filter and store it, unless it already is,
+        returns the path of its entry
+        """
+        digest = digest or file_digest(path)
+        out = self.path(digest)
+        if out.exists():
+            return out
+
+        # the same filter as read_audio, so that both give the same samples
+        audio = normalize(decode_audio(path, self.sampling_rate), self.normalization)
+
+        out.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, so that an interrupted run never leaves a truncated entry
+        tmp = out.with_suffix(f".{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            np.save(f, audio)
+        os.replace(tmp, out)
+        return out
+
+    def register(self, entries: Dict[str, Path]):
+        """
+        Record the entries of recordings by their stem, e.g. day1_consultation01_doctor
+        """
+        index = self._load_index()
+        index.setdefault(self.config, {}).update({stem: Path(path).name for stem, path in entries.items()})
+        self._index = index[self.config]
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f"index.{os.getpid()}.tmp"
+        with tmp.open("w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp, self.root / "index.json")
+
+    def __getitem__(self, stem: str) -> np.ndarray:
+        name = self.index.get(stem)
+        if name is None or not (self.root / name).exists():
+            raise KeyError(stem)
+        return np.load(self.root / name, mmap_mode="r")
+
+    def __contains__(self, stem: str) -> bool:
+        try:
+            self[stem]
+        except KeyError:
+            return False
+        return True
+
+    def __str__(self):
+        return f"FeatureStore(sampling_rate={self.sampling_rate}, normalization={self.normalization}, path={self.root})"
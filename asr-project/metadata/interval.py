@@ -2,10 +2,11 @@ import re
 from pathlib import Path
 from typing import TYPE_CHECKING
 
-import soundfile
-from textgrid import Interval as ForeignInterval
+from .audio import SAMPLING_RATE
 
 if TYPE_CHECKING:
+    from textgrid import Interval as ForeignInterval
+
     from .transcript import Transcript
 
 
@@ -26,7 +27,7 @@ class Interval:
         return f"Interval(tr_sid={self._transcript.sid}, n={self.n}, '{self.text}')"
 
     @classmethod
-    def from_raw_interval(cls, transcript: "Transcript", n: int, interval: ForeignInterval) -> "Interval":
+    def from_raw_interval(cls, transcript: "Transcript", n: int, interval: "ForeignInterval") -> "Interval":
         tmp = cls()
         tmp._transcript = transcript
         tmp.n = n
@@ -37,6 +38,35 @@ class Interval:
         #     tmp.audio = transcript.audio[0]["audio"]["array"][int(tmp.start_time * 16000):int(tmp.end_time * 16000)]
         return tmp
 
+    @classmethod
+    def from_values(cls, transcript: "Transcript", n: int, start_time: float, end_time: float,
+                    text: str) -> "Interval":
+        """
+        Build an interval from already normalized values, e.g. from a pre-processed index
+        """
+        tmp = cls()
+        tmp._transcript = transcript
+        tmp.n = n
+        tmp.start_time = start_time
+        tmp.end_time = end_time
+        tmp.text = text
+        return tmp
+
+    def to_tuple(self) -> tuple:
+        return self.n, self.start_time, self.end_time, self.text
+
+    @property
+    def transcript(self) -> "Transcript":
+        return self._transcript
+
+    @property
+    def fname(self) -> str:
+        return f"{Path(self._transcript.fname).stem}_{self.n}.wav"
+
+    @property
+    def audio_path(self) -> Path:
+        return self._transcript.audio_path
+
     @property
     def sid(self) -> str:
         tr = self._transcript
@@ -44,12 +74,13 @@ class Interval:
         return f"{tr.sid}:{self.start_time}:{self.end_time}"
 
     def save(self, path: Path) -> (Path, str):
-        if self._transcript.audio is None:
+        if self._transcript.audio_path is None:
             return Path(), ""
 
-        newname = (path / self._transcript.fname)
-        newname = newname.with_stem(f"{newname.stem}_{self.n}").with_suffix(".wav")
+        newname = path / self.fname
+
+        import soundfile
 
-        audio = self._transcript.audio[int(self.start_time * 16000):int(self.end_time * 16000)]
-        soundfile.write(newname, audio, samplerate=16000)
+        audio = self._transcript.read(self.start_time, self.end_time)
+        soundfile.write(newname, audio, samplerate=SAMPLING_RATE)
         return newname, self.text
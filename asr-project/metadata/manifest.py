@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha1()
+    with Path(path).open("rb") as f:
+        while chunk := f.read(2 ** 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Manifest:
+    """
+    Records what a generated dataset was built from, a hash of every source file and,
+    for every exported interval, the key of its audio and the shard holding it
+    """
+
+    VERSION = 3
+
+    def __init__(self, path: Path, settings: dict = None):
+        self._path = path
+        self.settings = settings or {}
+        # str(path) -> {"size", "mtime_ns", "sha1"}
+        self.sources = {}
+        # interval file name -> {"split", "shard", "key", "size", "start_time", "end_time", "speech"},
+        # speech is False for intervals exported whole because the VAD found no speech in them
+        self.intervals = {}
+        # split -> list of shard file names
+        self.shards = {}
+
+    @classmethod
+    def load(cls, path: Path) -> "Manifest":
+        tmp = cls(path)
+        if not path.exists():
+            return tmp
+
+        with path.open() as f:
+            dct = json.load(f)
+        if dct.get("version") != cls.VERSION:
+            return tmp
+
+        tmp.settings = dct["settings"]
+        tmp.sources = dct["sources"]
+        tmp.intervals = dct["intervals"]
+        tmp.shards = dct["shards"]
+        return tmp
+
+    def save(self):
+        tmp = self._path.with_suffix(".tmp")
+        with tmp.open("w") as f:
+            json.dump({
+                "version": self.VERSION,
+                "settings": self.settings,
+                "sources": self.sources,
+                "intervals": self.intervals,
+                "shards": self.shards,
+            }, f)
+        os.replace(tmp, self._path)
+
+    def digest(self, path: Path) -> str:
+        """
+        Hash of a source file, only recomputed when its size or modification time changed
+        """
+        st = path.stat()
+        rec = self.sources.get(str(path))
+        if rec is None or rec["size"] != st.st_size or rec["mtime_ns"] != st.st_mtime_ns:
+            rec = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": file_digest(path)}
+            self.sources[str(path)] = rec
+        return rec["sha1"]
@@ -0,0 +1,46 @@
+import contextlib
+import gzip
+import io
+import os
+import tarfile
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+
+
+def member_size(n_bytes: int) -> int:
+    """
+    Space taken by a file in a tar archive, a 512 B header plus the data padded to 512 B blocks
+    """
+    return 512 + -(-n_bytes // 512) * 512
+
+
+def shard_name(prefix: str, n: int, compress: bool = False) -> str:
+    return f"{prefix}-{n:05d}{'.tar.gz' if compress else '.tar'}"
+
+
+def shard_index(name: str) -> int:
+    return int(name.split(".")[0].rsplit("-", 1)[1])
+
+
+def read_shard(path: Path) -> Dict[str, bytes]:
+    with tarfile.open(path) as tar:
+        return {m.name: tar.extractfile(m).read() for m in tar if m.isfile()}
+
+
+def write_shard(path: Path, members: Iterable[Tuple[str, bytes]], compress: bool = False):
+    """
+    Write in-memory files into a tar shard, the shard is replaced only once it is complete
+
+    The members and the gzip header get a fixed mtime (and no file name), so that writing
+    the same members again gives the same bytes
+    """
+    tmp = path.with_name(f".{path.name}.tmp")
+    with tmp.open("wb") as f, (gzip.GzipFile(filename="", fileobj=f, mode="wb", mtime=0) if compress
+                               else contextlib.nullcontext(f)) as out:
+        with tarfile.open(fileobj=out, mode="w") as tar:
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = 0
+                tar.addfile(info, io.BytesIO(data))
+    os.replace(tmp, path)
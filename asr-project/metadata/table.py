@@ -0,0 +1,146 @@
+from typing import Iterator, List, Sequence, Union
+
+import numpy as np
+
+from .audio import SAMPLING_RATE
+from .interval import Interval
+from .transcript import Transcript
+
+
+def _pack(strings: Sequence[str]) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Encode strings into one byte buffer, returns the buffer and the start and end offsets of each string
+    """
+    encoded = [s.encode() for s in strings]
+    lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+    end = np.cumsum(lengths)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), end - lengths, end
+
+
+def _ranges(start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """
+    Indices of every [start, end) range, concatenated
+    """
+    lengths = end - start
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(start - offsets, lengths) + np.arange(lengths.sum())
+
+
+def _lines(*columns) -> bytes:
+    """
+    Join the rows of the columns into lines, every column is either a constant bytes
+    or a (buffer, start, end) tuple of packed strings
+    """
+    n_rows = next(len(c[1]) for c in columns if not isinstance(c, bytes))
+    lengths = np.zeros(n_rows, dtype=np.int64)
+    for c in columns:
+        lengths += len(c) if isinstance(c, bytes) else c[2] - c[1]
+
+    out = np.empty(lengths.sum(), dtype=np.uint8)
+    pos = np.cumsum(lengths) - lengths
+    for c in columns:
+        if isinstance(c, bytes):
+            out[pos[:, None] + np.arange(len(c))] = np.frombuffer(c, dtype=np.uint8)
+            pos = pos + len(c)
+        else:
+            buffer, start, end = c
+            out[_ranges(pos, pos + (end - start))] = buffer[_ranges(start, end)]
+            pos = pos + (end - start)
+    return out.tobytes()
+
+
+class IntervalTable:
+    """
+    Columnar table of intervals, every field is a NumPy array and all texts are kept
+    in one packed UTF-8 buffer addressed by start and end offsets
+
+    Selecting rows (slicing, shuffling, filtering) shares the text buffer and the transcripts
+    """
+
+    def __init__(self, transcripts: List[Transcript], transcript: np.ndarray, n: np.ndarray,
+                 start_time: np.ndarray, end_time: np.ndarray, text: np.ndarray,
+                 text_start: np.ndarray, text_end: np.ndarray):
+        self._transcripts = transcripts
+        self.transcript = transcript
+        self.n = n
+        self.start_time = start_time
+        self.end_time = end_time
+        self._text = text
+        self.text_start = text_start
+        self.text_end = text_end
+
+    @classmethod
+    def from_transcripts(cls, transcripts: List[Transcript]) -> "IntervalTable":
+        values = [tr.interval_values() for tr in transcripts]
+        counts = [len(v) for v in values]
+        rows = [it for v in values for it in v]
+
+        text, text_start, text_end = _pack([it[3] for it in rows])
+        return cls(
+            transcripts=transcripts,
+            transcript=np.repeat(np.arange(len(transcripts), dtype=np.int32), counts),
+            n=np.fromiter((it[0] for it in rows), dtype=np.int32, count=len(rows)),
+            start_time=np.fromiter((it[1] for it in rows), dtype=np.float64, count=len(rows)),
+            end_time=np.fromiter((it[2] for it in rows), dtype=np.float64, count=len(rows)),
+            text=text, text_start=text_start, text_end=text_end,
+        )
+
+    @property
+    def transcripts(self) -> List[Transcript]:
+        return self._transcripts
+
+    @property
+    def start_sample(self) -> np.ndarray:
+        return (self.start_time * SAMPLING_RATE).astype(np.int64)
+
+    @property
+    def end_sample(self) -> np.ndarray:
+        return (self.end_time * SAMPLING_RATE).astype(np.int64)
+
+    def __len__(self):
+        return len(self.n)
+
+    def __getitem__(self, idx: Union[slice, np.ndarray]) -> "IntervalTable":
+        """
+        Select rows by a slice, an index array or a boolean mask
+        """
+        return IntervalTable(self._transcripts, self.transcript[idx], self.n[idx], self.start_time[idx],
+                             self.end_time[idx], self._text, self.text_start[idx], self.text_end[idx])
+
+    def non_empty(self) -> "IntervalTable":
+        """
+        Rows with some text left after normalization
+        """
+        return self[self.text_end > self.text_start]
+
+    def text(self, i: int) -> str:
+        return self._text[self.text_start[i]:self.text_end[i]].tobytes().decode()
+
+    def texts(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self.text(i)
+
+    def sids(self) -> List[str]:
+        prefixes = [tr.sid for tr in self._transcripts]
+        return [f"{prefixes[t]}:{s}:{e}"
+                for t, s, e in zip(self.transcript.tolist(), self.start_time.tolist(), self.end_time.tolist())]
+
+    def sentence_lines(self) -> bytes:
+        """
+        Every text as a '<s> text </s>' line
+        """
+        return _lines(b"<s> ", (self._text, self.text_start, self.text_end), b" </s>\n")
+
+    def sid_lines(self) -> bytes:
+        """
+        Every text as a 'sid<TAB>text' line
+        """
+        return _lines(_pack(self.sids()), b"\t", (self._text, self.text_start, self.text_end), b"\n")
+
+    def intervals(self) -> List[Interval]:
+        """
+        Interval objects of the rows, for consumers working on single intervals
+        """
+        return [Interval.from_values(self._transcripts[t], n, s, e, self.text(i))
+                for i, (t, n, s, e) in enumerate(zip(self.transcript.tolist(), self.n.tolist(),
+                                                     self.start_time.tolist(), self.end_time.tolist()))]
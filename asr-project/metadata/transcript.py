@@ -1,12 +1,13 @@
 import re
 from pathlib import Path
-from typing import List
-
-from datasets import Audio, Dataset
-from textgrid import TextGrid, IntervalTier
+from typing import TYPE_CHECKING, List
 
+from .audio import load_audio, read_audio
 from .interval import Interval
 
+if TYPE_CHECKING:
+    from textgrid import IntervalTier
+
 
 class Transcript:
     """
@@ -32,9 +33,9 @@ class Transcript:
     __path_re_keys = ["day", "consultation_n", "doctor"]
 
     _path: Path
-    _intervals: List[Interval]
-    __a = Audio(sampling_rate=16000)
-    __cache = None
+    _intervals: List[Interval] = None
+    # (n, start_time, end_time, text) of every interval, when loaded from a pre-processed index
+    _values: List[tuple] = None
 
     day: int
     consultation_n: int
@@ -48,51 +49,93 @@ class Transcript:
         self.is_doctor = doctor
 
     def save(self):
-        for interv in self._intervals:
+        for interv in self.intervals:
             interv.save()
 
+    @property
+    def path(self) -> Path:
+        return self._path
+
     @property
     def fname(self):
         return self._path.name
 
+    @property
+    def audio_path(self):
+        return self._audio
+
     @property
     def audio(self):
         if self._audio is None:
             return None
 
-        if self.__cache is None:
-            self.__cache = Dataset.from_dict({
-                "audio": [str(self._audio)]
-            }).cast_column("audio", Audio())[0]["audio"]["array"]
+        return load_audio(self._audio)
 
-        return self.__cache
+    def read(self, start_time: float, end_time: float):
+        """
+        Read only the requested time range of the audio
+        """
+        if self._audio is None:
+            return None
+
+        return read_audio(self._audio, start_time, end_time)
 
     @property
     def intervals(self):
+        # interval objects are only created when somebody asks for them
+        if self._intervals is None and self._values is not None:
+            self._intervals = [Interval.from_values(self, *it) for it in self._values]
         return self._intervals
 
+    def interval_values(self) -> List[tuple]:
+        """
+        (n, start_time, end_time, text) of every interval
+        """
+        if self._values is None:
+            self._values = [it.to_tuple() for it in self._intervals]
+        return self._values
+
     @property
     def sid(self) -> str:
         return f"{self.day}:{self.consultation_n}:{int(self.is_doctor)}"
 
     @intervals.setter
-    def intervals(self, it: IntervalTier):
+    def intervals(self, it: "IntervalTier"):
+        from textgrid import IntervalTier
+
         if not isinstance(it, IntervalTier):
             raise TypeError(f"Setting intervals with {it.__class__} (IntervalTier required)")
 
         self._intervals = [Interval.from_raw_interval(self, n + 1, i) for n, i in enumerate(it)]
+        self._values = None
 
     @classmethod
     def from_file(cls, path: Path) -> "Transcript":
+        from textgrid import TextGrid
+
         tmp = cls(path=path, **cls.decode_path_name(path.stem))
         tmp.intervals = TextGrid.fromFile(path)[0]
 
         return tmp
 
     @classmethod
-    def from_dict(cls) -> "Transcript":
-        # For future use when loading from a pre-processed file
-        raise NotImplementedError()
+    def from_dict(cls, dct: dict) -> "Transcript":
+        """
+        Load a transcript from a pre-processed dict created by to_dict()
+        """
+        tmp = cls(path=Path(dct["path"]), day=dct["day"], consultation_n=dct["consultation_n"], doctor=dct["doctor"])
+        tmp._values = [tuple(it) for it in dct["intervals"]]
+
+        return tmp
+
+    def to_dict(self) -> dict:
+        return {
+            "path": str(self._path),
+            "day": self.day,
+            "consultation_n": self.consultation_n,
+            "doctor": self.is_doctor,
+            "intervals": self.interval_values(),
+        }
 
     @classmethod
     def decode_path_name(cls, path_name: str) -> dict:
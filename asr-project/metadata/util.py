@@ -1,49 +1,227 @@
+import csv
+import hashlib
+import io
+import json
+import multiprocessing
 import shutil
-import tarfile
-import tempfile
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
-from datasets import load_dataset
-from rich.progress import track
+import numpy as np
 
-from . import Interval
+from . import Interval, IntervalTable
+from .audio import SAMPLING_RATE
+from .features import FeatureStore
+from .manifest import Manifest
+from .shards import member_size, read_shard, shard_index, shard_name, write_shard
+from .vad import VAD
 
 
-def generate(dct: Dict[str, List[Interval]], out_dir: Path = Path(".")):
+def _ingest(job) -> Path:
+    store, audio_path, digest = job
+    return store.ingest(audio_path, digest)
+
+
+def _encode(job) -> Tuple[bytes, int, int, bool]:
+    """
+    Cut one interval out of its memory-mapped recording, trim the silence around its speech and
+    encode it as a WAV file in memory, returns the data, the exported sample range and whether
+    the VAD found speech (an interval where it finds none still has a transcription, so it is
+    exported untrimmed)
+    """
+    import soundfile
+
+    entry, start, end, vad = job
+    audio = np.load(entry, mmap_mode="r")[start:end]
+    speech = VAD(**vad)(audio) if vad is not None else (0, len(audio))
+    if speech is not None:
+        audio = audio[speech[0]:speech[1]]
+        start = start + speech[0]
+
+    buf = io.BytesIO()
+    soundfile.write(buf, audio, samplerate=SAMPLING_RATE, format="WAV")
+    return buf.getvalue(), start, start + len(audio), speech is not None
+
+
+def _audio_key(digest: str, it: Interval) -> str:
+    """
+    Everything the exported audio of an interval depends on
+    """
+    return hashlib.sha1(f"{digest}:{it.start_time!r}:{it.end_time!r}:{SAMPLING_RATE}".encode()).hexdigest()[:16]
+
+
+def _estimate_size(it: Interval) -> int:
+    # 16-bit PCM with a 44 B WAV header
+    n_samples = int(it.end_time * SAMPLING_RATE) - int(it.start_time * SAMPLING_RATE)
+    return member_size(44 + 2 * max(n_samples, 0))
+
+
+def _plan(key: str, intrvls: List[Interval], previous: Dict[str, dict], old: List[str], shard_size: int,
+          compress: bool) -> Dict[str, List[Interval]]:
+    """
+    Assign the intervals of a split to shards, intervals stay in the shard they were in before
+    and new ones are appended to the last shard, or to new shards once it is full
+    """
+    plan = {name: [] for name in old}
+    sizes = {name: 0 for name in old}
+    new = []
+    for it in intrvls:
+        rec = previous.get(it.fname)
+        if rec is not None and rec["split"] == key and rec["shard"] in plan:
+            plan[rec["shard"]].append(it)
+            sizes[rec["shard"]] += rec["size"]
+        else:
+            new.append(it)
+
+    last = old[-1] if old else None
+    n_next = shard_index(last) + 1 if old else 0
+    for it in new:
+        size = _estimate_size(it)
+        # the archive itself ends with two zero blocks
+        if last is None or (sizes[last] and sizes[last] + size + 1024 > shard_size):
+            last = shard_name(key, n_next, compress)
+            n_next += 1
+            plan[last] = []
+            sizes[last] = 0
+        plan[last].append(it)
+        sizes[last] += size
+
+    return {name: members for name, members in plan.items() if members}
+
+
+def generate(dct: Dict[str, List[Interval]], out_dir: Path = Path("."), workers: int = None,
+             shard_size: int = 256 * 2 ** 20, compress: bool = False, clean: bool = False,
+             vad: Optional[VAD] = VAD(), features: FeatureStore = None):
+    """
+    Export the intervals into tar shards, only the intervals whose audio source or boundaries
+    changed since the last run are exported again and only the shards containing them are rewritten
+
+    Every source recording is resampled once into the feature store and the intervals are cut
+    out of it, the exported time ranges are aligned to its samples
+
+    With a VAD, the intervals are trimmed to their speech, the ones where it finds no speech are
+    exported whole and flagged in the manifest, the exported time range of every interval is
+    recorded in the manifest and in the split CSVs
+    """
+    from rich.progress import track
+
     out_dir.mkdir(parents=True, exist_ok=True)
     DATA_DIR = out_dir / "hf-primock57" / "data"
-    if DATA_DIR.exists():
-        shutil.rmtree(DATA_DIR)
+    features = features or FeatureStore()
+    settings = {"shard_size": shard_size, "compress": compress, "sampling_rate": features.sampling_rate,
+                "normalization": features.normalization, "vad": vad.settings() if vad is not None else None}
+    manifest = Manifest.load(DATA_DIR / "manifest.json")
+    if clean or manifest.settings != settings:
+        if DATA_DIR.exists():
+            shutil.rmtree(DATA_DIR)
+        manifest = Manifest(DATA_DIR / "manifest.json", settings)
     DATA_DIR.mkdir(parents=True, exist_ok=True)
-    tars = {k: tarfile.open((DATA_DIR / k).with_suffix(".tar.gz"), "w:gz") for k, i in dct.items()}
-    for key, intrvls in dct.items():
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            md = (DATA_DIR / f"{key}.csv").open("w")
-            md.write("file_name,transcription\n")
-            for it in track(intrvls, description=f"Processing {key}:"):
-                name, text = it.save(Path(tmp_dir))
-                if not text:
-                    continue
-                md.write(f"{name.name},{text}\n")
-                tars[key].add(name, arcname=name.name)
-
-            md.close()
-            # tars[key].add((Path(tmp_dir) / "metadata.csv"), arcname="metadata.csv")
-    [v.close() for v in tars.values()]
-
-
-def sentences(dct: Dict[str, List[Interval]], out_dir: Path = Path(".")):
+
+    # intervals without audio or with no text left after normalization are not exported
+    dct = {key: [it for it in intrvls if it.text and it.audio_path is not None] for key, intrvls in dct.items()}
+    transcripts = {it.transcript for intrvls in dct.values() for it in intrvls}
+    digests = {tr: manifest.digest(tr.audio_path) for tr in transcripts}
+    for tr in transcripts:
+        manifest.digest(tr.path)
+    keys = {it.fname: _audio_key(digests[it.transcript], it) for intrvls in dct.values() for it in intrvls}
+    # state of the previous run, the manifest is filled again split by split
+    previous = manifest.intervals
+    manifest.intervals = {}
+
+    with multiprocessing.Pool(workers) as pool:
+        # recordings already in the store are not read again
+        recordings = sorted(transcripts, key=lambda tr: str(tr.audio_path))
+        jobs = [(features, tr.audio_path, digests[tr]) for tr in recordings]
+        entries = {tr: Path(e) for tr, e in zip(recordings, track(pool.imap(_ingest, jobs), total=len(jobs),
+                                                                   description="Ingesting audio:"))}
+        features.register({tr.audio_path.stem: e for tr, e in entries.items()})
+
+        for key, intrvls in dct.items():
+            plan = _plan(key, intrvls, previous, manifest.shards.get(key, []), shard_size, compress)
+            old_members = {}
+            for fname, rec in previous.items():
+                if rec["split"] == key:
+                    old_members.setdefault(rec["shard"], set()).add(fname)
+
+            def reusable(it: Interval) -> bool:
+                rec = previous.get(it.fname)
+                return rec is not None and rec["split"] == key and rec["key"] == keys[it.fname] \
+                    and (DATA_DIR / rec["shard"]).exists()
+
+            dirty = [
+                name for name, members in plan.items()
+                if old_members.get(name) != {it.fname for it in members} or not all(reusable(it) for it in members)
+            ]
+            vad_settings = vad.settings() if vad is not None else None
+            jobs = [(str(entries[it.transcript]), int(it.start_time * features.sampling_rate),
+                     int(it.end_time * features.sampling_rate), vad_settings)
+                    for name in dirty for it in plan[name] if not reusable(it)]
+            # imap keeps the order of the jobs, so the shards are reproducible
+            encoded = iter(track(pool.imap(_encode, jobs, chunksize=8), total=len(jobs),
+                                 description=f"Processing {key}:"))
+
+            records = {}
+
+            def members(name: str, old: Dict[str, bytes]):
+                for it in plan[name]:
+                    if reusable(it):
+                        records[it.fname] = previous[it.fname]
+                        yield it.fname, old[it.fname]
+                        continue
+                    data, start, end, speech = next(encoded)
+                    records[it.fname] = {"key": keys[it.fname], "size": member_size(len(data)),
+                                         "start_time": start / features.sampling_rate,
+                                         "end_time": end / features.sampling_rate, "speech": speech}
+                    yield it.fname, data
+
+            for name in dirty:
+                path = DATA_DIR / name
+                write_shard(path, members(name, read_shard(path) if path.exists() else {}), compress)
+            # every job has been consumed, this only completes the progress bar
+            next(encoded, None)
+
+            for name, members_ in plan.items():
+                for it in members_:
+                    rec = records.get(it.fname, previous.get(it.fname))
+                    manifest.intervals[it.fname] = {"split": key, "shard": name, "key": rec["key"],
+                                                    "size": rec["size"], "start_time": rec["start_time"],
+                                                    "end_time": rec["end_time"], "speech": rec["speech"]}
+            # shards of a previous run which are no longer planned
+            for name in set(manifest.shards.get(key, [])) - set(plan):
+                (DATA_DIR / name).unlink(missing_ok=True)
+            manifest.shards[key] = sorted(plan, key=shard_index)
+
+            exported = [manifest.intervals[it.fname] for it in intrvls]
+            no_speech = sum(1 for rec in exported if not rec["speech"])
+            trimmed = sum((it.end_time - it.start_time) - (rec["end_time"] - rec["start_time"])
+                          for it, rec in zip(intrvls, exported))
+            print(f"{key}: {len(jobs)} of {len(intrvls)} intervals exported, {len(dirty)} of {len(plan)} shards written, "
+                  f"{trimmed:.1f}s of silence trimmed, {no_speech} intervals without detected speech kept whole")
+
+            # the transcriptions only live in the metadata, which is cheap to rewrite
+            with (DATA_DIR / f"{key}.csv").open("w", newline="") as md:
+                writer = csv.writer(md)
+                writer.writerow(["file_name", "start_time", "end_time", "transcription"])
+                for it in intrvls:
+                    rec = manifest.intervals[it.fname]
+                    writer.writerow([it.fname, f"{rec['start_time']:.6f}", f"{rec['end_time']:.6f}", it.text])
+
+    used = {str(tr.audio_path) for tr in transcripts} | {str(tr.path) for tr in transcripts}
+    manifest.sources = {k: v for k, v in manifest.sources.items() if k in used}
+    manifest.save()
+    with (DATA_DIR / "shards.json").open("w") as f:
+        json.dump(manifest.shards, f, indent=2)
+
+
+def sentences(dct: Dict[str, IntervalTable], out_dir: Path = Path(".")):
     out_dir /= "outputs"
     out_dir.mkdir(parents=True, exist_ok=True)
-    for key, intrvls in dct.items():
-        with (out_dir / key).open("w") as f:
-            for it in intrvls:
-                f.write(f"{it.sid}\t{it.text}\n")
+    for key, table in dct.items():
+        with (out_dir / key).open("wb") as f:
+            f.write(table.sid_lines())
 
-        with (out_dir / key).with_suffix(".s").open("w") as f:
-            for it in intrvls:
-                f.write(f"<s> {it.text} </s>\n")
+        with (out_dir / key).with_suffix(".s").open("wb") as f:
+            f.write(table.sentence_lines())
 
 
 def test(out_dir: Path = Path(".")):
@@ -51,6 +229,8 @@ def test(out_dir: Path = Path(".")):
     if not DATA_DIR.exists() or not DATA_DIR.is_dir():
         raise NotADirectoryError(f"Data directory '{DATA_DIR}' is not a directory!")
 
+    from datasets import load_dataset
+
     dataset = load_dataset("hf-primock57")
     print(dataset)
     print(dataset["train"][2])
@@ -0,0 +1,66 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .audio import SAMPLING_RATE
+
+# the speech threshold never gets closer than this to the loudest frame of an interval,
+# so that an interval which is speech from start to end is not mistaken for noise
+HEADROOM_DB = 20.0
+
+
+class VAD:
+    """
+    Energy based voice activity detection on the audio of one interval
+
+    A frame is speech when its energy is threshold_db above the noise floor of the interval
+    (the 10th percentile of its frame energies) and above floor_db, intervals with at least
+    min_speech seconds of speech are trimmed to their speech with margin seconds of padding
+    on each side
+    """
+
+    def __init__(self, margin: float = 0.1, threshold_db: float = 12.0, floor_db: float = -50.0,
+                 min_speech: float = 0.1, frame_ms: float = 25.0, hop_ms: float = 10.0):
+        self.margin = margin
+        self.threshold_db = threshold_db
+        self.floor_db = floor_db
+        self.min_speech = min_speech
+        self.frame_ms = frame_ms
+        self.hop_ms = hop_ms
+
+    def settings(self) -> dict:
+        return dict(self.__dict__)
+
+    def frame_energy(self, audio: np.ndarray, sampling_rate: int = SAMPLING_RATE) -> np.ndarray:
+        """
+        RMS energy in dBFS of every frame
+        """
+        frame = int(sampling_rate * self.frame_ms / 1000)
+        hop = int(sampling_rate * self.hop_ms / 1000)
+        if len(audio) < frame:
+            audio = np.pad(audio, (0, frame - len(audio)))
+        frames = np.lib.stride_tricks.sliding_window_view(audio, frame)[::hop]
+        rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+        return 20 * np.log10(rms + 1e-10)
+
+    def speech(self, audio: np.ndarray, sampling_rate: int = SAMPLING_RATE) -> np.ndarray:
+        energy = self.frame_energy(audio, sampling_rate)
+        noise = np.percentile(energy, 10)
+        threshold = max(self.floor_db, min(noise + self.threshold_db, energy.max() - HEADROOM_DB))
+        return energy > threshold
+
+    def __call__(self, audio: np.ndarray, sampling_rate: int = SAMPLING_RATE) -> Optional[Tuple[int, int]]:
+        """
+        (start, end) samples of the speech of an interval including the margins, None without speech
+        """
+        if len(audio) == 0:
+            return None
+        mask = self.speech(audio, sampling_rate)
+        hop = int(sampling_rate * self.hop_ms / 1000)
+        frame = int(sampling_rate * self.frame_ms / 1000)
+        if np.count_nonzero(mask) * hop < self.min_speech * sampling_rate:
+            return None
+
+        first, last = np.flatnonzero(mask)[[0, -1]]
+        margin = int(self.margin * sampling_rate)
+        return max(first * hop - margin, 0), min(last * hop + frame + margin, len(audio))
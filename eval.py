@@ -4,11 +4,12 @@ import json
 
 from transformers import \
     AutoProcessor, Wav2Vec2Processor, Wav2Vec2ProcessorWithLM, Wav2Vec2ForCTC, Wav2Vec2CTCTokenizer
-from pyctcdecode import build_ctcdecoder
 from pathlib import Path
-from evaluate import load
 
 from datasets import load_dataset
+
+from evaluation import ModelRegistry, utterance_wer
+
 sample_dataset = load_dataset("hf-internal-testing/librispeech_asr_demo", "clean", split="validation")
 dataset = load_dataset("hf-primock57", split="train")
 
@@ -33,25 +34,13 @@ tokenizer = Wav2Vec2CTCTokenizer(vocab_file="vocab.json")
 
 
 current_dir = Path().cwd()
-context_2_gram = path_to_models / "2gram_context_lm.arpa"
-background_2_gram = path_to_models / "2gram_background_lm.arpa"
-adapted_2_gram = path_to_models / "2gram_log_adapted_lm.arpa"
+# ARPA models are converted to KenLM binaries once and the decoders are shared
+registry = ModelRegistry(list(tokenizer.get_vocab().keys()), path_to_models)
 
 # Create 2-gram based decoder
-decoder_context_2g = build_ctcdecoder(
-    labels=list(tokenizer.get_vocab().keys()),
-    kenlm_model_path=str(context_2_gram),
-)
-
-decoder_background_2g = build_ctcdecoder(
-    labels=list(tokenizer.get_vocab().keys()),
-    kenlm_model_path=str(background_2_gram),
-)
-
-decoder_adapted_2g = build_ctcdecoder(
-    labels=list(tokenizer.get_vocab().keys()),
-    kenlm_model_path=str(adapted_2_gram),
-)
+decoder_context_2g = registry.decoder("context", 2).beam_search
+decoder_background_2g = registry.decoder("background", 2).beam_search
+decoder_adapted_2g = registry.decoder("log_adapted", 2).beam_search
 
 
 
@@ -141,8 +130,7 @@ print("Combined 2G: ", combined)
 
 predictions = [no_lm, context, background, combined]
 
-wer_metric = load("wer")
-wer = [wer_metric.compute(references=[reference], predictions=[pred]) for pred in predictions]
+wer = utterance_wer([reference] * len(predictions), predictions)
 print("=== WER ===")
 print("Without LM: ", wer[0])
 print("Context 2G: ", wer[1])
@@ -1,26 +1,100 @@
 
 # To run this file you might need the following modules (pip install):
-#    datasets transformers soundfile evaluate pyctcdecode pypi-kenlm jiwer https://github.com/kpu/kenlm/archive/master.zip
+#    datasets transformers soundfile pyctcdecode pypi-kenlm https://github.com/kpu/kenlm/archive/master.zip
     
 # General imports
 import torch
 import json
+import numpy as np
+import argparse
+import hashlib
+import io
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
 import warnings
 
 from pathlib import Path
+from typing import List, Tuple
 
-from datasets import load_dataset
-from transformers import AutoProcessor, Wav2Vec2ProcessorWithLM, \
-                            Wav2Vec2ForCTC, Wav2Vec2CTCTokenizer
-from pyctcdecode import build_ctcdecoder
-from evaluate import load
+from datasets import Audio, load_dataset
+from transformers import AutoProcessor, Wav2Vec2CTCTokenizer
 from rich.progress import track
 
+from evaluation import (BACKENDS, BatchedInference, DecoderPool, FeatureReader, LogitStore, ModelRegistry, Pipeline,
+                        PRECISIONS, Stage, SweepResult, WerAccumulator, WerBreakdown, ctc_confidence, decode_stage,
+                        greedy_decode, grid, load_acoustic_model, merge_report, merge_shards,
+                        pareto_front, parse_shard, parse_space, peak_rss_mb, random_points, set_threads, shard_path,
+                        write_shard)
+from metadata.audio import decode_audio
+
+# worker threads of every pipeline stage, decode workers are processes (0 decodes in a thread)
+PIPELINE_WORKERS = {"read": 1, "features": 2, "inference": 1, "decode": os.cpu_count(), "wer": 1}
+
+
+def compare_precisions(argv: List[str], precisions: List[str]=PRECISIONS):
+    """
+    Run the benchmark of every precision in its own process, so that the peak memory of one does not
+    hide the other, and print the real-time factor, peak memory and WER side by side
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for precision in precisions:
+            out = Path(tmp) / f"{precision}.json"
+            print(f"Benchmarking {precision} ...")
+            subprocess.run([sys.executable, sys.argv[0], *argv, "--precision", precision, "--benchmark", str(out)],
+                           check=True)
+            with out.open() as f:
+                results.append(json.load(f))
+
+    base = results[0]
+    print(f"{'precision':>10} {'threads':>8} {'RTF':>7} {'speedup':>8} {'peak RSS':>10}  "
+          f"WER (delta against {base['precision']})")
+    for r in results:
+        wer = ", ".join(f"{key} {value:.4f} ({value - base['wer'][key]:+.4f})" for key, value in r["wer"].items())
+        speedup = base["rtf"] / r["rtf"] if r["rtf"] else 0.0
+        print(f"{r['precision']:>10} {r['intra_threads']:>4}/{r['inter_threads']:<3} {r['rtf']:>7.3f} {speedup:>7.2f}x "
+              f"{r['peak_rss_mb']:>8.0f}MB  {wer}")
+    print(f"({base['utterances']} utterances, threads are intra-op/inter-op)")
+
+
+def run_shards(argv: List[str], count: int, shard_dir: Path):
+    """
+    Evaluate count shards in as many local processes at once, each with its share of the cores,
+    and merge their shard files, on several machines run `eval3.py --shard i/N` on each of them
+    and merge with `python -m evaluation.shards` instead
+    """
+    threads = str(max(1, (os.cpu_count() or 1) // count))
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    processes = []
+    for index in range(count):
+        log = shard_dir / f"shard-{index:03d}-of-{count:03d}.log"
+        with log.open("w") as f:
+            # the thread counts come first, so that ones given in argv override them
+            processes.append((log, subprocess.Popen(
+                [sys.executable, sys.argv[0], "--intra-threads", threads, "--decode-workers", threads, *argv,
+                 "--shard", f"{index}/{count}", "--shard-dir", str(shard_dir)], stdout=f, stderr=subprocess.STDOUT)))
+    print(f"Evaluating {count} shards in local processes, logs in {shard_dir}")
+    failed = [log for log, p in processes if p.wait() != 0]
+    if failed:
+        raise RuntimeError(f"{len(failed)} shards failed, see {', '.join(map(str, failed))}")
+    print(merge_report(merge_shards([shard_path(shard_dir, i, count) for i in range(count)])))
+
+
 class ModelEvaluator:
     """
     Build and evaluate multiple n-gram models
     """
-    def __init__(self, N: list, model_names: list, n_samples: int=-1, models_dir: Path=""):
+    def __init__(self, N: list, model_names: list, n_samples: int=-1, models_dir: Path="models",
+                 cache_dir: Path="cache", logits_dtype: str="float32", batch_samples: int=16000 * 60,
+                 decode_workers: int=None, streaming: bool=False, window: int=64, binary_lm: bool=True,
+                 confidence_threshold: float=None, confidence: str="max_posterior", decoder: str="pyctcdecode",
+                 features: Path=None, precision: str="fp32", intra_threads: int=None, inter_threads: int=None,
+                 wer_details: Path=None, shard: Tuple[int, int]=None, shard_dir: Path="shards"):
+        self.created = time.perf_counter()
         if (type(N) == int): N = [N]
         if (type(model_names) == int): model_names = [model_names]
         
@@ -28,14 +102,54 @@ class ModelEvaluator:
         self.model_names = model_names
         self.model_dir = Path(models_dir)
         
-        self.dataset = load_dataset("hf-primock57", split="test")
+        self.streaming = streaming
+        self.window = window
+        self.wer_details = wer_details
+        # (i, N): only every N-th row of the split from the i-th on is evaluated, and the results are
+        # written to a shard file under shard_dir for `python -m evaluation.shards` to merge
+        self.shard = shard
+        self.shard_dir = Path(shard_dir)
+        self.n_samples = n_samples
+        self.decode_seconds = 0.0
+        self.dataset = load_dataset("hf-primock57", split="test", streaming=streaming)
+        # with the feature store of the export, the audio is sliced out of the resampled recordings
+        # and the WAV files of the dataset are never decoded
+        self.features = None
+        if features is not None:
+            self.features = FeatureReader(features)
+            self.dataset = self.dataset.remove_columns("audio")
         
         self.pre_trained_model = "facebook/wav2vec2-base-960h"
-        print("Loading pre-trained model: ", self.pre_trained_model)
+        # before the model runs anything, the inter-op pool cannot be resized afterwards
+        set_threads(intra_threads, inter_threads)
+        self.precision = precision
+        print("Loading pre-trained model: ", self.pre_trained_model, f"({precision})")
         self.base_processor = AutoProcessor.from_pretrained(self.pre_trained_model)
-        self.accoustic_model = Wav2Vec2ForCTC.from_pretrained(self.pre_trained_model)
+        # the int8 model has its linear layers quantized, it is cached under cache/quantized
+        self.accoustic_model = load_acoustic_model(self.pre_trained_model, precision, Path(cache_dir) / "quantized")
         self.create_tokenizer()
+        # ARPA models are converted to KenLM binaries once, under cache/kenlm,
+        # the beam search is pyctcdecode or the native BeamSearchDecoder
+        self.registry = ModelRegistry(list(self.tokenizer.get_vocab().keys()), self.model_dir,
+                                      Path(cache_dir) / "kenlm", binary=binary_lm, backend=decoder)
+        # logits only depend on the acoustic model, so they are shared by all LM configurations
+        self.model_id = self.pre_trained_model if precision == "fp32" else f"{self.pre_trained_model}:{precision}"
+        self.logit_store = LogitStore(Path(cache_dir) / "logits", self.model_id, dtype=logits_dtype)
+        # batch_samples=0 runs the acoustic model on one utterance at a time
+        self.inference = BatchedInference(self.accoustic_model, self.base_processor.feature_extractor,
+                                          max_samples=batch_samples)
+        # None uses every core, 0 decodes in this process
+        self.decode_workers = decode_workers
+        self._decoder_pool = None
+        # utterances at least this confident skip the beam search and get the greedy transcript
+        self.confidence_threshold = confidence_threshold
+        self.confidence = confidence
         
+        if streaming:
+            # samples are read lazily, one window at a time, by evaluate_streaming()
+            self.num_samples = n_samples
+            return
+
         # TODO: change this:
         print("Extract audio sample ...", end=" ")
         if(n_samples == -1): 
@@ -43,7 +157,12 @@ class ModelEvaluator:
         else:
             self.num_samples = min(self.dataset.num_rows, n_samples)
             
-        self.audio_sample = self.dataset[:self.num_samples]
+        if self.shard is None:
+            self.audio_sample = self.dataset[:self.num_samples]
+        else:
+            index, count = self.shard
+            self.audio_sample = self.dataset.select(range(index, self.num_samples, count))[:]
+            self.num_samples = len(self.audio_sample["path"])
         print("[DONE]")
         
 
@@ -59,71 +178,345 @@ class ModelEvaluator:
         tokenizer = Wav2Vec2CTCTokenizer.from_pretrained(self.pre_trained_model)
         sorted_vocab_dict = {k.lower(): v for k, v in sorted(tokenizer.get_vocab().items(), key=lambda item: item[1])}
         
-        with open("vocab.json", "w") as outfile:
+        # written atomically, shards running side by side all write it
+        tmp = Path(f".vocab.json.{os.getpid()}")
+        with open(tmp, "w") as outfile:
             json.dump(sorted_vocab_dict, outfile)
+        os.replace(tmp, "vocab.json")
         self.tokenizer = Wav2Vec2CTCTokenizer(vocab_file="vocab.json")
         print("[DONE]")
         
 
+    @staticmethod
+    def sample_id(sample: dict) -> str:
+        """
+        Identify a sample by its file name and the hash of its audio,
+        so that a regenerated dataset never reuses stale logits
+        """
+        audio = sample["audio"]
+        # hashed in place, the array may be a view of a memory-mapped recording
+        digest = hashlib.sha1(np.ascontiguousarray(audio["array"])).hexdigest()[:16]
+        return f"{sample['path']}:{audio['sampling_rate']}:{digest}"
+
+    def samples(self) -> List[dict]:
+        """
+        Rows of the extracted audio sample
+        """
+        return [self.with_audio({k: v[i] for k, v in self.audio_sample.items()}) for i in range(self.num_samples)]
+
+    def iter_rows(self):
+        """
+        Rows of the split as the dataset yields them, without the audio of the feature store
+        """
+        rows = iter(self.dataset)
+        if self.num_samples != -1:
+            rows = itertools.islice(rows, self.num_samples)
+        if self.shard is not None:
+            index, count = self.shard
+            rows = itertools.islice(rows, index, None, count)
+        return rows
+
+    def iter_samples(self):
+        return map(self.with_audio, self.iter_rows())
+
+    def with_audio(self, sample: dict) -> dict:
+        if self.features is None:
+            return sample
+        return {**sample, "audio": self.features.audio(sample)}
+
+    def load_audio(self, sample: dict) -> dict:
+        """
+        Decode and resample the audio of a row read without decoding (Audio(decode=False)),
+        rows with decoded audio are returned as they are
+        """
+        sample = self.with_audio(sample)
+        audio = sample["audio"]
+        if audio.get("array") is not None:
+            return sample
+
+        target = self.base_processor.feature_extractor.sampling_rate
+        array = decode_audio(io.BytesIO(audio["bytes"]), target)
+        return {**sample, "audio": {"path": audio.get("path"), "array": array, "sampling_rate": target}}
+
+    def compute_logits(self, samples: List[dict], progress: bool=True) -> List[str]:
+        """
+        Run the acoustic model once per sample and keep the logits in the logit store,
+        samples which are already in the store are not recomputed
+        """
+        sample_ids = [self.sample_id(s) for s in samples]
+        missing = [i for i, s in enumerate(sample_ids) if s not in self.logit_store]
+        if progress:
+            print(f"Computing logits for {len(missing)} samples ({len(samples) - len(missing)} cached)")
+        audios = [samples[i]["audio"] for i in missing]
+        # buckets are formed within chunks, which keeps the progress bar moving and memory bounded
+        chunk = 256
+        chunks = range(0, len(missing), chunk)
+        for c in track(chunks, description="Feeding embeddings") if progress else chunks:
+            batch = audios[c:c + chunk]
+            logits = self.inference([a["array"] for a in batch], sampling_rate=batch[0]["sampling_rate"])
+            for i, lg in zip(missing[c:c + chunk], logits):
+                self.logit_store[sample_ids[i]] = lg
+        if missing and progress:
+            print(f"\tAcoustic model: {self.inference.throughput}")
+        return sample_ids
+
+    def model_path(self, name: str, n: int) -> Path:
+        return self.registry.arpa_path(name, n)
+
+    @property
+    def decoder_pool(self) -> DecoderPool:
+        """
+        Worker pool for the LM beam search, started on first use and kept until close()
+        """
+        if self._decoder_pool is None:
+            self._decoder_pool = DecoderPool(self.registry, self.logit_store, processes=self.decode_workers)
+        return self._decoder_pool
+
+    def lm_paths(self) -> dict:
+        return {(name, n): self.model_path(name, n) for name in self.model_names for n in self.N}
+
     def generate_transcripts(self):
         if not hasattr(self, 'tokenizer'):
             self.create_tokenizer()
+        sample_ids = self.compute_logits(self.samples())
+
         model_paths = {}
-        decoders = {}
-        processors = {}
-        inputs = {}
-        logits = {}
-        transcripts = {}
-        
         for name in self.model_names:
             model_paths[name] = {}
-            decoders[name] = {}
-            processors[name] = {}
-            inputs[name] = {}
-            logits[name] = {}
-            transcripts[name] = {}
-            
             for n in self.N:
-                print(f"Processing {name} {n}-gram...")
-                # model path
-                model_paths[name][n] = Path().cwd() / "models" / str(str(n) + "gram_" + name + "_lm.arpa")
-                # Decoder
-                print("\tGenerating decoder")
-                decoders[name][n] = build_ctcdecoder(
-                    labels=list(self.tokenizer.get_vocab().keys()),
-                    kenlm_model_path=str(model_paths[name][n]))
-                # Processor
-                print("\tGenerating processor")
-                processors[name][n] = Wav2Vec2ProcessorWithLM(
-                    feature_extractor=self.base_processor.feature_extractor,
-                    tokenizer=self.tokenizer,
-                    decoder=decoders[name][n]
-                )
-                # Compute inputs for acoustic model 
-                print("\tComputing Wav2Vec2 embeddings")
-                inputs[name][n] = []
-                for i in range(self.num_samples):
-                    inputs[name][n].append(processors[name][n](
-                        self.audio_sample["audio"][i]["array"], 
-                        sampling_rate=self.audio_sample["audio"][i]["sampling_rate"], 
-                        return_tensors="pt"))
-                # Compute logits
-                logits[name][n] = []
-                #print("\tFeeding embeddings to acoustic models 0", end="")
-                with torch.no_grad():
-                    for i in track(range(self.num_samples), description="Feeding embeddings"):
-                        logits[name][n].append(self.accoustic_model(**inputs[name][n][i]).logits.numpy())
-                print()
-                # Compute final transcripts
-                print("\tDecoding output")
-                transcripts[name][n] = processors[name][n].batch_decode(logits[name][n]).text
-        
+                model_paths[name][n] = self.model_path(name, n)
+
+        # every (LM, order) combination goes through one shared job queue
+        lm_paths = self.lm_paths()
+        print(f"Decoding {len(lm_paths)} LM configurations with {self.decoder_pool.processes} workers")
+        decoded = self.decode(lm_paths, sample_ids)
+        seconds = sum(self.decoder_pool.seconds.values())
+        if sample_ids:
+            print(f"\tBeam search ({self.registry.backend}): "
+                  f"{1000 * seconds / (len(sample_ids) * len(lm_paths)):.1f} ms per utterance and LM")
+
         self.model_paths = model_paths
-        self.decoders = decoders
-        self.processors = processors 
-        self.inputs = inputs
-        self.logits = logits
-        self.transcripts = transcripts 
+        self.sample_ids = sample_ids
+        self.transcripts = {name: {n: decoded[(name, n)] for n in self.N} for name in self.model_names}
+
+    def decode(self, lm_paths: dict, sample_ids: List[str]) -> dict:
+        if self.confidence_threshold is None:
+            decoded = self.decoder_pool.decode(lm_paths, sample_ids)
+        else:
+            decoded = self.decode_hybrid(lm_paths, sample_ids)
+        self.decode_seconds += sum(self.decoder_pool.seconds.values())
+        return decoded
+
+    def decode_hybrid(self, lm_paths: dict, sample_ids: List[str]) -> dict:
+        """
+        Greedy transcripts for the utterances the acoustic model is confident about,
+        only the others go through the LM beam search
+        """
+        labels = list(self.tokenizer.get_vocab().keys())
+        greedy = {}
+        for s in sample_ids:
+            logits = self.logit_store.read(s)
+            if ctc_confidence(logits, self.confidence) >= self.confidence_threshold:
+                greedy[s] = greedy_decode(logits, labels)
+        uncertain = [s for s in sample_ids if s not in greedy]
+        self.routed = len(uncertain) / len(sample_ids) if sample_ids else 0.0
+        print(f"\tGreedy fast path: {len(greedy)}/{len(sample_ids)} utterances with {self.confidence} >= "
+              f"{self.confidence_threshold}, {len(uncertain)} ({100 * self.routed:.1f}%) routed to the beam search")
+
+        decoded = self.decoder_pool.decode(lm_paths, uncertain)
+        beam = {key: dict(zip(uncertain, texts)) for key, texts in decoded.items()}
+        return {key: [greedy[s] if s in greedy else beam[key][s] for s in sample_ids] for key in lm_paths}
+
+    def compare_hybrid(self):
+        """
+        Decode with and without the greedy fast path and report the WER and beam search time of both
+        """
+        if not hasattr(self, 'tokenizer'):
+            self.create_tokenizer()
+        sample_ids = self.compute_logits(self.samples())
+        references = self.audio_sample["transcription"]
+        lm_paths = self.lm_paths()
+
+        full = self.decoder_pool.decode(lm_paths, sample_ids)
+        full_seconds = dict(self.decoder_pool.seconds)
+        hybrid = self.decode_hybrid(lm_paths, sample_ids)
+        hybrid_seconds = self.decoder_pool.seconds
+
+        for (name, n) in lm_paths:
+            wer_full, wer_hybrid = WerAccumulator(), WerAccumulator()
+            wer_full.add(references, full[(name, n)])
+            wer_hybrid.add(references, hybrid[(name, n)])
+            print(f"{name} {n}-gram: WER {wer_full.wer:.4f} -> {wer_hybrid.wer:.4f} "
+                  f"({wer_hybrid.wer - wer_full.wer:+.4f}), beam search {full_seconds[(name, n)]:.2f}s -> "
+                  f"{hybrid_seconds[(name, n)]:.2f}s")
+
+    def sweep(self, points: List[dict], output: Path=None) -> List[SweepResult]:
+        """
+        Decode the same logits with every LM and every set of decoder parameters,
+        and report WER against beam search time, marking the Pareto-optimal settings of each LM
+        """
+        if not hasattr(self, 'tokenizer'):
+            self.create_tokenizer()
+        sample_ids = self.compute_logits(self.samples())
+        references = self.audio_sample["transcription"]
+
+        lm_paths = self.lm_paths()
+        configs = {(name, n, i): path for (name, n), path in lm_paths.items() for i in range(len(points))}
+        print(f"Sweeping {len(points)} decoder settings x {len(lm_paths)} LM configurations "
+              f"with {self.decoder_pool.processes} workers")
+        decoded = self.decoder_pool.decode(configs, sample_ids, params={key: points[key[2]] for key in configs})
+
+        results = {key: [] for key in lm_paths}
+        for (name, n, i), texts in decoded.items():
+            wer = WerAccumulator()
+            wer.add(references, texts)
+            seconds = self.decoder_pool.seconds[(name, n, i)]
+            results[(name, n)].append(SweepResult((name, n), points[i], wer, seconds, len(texts)))
+
+        for (name, n), val in results.items():
+            front = pareto_front(val)
+            print(f"{name} {n}-gram:")
+            for r in sorted(val, key=lambda r: (r.wer.wer, r.seconds)):
+                print(f"\t{'*' if r in front else ' '} {r}")
+        print("* Pareto-optimal: no other setting of the LM is both faster and more accurate")
+
+        results = [r for val in results.values() for r in val]
+        if output is not None:
+            with open(output, "w") as f:
+                json.dump([r.to_dict() for r in results], f, indent=2)
+            print(f"Sweep results written to {output}")
+        return results
+
+    def evaluate_streaming(self):
+        """
+        Run feature extraction, inference, decoding and WER accumulation over a fixed window
+        of samples at a time, memory use does not grow with the size of the split
+        """
+        lm_paths = self.lm_paths()
+        wer = {key: WerBreakdown() for key in lm_paths}
+        # the transcripts are only kept for the shard file
+        hypotheses = {key: {} for key in lm_paths} if self.shard is not None else None
+        reference_texts = {}
+        samples = self.iter_samples()
+        done = 0
+        while window := list(itertools.islice(samples, self.window)):
+            sample_ids = self.compute_logits(window, progress=False)
+            names = [s["path"] for s in window]
+            references = [s["transcription"] for s in window]
+            for key, texts in self.decode(lm_paths, sample_ids).items():
+                wer[key].add(names, references, texts)
+                if hypotheses is not None:
+                    hypotheses[key].update(zip(names, texts))
+            if hypotheses is not None:
+                reference_texts.update(zip(names, references))
+            done += len(window)
+            print(f"\t{done} samples evaluated")
+
+        self.report_wer(wer, hypotheses, reference_texts)
+
+    def evaluate_pipeline(self, workers: dict=None, torch_threads: int=None, queue_size: int=8):
+        """
+        Run audio reading, feature extraction, batched inference, LM decoding and WER accumulation as
+        concurrent stages connected by bounded queues, and report the utilization of every stage
+        """
+        workers = workers or {}
+        # --decode-workers sizes the decode stage unless it is given explicitly
+        defaults = {**PIPELINE_WORKERS, **({"decode": self.decode_workers} if self.decode_workers is not None else {})}
+        workers = {**defaults, **workers}
+        lm_paths = self.lm_paths()
+        wer = {key: WerBreakdown() for key in lm_paths}
+        hypotheses = {key: {} for key in lm_paths} if self.shard is not None else None
+        reference_texts = {}
+        if self.features is None:
+            # the WAV files are decoded by the read stage, not while iterating the dataset
+            self.dataset = self.dataset.cast_column("audio", Audio(decode=False))
+
+        def read(rows):
+            samples = [self.load_audio(r) for r in rows]
+            return [{**s, "id": self.sample_id(s)} for s in samples]
+
+        def extract(samples):
+            for s in samples:
+                if s["id"] not in self.logit_store:
+                    s["values"] = self.inference.extract(s["audio"]["array"], s["audio"]["sampling_rate"])
+            return samples
+
+        def infer(samples):
+            missing = [s for s in samples if "values" in s]
+            for bucket in self.inference.buckets([len(s["values"]) for s in missing]):
+                logits = self.inference.forward_features([missing[i]["values"] for i in bucket])
+                for i, lg in zip(bucket, logits):
+                    self.logit_store[missing[i]["id"]] = lg
+            # the decode stage passes the reference through as it is
+            return [(s["id"], (s["path"], s["transcription"])) for s in samples]
+
+        def accumulate(results):
+            for _, (name, reference), texts in results:
+                for key, text in texts.items():
+                    wer[key].add([name], [reference], [text])
+                    if hypotheses is not None:
+                        hypotheses[key][name] = text
+                if hypotheses is not None:
+                    reference_texts[name] = reference
+            return [s for s, _, _ in results]
+
+        pipeline = Pipeline([
+            Stage("read", read, workers["read"], queue_size=queue_size),
+            Stage("features", extract, workers["features"], queue_size=queue_size),
+            # batches of whatever is waiting, split into padded buckets of at most batch_samples
+            Stage("inference", infer, workers["inference"], batch_size=16, queue_size=4 * queue_size,
+                  threads=torch_threads),
+            decode_stage(self.registry, self.logit_store, lm_paths, workers["decode"], queue_size=4 * queue_size),
+            Stage("wer", accumulate, workers["wer"], batch_size=16, queue_size=queue_size),
+        ])
+
+        print(f"Evaluating {len(lm_paths)} LM configurations in a pipeline of "
+              f"{', '.join(f'{st.name}={st.workers}' for st in pipeline.stages)} workers")
+        done = 0
+        # the read stage looks the audio up, see load_audio()
+        for _ in pipeline.run(self.iter_rows()):
+            done += 1
+            if done % 100 == 0:
+                print(f"\t{done} samples evaluated")
+        print(pipeline.report())
+        self.decode_seconds += next(st.busy for st in pipeline.stages if st.name == "decode")
+        self.report_wer(wer, hypotheses, reference_texts)
+
+    def benchmark(self, output: Path):
+        """
+        Compute the logits of the samples from scratch and decode them, the real-time factor of the
+        acoustic model, the peak memory of the process and the WERs are written to output as JSON,
+        compare_precisions() runs this in a fresh process for every precision
+        """
+        labels = list(self.tokenizer.get_vocab().keys())
+        references = self.audio_sample["transcription"]
+        with tempfile.TemporaryDirectory() as tmp:
+            # a throwaway logit store, so that every logit is computed by this model
+            self.logit_store = LogitStore(tmp, self.model_id, dtype=self.logit_store.dtype)
+            sample_ids = self.compute_logits(self.samples())
+            wer = {"greedy": WerAccumulator()}
+            wer["greedy"].add(references, [greedy_decode(self.logit_store.read(s), labels) for s in sample_ids])
+            for (name, n), texts in self.decode(self.lm_paths(), sample_ids).items():
+                wer[f"{name} {n}-gram"] = WerAccumulator()
+                wer[f"{name} {n}-gram"].add(references, texts)
+            self.close()
+
+        result = {
+            "precision": self.precision,
+            "intra_threads": torch.get_num_threads(),
+            "inter_threads": torch.get_num_interop_threads(),
+            "utterances": len(sample_ids),
+            "rtf": self.inference.throughput.rtf,
+            "peak_rss_mb": peak_rss_mb(),
+            "wer": {key: acc.wer for key, acc in wer.items()},
+        }
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    def close(self):
+        if self._decoder_pool is not None:
+            self._decoder_pool.close()
+            self._decoder_pool = None
     
     def print_transcripts(self, nb=-1):
         if nb == -1: nb = self.num_samples
@@ -137,35 +530,204 @@ class ModelEvaluator:
         print("----------")
     
     def compute_wer(self):
-        wer_metric = load("wer")
-        wer = {}
+        wer, hypotheses = {}, {}
         for name in self.model_names:
-            wer[name] = {}
             for n in self.N:
-                reference = self.audio_sample["transcription"]
-                predictions = self.transcripts[name][n]
-                wer[name][n] = [wer_metric.compute(references=reference, predictions=predictions)]
-        print(wer)
-    
-    
-    def __compute_wer(reference, prediction):
-        wer_metric = load("wer")
-        # TODO
+                wer[(name, n)] = WerBreakdown()
+                wer[(name, n)].add(self.audio_sample["path"], self.audio_sample["transcription"],
+                                   self.transcripts[name][n])
+                hypotheses[(name, n)] = dict(zip(self.audio_sample["path"], self.transcripts[name][n]))
+        self.report_wer(wer, hypotheses, dict(zip(self.audio_sample["path"], self.audio_sample["transcription"])))
+
+    def report_wer(self, wer: dict, hypotheses: dict=None, references: dict=None):
+        """
+        Print the WER of every LM configuration, overall and by role, and write the error counts
+        of every interval, transcript and role to wer_details if it is set, with a shard the
+        hypotheses, error counts and timings also go to its shard file
+        """
+        self.wer = {name: {n: wer[(name, n)] for n in self.N} for name in self.model_names}
+        for name, val in self.wer.items():
+            for n, breakdown in val.items():
+                print(f"{name} {n}-gram: {breakdown.total}")
+                for role, acc in sorted(breakdown.roles.items()):
+                    print(f"\t{role}: {acc}")
+        if self.wer_details is not None:
+            with open(self.wer_details, "w") as f:
+                json.dump({f"{name} {n}-gram": b.to_dict() for name, val in self.wer.items() for n, b in val.items()},
+                          f, indent=2)
+            print(f"WER breakdown written to {self.wer_details}")
+        if self.inference.throughput.utterances:
+            print(f"Acoustic model throughput: {self.inference.throughput}")
+        if self.shard is not None:
+            self.write_shard(wer, hypotheses, references)
+
+    def write_shard(self, wer: dict, hypotheses: dict, references: dict):
+        index, count = self.shard
+        keys = {(name, n): f"{name} {n}-gram" for name in self.model_names for n in self.N}
+        # everything that changes the transcripts, the merge refuses shards which differ in it
+        config = {
+            "model": self.model_id,
+            "models": self.model_names,
+            "orders": self.N,
+            "samples": self.n_samples,
+            "decoder": self.registry.backend,
+            "confidence_threshold": self.confidence_threshold,
+            "confidence": self.confidence,
+            "features": self.features is not None,
+        }
+        throughput = self.inference.throughput
+        timings = {
+            "seconds": time.perf_counter() - self.created,
+            "decode_seconds": self.decode_seconds,
+            "acoustic": {"utterances": throughput.utterances, "audio_seconds": throughput.audio_seconds,
+                         "seconds": throughput.seconds},
+        }
+        path = shard_path(self.shard_dir, index, count)
+        write_shard(path, index, count, config, references, {keys[k]: v for k, v in hypotheses.items()},
+                    {keys[k]: v for k, v in wer.items()}, timings)
+        print(f"Shard {index}/{count} written to {path}")
 
     
 if __name__ == "__main__":
-    model_names = ["context", "background", "log_adapted"] # "background"
-    N = [2]
+    parser = argparse.ArgumentParser(description=ModelEvaluator.__doc__.strip())
+    parser.add_argument("-n", "--order", type=int, nargs="+", default=[2], help="n-gram orders to evaluate")
+    parser.add_argument("-m", "--models", nargs="+", default=["context", "background", "log_adapted"],
+                        help="LM names, models/<n>gram_<name>_lm.arpa")
+    parser.add_argument("--samples", type=int, default=50, help="number of test samples (-1 for all)")
+    parser.add_argument("--batch-samples", type=int, default=16000 * 60,
+                        help="max padded audio samples per acoustic model batch (0 runs utterances one by one)")
+    parser.add_argument("--decode-workers", type=int, default=None,
+                        help="beam search worker processes (default: all cores, 0 decodes in this process)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="stream the split through the pipeline instead of loading it into memory")
+    parser.add_argument("--window", type=int, default=64, help="samples in flight at once in streaming mode")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="run reading, feature extraction, inference, decoding and WER as concurrent stages")
+    parser.add_argument("--stage-workers", nargs="+", default=[], metavar="STAGE=N",
+                        help=f"workers of pipeline stages, e.g. features=4 decode=8 "
+                             f"(stages: {', '.join(PIPELINE_WORKERS)})")
+    parser.add_argument("--torch-threads", type=int, default=None, help="intra-op threads of torch in the inference stage of the pipeline")
+    parser.add_argument("--queue-size", type=int, default=8, help="capacity of the queues between pipeline stages")
+    parser.add_argument("--features", type=Path, default=None, nargs="?", const=Path("cache") / "features",
+                        help="read the audio from the feature store of the dataset export (default: cache/features) "
+                             "instead of decoding the WAV files of the dataset")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32",
+                        help="acoustic model weights, int8 quantizes the linear layers dynamically")
+    parser.add_argument("--intra-threads", type=int, default=None, help="torch intra-op threads (default: torch's)")
+    parser.add_argument("--inter-threads", type=int, default=None, help="torch inter-op threads (default: torch's)")
+    parser.add_argument("--compare-precision", action="store_true",
+                        help="report the RTF, peak memory and WER of every precision side by side, "
+                             "each measured in its own process without cached logits")
+    parser.add_argument("--benchmark", type=Path, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--arpa", action="store_true",
+                        help="load the ARPA models as text instead of converting them to KenLM binaries")
+    parser.add_argument("--decoder", choices=BACKENDS, default="pyctcdecode",
+                        help="beam search implementation, pyctcdecode or the in-project native decoder")
+    parser.add_argument("--confidence-threshold", type=float, default=None,
+                        help="send only utterances with a lower CTC confidence to the beam search, "
+                             "the others get the greedy transcript")
+    parser.add_argument("--confidence", choices=["max_posterior", "entropy"], default="max_posterior",
+                        help="per-utterance CTC confidence measure")
+    parser.add_argument("--compare-hybrid", action="store_true",
+                        help="decode with and without the greedy fast path and report the WER impact")
+    parser.add_argument("--sweep", nargs="+", metavar="PARAM=VALUES",
+                        help="sweep decoder parameters over the cached logits instead of evaluating, "
+                             "e.g. alpha=0.3,0.5,0.7 beta=0:3 beam_width=25,50,100 (ranges need --random)")
+    parser.add_argument("--random", type=int, default=0, metavar="N",
+                        help="draw N random points of the sweep space instead of taking the full grid")
+    parser.add_argument("--wer-details", type=Path, default=None, metavar="JSON",
+                        help="write the error counts of every interval, transcript and role to this file")
+    parser.add_argument("--shard", default=None, metavar="i/N",
+                        help="evaluate only every N-th row of the split from the i-th (counted from 0) on and "
+                             "write the results to a shard file, merge the shards with python -m evaluation.shards")
+    parser.add_argument("--shard-dir", type=Path, default=Path("shards"), help="where shard files are written")
+    parser.add_argument("--local-shards", type=int, default=None, metavar="N",
+                        help="run N shards as local processes and merge them")
+    parser.add_argument("--sweep-out", type=Path, default=Path("sweep.json"), help="where to write the sweep results")
+    args = parser.parse_args()
+
+    if args.compare_hybrid and (args.confidence_threshold is None or args.streaming):
+        parser.error("--compare-hybrid needs --confidence-threshold and the samples in memory (no --streaming)")
+
+    shard = None
+    if args.shard is not None or args.local_shards is not None:
+        if args.sweep or args.compare_hybrid or args.compare_precision or args.benchmark is not None:
+            parser.error("--shard and --local-shards cannot be combined with --sweep, --compare-hybrid "
+                         "or --compare-precision")
+    if args.shard is not None:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.local_shards is not None:
+        if args.shard is not None or args.local_shards < 1:
+            parser.error("--local-shards needs a positive number of shards and no --shard")
+        argv, skip = [], False
+        for a in sys.argv[1:]:
+            if not skip and a == "--local-shards":
+                skip = True
+            elif skip:
+                skip = False
+            elif not a.startswith("--local-shards="):
+                argv.append(a)
+        run_shards(argv, args.local_shards, args.shard_dir)
+        sys.exit(0)
+
+    if args.compare_precision:
+        if args.streaming or args.pipeline:
+            parser.error("--compare-precision needs the samples in memory (no --streaming or --pipeline)")
+        argv = [a for a in sys.argv[1:] if a != "--compare-precision"]
+        # every run uses the given precision flag last, so it overrides one given here
+        compare_precisions(argv)
+        sys.exit(0)
+
+    stage_workers = {}
+    for item in args.stage_workers:
+        stage, _, n = item.partition("=")
+        if stage not in PIPELINE_WORKERS or not n.isdigit():
+            parser.error(f"invalid --stage-workers {item!r}, expected STAGE=N with a stage of "
+                         f"{', '.join(PIPELINE_WORKERS)}")
+        stage_workers[stage] = int(n)
+    if args.pipeline and (args.confidence_threshold is not None or args.sweep or args.compare_hybrid):
+        parser.error("--pipeline cannot be combined with --confidence-threshold, --sweep or --compare-hybrid")
+
+    points = None
+    if args.sweep:
+        if args.streaming:
+            parser.error("--sweep needs the samples in memory, it cannot be combined with --streaming")
+        try:
+            space = parse_space(args.sweep)
+        except ValueError as e:
+            parser.error(str(e))
+        if not args.random and any(isinstance(v, tuple) for v in space.values()):
+            parser.error("ranges (low:high) can only be sampled with --random")
+        points = random_points(space, args.random) if args.random else grid(space)
+
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        evaluator = ModelEvaluator(N, model_names, n_samples=50)
-        evaluator.create_tokenizer()
-        evaluator.generate_transcripts()
-        # evaluator.print_transcripts(5)
-        evaluator.compute_wer()
-        
-    
-    
-    
-    
-    
\ No newline at end of file
+        evaluator = ModelEvaluator(args.order, args.models, n_samples=args.samples, batch_samples=args.batch_samples,
+                                   decode_workers=args.decode_workers, streaming=args.streaming or args.pipeline,
+                                   window=args.window, binary_lm=not args.arpa,
+                                   confidence_threshold=args.confidence_threshold,
+                                   confidence=args.confidence, decoder=args.decoder, features=args.features,
+                                   precision=args.precision, intra_threads=args.intra_threads,
+                                   inter_threads=args.inter_threads, wer_details=args.wer_details, shard=shard,
+                                   shard_dir=args.shard_dir)
+        try:
+            if args.benchmark is not None:
+                evaluator.benchmark(args.benchmark)
+            elif points is not None:
+                evaluator.sweep(points, output=args.sweep_out)
+            elif args.compare_hybrid:
+                evaluator.compare_hybrid()
+            elif args.pipeline:
+                evaluator.evaluate_pipeline(stage_workers, args.torch_threads, args.queue_size)
+            elif args.streaming:
+                evaluator.evaluate_streaming()
+            else:
+                evaluator.create_tokenizer()
+                evaluator.generate_transcripts()
+                # evaluator.print_transcripts(5)
+                evaluator.compute_wer()
+        finally:
+            evaluator.close()
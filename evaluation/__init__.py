@@ -0,0 +1,42 @@
+import importlib
+import sys
+from pathlib import Path
+
+# the feature store and the audio helpers are shared with the dataset generator, which is run
+# from its own directory, see asr-project/__main__.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "asr-project"))
+
+# submodule of every public name, they are imported on first access so that e.g.
+# `python -m evaluation.shards` does not load torch
+_EXPORTS = {
+    "beam_search": ["BeamSearchDecoder", "DecoderOutput", "DecoderStream", "ScoreCache"],
+    "confidence": ["ctc_confidence", "greedy_decode"],
+    "decoding": ["DEFAULT_PARAMS", "DecoderPool"],
+    "features": ["FeatureReader"],
+    "inference": ["BatchedInference", "Throughput", "make_buckets"],
+    "logits": ["LogitStore"],
+    "longform": ["AudioReader", "LongFormInference", "chunk_windows"],
+    "pipeline": ["Pipeline", "Stage", "decode_stage"],
+    "quantize": ["PRECISIONS", "load_acoustic_model", "peak_rss_mb", "quantize", "set_threads"],
+    "registry": ["BACKENDS", "Decoder", "ModelRegistry"],
+    "service": ["ServiceMetrics", "TranscriptionService"],
+    "shards": ["merge_report", "merge_shards", "parse_shard", "shard_path", "write_shard"],
+    "sweep": ["SweepResult", "grid", "parse_space", "pareto_front", "random_points"],
+    "wer": ["Vocabulary", "WerAccumulator", "WerBreakdown", "edit_counts", "utterance_wer"],
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+__all__ = sorted(_MODULES)
+
+
+def __getattr__(name: str):
+    if name not in _MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = _MODULES[name]
+    imported = importlib.import_module(f".{module}", __name__)
+    # also replaces the submodule the import bound to its name, e.g. quantize is the function
+    globals().update({n: getattr(imported, n) for n in _EXPORTS[module]})
+    return globals()[name]
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
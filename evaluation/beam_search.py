@@ -0,0 +1,362 @@
+import math
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+from .confidence import BLANK, WORD_DELIMITER, log_softmax
+from .decoding import DEFAULT_PARAMS
+
+BOS = "<s>"
+EOS = "</s>"
+LN10 = math.log(10)
+# frame log-probabilities are clipped like pyctcdecode does, so that scores stay finite
+MIN_TOKEN_LOGP = math.log(1e-15)
+NEG_INF = -np.inf
+# characters of an average word, longer unknown partial words are penalized more
+AVG_WORD_LEN = 6
+# the prefix tree of a stream is never collected below this many nodes
+COLLECT_MIN_NODES = 4096
+# tokens behind the best beam at which the text is decided even if other beams still disagree, the
+# scores of hypotheses which differ that far back no longer converge once the LM context has passed
+COMMIT_LAG = 512
+
+Context = Tuple[str, ...]
+
+
+class ScoreCache:
+    """
+    LRU cache of KenLM log10 p(word | context) scores, shared by every utterance decoded with
+    the same LM so that the (context, word) pairs the beams keep revisiting are scored once
+    """
+
+    def __init__(self, model, maxsize: int = 2 ** 20):
+        self.model = model
+        self.order = model.order
+        self.maxsize = maxsize
+        self._scores = OrderedDict()
+        self._states = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _state(self, context: Context):
+        import kenlm
+
+        state = self._states.get(context)
+        if state is not None:
+            self._states.move_to_end(context)
+            return state
+
+        state = kenlm.State()
+        words = context
+        if context and context[0] == BOS:
+            self.model.BeginSentenceWrite(state)
+            words = context[1:]
+        else:
+            self.model.NullContextWrite(state)
+        for w in words:
+            out = kenlm.State()
+            self.model.BaseScore(state, w, out)
+            state = out
+
+        self._states[context] = state
+        if len(self._states) > self.maxsize:
+            self._states.popitem(last=False)
+        return state
+
+    def score(self, context: Context, word: str) -> float:
+        import kenlm
+
+        key = (context, word)
+        score = self._scores.get(key)
+        if score is not None:
+            self.hits += 1
+            self._scores.move_to_end(key)
+            return score
+
+        self.misses += 1
+        score = self.model.BaseScore(self._state(context), word, kenlm.State())
+        self._scores[key] = score
+        if len(self._scores) > self.maxsize:
+            self._scores.popitem(last=False)
+        return score
+
+    def advance(self, context: Context, word: str) -> Context:
+        """
+        Context after a word, the last order - 1 words
+        """
+        return (context + (word,))[1 - self.order:] if self.order > 1 else ()
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+
+class DecoderOutput:
+    """
+    Transcripts of a batch, like the output of Wav2Vec2ProcessorWithLM.batch_decode
+    """
+
+    def __init__(self, text: List[str]):
+        self.text = text
+
+
+class DecoderStream:
+    """
+    State of the beam search over one utterance, logits can be fed in chunks of frames
+
+    Beams are nodes of a prefix tree of tokens, every node keeps its LM context, the word being
+    spelled and its LM score, so the frame loop only updates arrays of beam probabilities. Nodes
+    which no beam descends from any more are dropped whenever the tree has doubled, and the common
+    prefix of all the beams is committed as text.
+    """
+
+    def __init__(self, decoder: "BeamSearchDecoder"):
+        self.decoder = decoder
+        # prefix tree, node 0 is the empty prefix
+        self._parent = [-1]
+        self._token = [-1]
+        self._context = [(BOS,)]
+        self._partial = [""]
+        # LM score of the completed words, and the same with the penalty of the partial word
+        self._done = [0.0]
+        self._lm = [0.0]
+        # node whose children a node shares, itself unless it only adds delimiters to that node
+        self._same = [0]
+        self._children = {}
+        # characters of the tokens above the root, which every beam starts with
+        self._text = ""
+        # tree size at which the unreachable nodes are dropped next
+        self._collect_at = COLLECT_MIN_NODES
+
+        self.nodes = np.zeros(1, dtype=np.int64)
+        self.p_blank = np.zeros(1)
+        self.p_non_blank = np.full(1, NEG_INF)
+
+    def _child(self, node: int, token: int) -> int:
+        d = self.decoder
+        if token != d.delimiter:
+            # delimiters which end no word spell the same text as the node before them,
+            # the beams meet again on the next character like those of pyctcdecode
+            node = self._same[node]
+        key = (node, token)
+        child = self._children.get(key)
+        if child is not None:
+            return child
+
+        child = same = len(self._parent)
+        context, partial, done = self._context[node], self._partial[node], self._done[node]
+        if token == d.delimiter:
+            if partial:
+                done += d.word_score(context, partial)
+                context = d.cache.advance(context, partial)
+            else:
+                same = self._same[node]
+            partial = ""
+        else:
+            partial += d.chars[token]
+        penalty = d.partial_score(partial)
+
+        self._parent.append(node)
+        self._token.append(token)
+        self._context.append(context)
+        self._partial.append(partial)
+        self._done.append(done)
+        self._lm.append(done + penalty)
+        self._same.append(same)
+        self._children[key] = child
+        return child
+
+    def feed(self, logits: np.ndarray) -> "DecoderStream":
+        d = self.decoder
+        logp = np.clip(log_softmax(np.asarray(logits, dtype=np.float64)), MIN_TOKEN_LOGP, 0)
+        for frame in logp:
+            candidates = np.flatnonzero((frame >= d.token_min_logp) & d.emitting)
+            if len(candidates) == 0:
+                best = int(np.argmax(np.where(d.emitting, frame, NEG_INF)))
+                candidates = np.asarray([best])
+            self._step(frame, candidates)
+        return self
+
+    def _step(self, frame: np.ndarray, candidates: np.ndarray):
+        nodes, p_blank, p_non_blank = self.nodes, self.p_blank, self.p_non_blank
+        total = np.logaddexp(p_blank, p_non_blank)
+        last = np.asarray([self._token[n] for n in nodes.tolist()])
+
+        # the prefix stays the same after a blank, or after a repeat of its last token
+        stay_blank = total + frame[BLANK]
+        stay_non_blank = np.where(last >= 0, p_non_blank + frame[np.maximum(last, 0)], NEG_INF)
+        # a repeated token only extends the prefix after a blank
+        extend = np.where(candidates[None, :] == last[:, None], p_blank[:, None], total[:, None]) \
+            + frame[candidates][None, :]
+        children = [self._child(n, c) for n in nodes.tolist() for c in candidates.tolist()]
+
+        all_nodes = np.concatenate([nodes, nodes, np.asarray(children, dtype=np.int64)])
+        all_blank = np.concatenate([stay_blank, np.full(len(nodes) * (1 + len(candidates)), NEG_INF)])
+        all_non_blank = np.concatenate([np.full(len(nodes), NEG_INF), stay_non_blank, extend.reshape(-1)])
+
+        # merge the paths which end in the same prefix
+        nodes, inverse = np.unique(all_nodes, return_inverse=True)
+        p_blank = np.full(len(nodes), NEG_INF)
+        p_non_blank = np.full(len(nodes), NEG_INF)
+        np.logaddexp.at(p_blank, inverse, all_blank)
+        np.logaddexp.at(p_non_blank, inverse, all_non_blank)
+
+        score = np.logaddexp(p_blank, p_non_blank) + np.asarray([self._lm[n] for n in nodes.tolist()])
+        keep = np.flatnonzero(score >= score.max() + self.decoder.beam_prune_logp)
+        if len(keep) > self.decoder.beam_width:
+            keep = keep[np.argpartition(-score[keep], self.decoder.beam_width - 1)[:self.decoder.beam_width]]
+        self.nodes, self.p_blank, self.p_non_blank = nodes[keep], p_blank[keep], p_non_blank[keep]
+        if len(self._parent) >= self._collect_at:
+            self._collect()
+
+    def _collect(self):
+        """
+        Drop the nodes which are neither a beam nor an ancestor of one, with their children entries
+
+        The tokens down to the last node all the beams descend from can no longer change, they are
+        moved to the committed text and that node becomes the root, so the tree of a stream fed for
+        hours stays as small as the one of a single utterance. Beams which disagree with the best one
+        more than COMMIT_LAG tokens back are dropped first. The kept nodes are renumbered in the same
+        order, parents still come before their children.
+        """
+        best = int(self.nodes[np.argmax(self._scores())])
+        anchor, lag = best, 0
+        while anchor > 0 and lag < COMMIT_LAG:
+            anchor, lag = self._parent[anchor], lag + 1
+        if anchor > 0:
+            # parents have lower ids, a beam descends from the anchor if its ancestors reach it
+            agree = []
+            for n in self.nodes.tolist():
+                while n > anchor:
+                    n = self._parent[n]
+                agree.append(n == anchor)
+            agree = np.asarray(agree)
+            self.nodes, self.p_blank, self.p_non_blank = \
+                self.nodes[agree], self.p_blank[agree], self.p_non_blank[agree]
+
+        alive = set()
+        below = {}
+        for n in self.nodes.tolist():
+            while n >= 0 and n not in alive:
+                alive.add(n)
+                below.setdefault(self._parent[n], []).append(n)
+                n = self._parent[n]
+        beams = set(self.nodes.tolist())
+        root = 0
+        while root not in beams and len(below.get(root, ())) == 1:
+            root = below[root][0]
+
+        path = []
+        n = root
+        while n > 0:
+            path.append(self._token[n])
+            n = self._parent[n]
+        self._text += self._spell(reversed(path))
+
+        # the ancestors of the new root have lower ids, its descendants higher ones
+        kept = [n for n in sorted(alive) if n >= root]
+        new = {old: i for i, old in enumerate(kept)}
+        self._parent = [new.get(self._parent[n], -1) for n in kept]
+        self._token = [self._token[n] for n in kept]
+        self._context = [self._context[n] for n in kept]
+        self._partial = [self._partial[n] for n in kept]
+        self._done = [self._done[n] for n in kept]
+        self._lm = [self._lm[n] for n in kept]
+        self._same = [new.get(self._same[n], 0) for n in kept]
+        self._children = {(new[node], token): new[child] for (node, token), child in self._children.items()
+                          if child in new and node in new}
+        self.nodes = np.asarray([new[n] for n in self.nodes.tolist()], dtype=np.int64)
+        self._collect_at = max(2 * len(kept), COLLECT_MIN_NODES)
+
+    def _final_scores(self) -> np.ndarray:
+        d = self.decoder
+        scores = []
+        for n in self.nodes.tolist():
+            context, score = self._context[n], self._done[n]
+            if self._partial[n]:
+                score += d.word_score(context, self._partial[n])
+                context = d.cache.advance(context, self._partial[n])
+            scores.append(score + d.alpha * LN10 * d.cache.score(context, EOS))
+        return np.logaddexp(self.p_blank, self.p_non_blank) + np.asarray(scores)
+
+    def _spell(self, tokens: Iterable[int]) -> str:
+        return "".join(" " if t == self.decoder.delimiter else self.decoder.chars[t] for t in tokens)
+
+    def text(self, node: int) -> str:
+        tokens = []
+        while node > 0:
+            tokens.append(self._token[node])
+            node = self._parent[node]
+        return " ".join((self._text + self._spell(reversed(tokens))).split())
+
+    def _scores(self) -> np.ndarray:
+        return np.logaddexp(self.p_blank, self.p_non_blank) + np.asarray([self._lm[n] for n in self.nodes.tolist()])
+
+    def partial_text(self) -> str:
+        """
+        Best transcript of the frames fed so far, without the end of sentence
+        """
+        return self.text(int(self.nodes[np.argmax(self._scores())]))
+
+    def finalize(self) -> str:
+        return self.text(int(self.nodes[np.argmax(self._final_scores())]))
+
+
+class BeamSearchDecoder:
+    """
+    CTC prefix beam search with KenLM shallow fusion, scored like pyctcdecode: alpha weights the
+    natural-log LM score, beta is a bonus per word, words outside of the unigrams pay unk_score_offset
+    and so do partial words which do not start any unigram
+    """
+
+    def __init__(self, labels: List[str], cache: ScoreCache, unigrams: Iterable[str],
+                 alpha: float = DEFAULT_PARAMS["alpha"], beta: float = DEFAULT_PARAMS["beta"],
+                 beam_width: int = DEFAULT_PARAMS["beam_width"],
+                 beam_prune_logp: float = DEFAULT_PARAMS["beam_prune_logp"],
+                 token_min_logp: float = DEFAULT_PARAMS["token_min_logp"], unk_score_offset: float = -10.0):
+        self.labels = labels
+        # one character per token, special tokens (<s>, </s>, <unk>) are never emitted
+        self.chars = [c if len(c) == 1 else "" for c in labels]
+        self.delimiter = labels.index(WORD_DELIMITER)
+        self.emitting = np.asarray([i != BLANK and len(c) == 1 for i, c in enumerate(labels)])
+
+        self.cache = cache
+        self.unigrams: Set[str] = set(unigrams)
+        self.prefixes = {w[:i] for w in self.unigrams for i in range(1, len(w) + 1)}
+        self.alpha = alpha
+        self.beta = beta
+        self.beam_width = beam_width
+        self.beam_prune_logp = beam_prune_logp
+        self.token_min_logp = token_min_logp
+        self.unk_score_offset = unk_score_offset
+
+    def word_score(self, context: Context, word: str) -> float:
+        score = self.cache.score(context, word)
+        if word not in self.unigrams:
+            score += self.unk_score_offset
+        return self.alpha * LN10 * score + self.beta
+
+    def partial_score(self, partial: str) -> float:
+        """
+        Penalty of a partial word which does not start any unigram, growing with words longer than usual
+        """
+        if not partial or partial in self.prefixes:
+            return 0.0
+        return self.unk_score_offset * max(len(partial) / AVG_WORD_LEN, 1.0)
+
+    def stream(self) -> DecoderStream:
+        return DecoderStream(self)
+
+    def decode(self, logits: np.ndarray) -> str:
+        return self.stream().feed(logits).finalize()
+
+    def batch_decode(self, logits: Union[np.ndarray, Sequence[np.ndarray]],
+                     lengths: Optional[Sequence[int]] = None) -> DecoderOutput:
+        """
+        Decode a padded (batch, frames, vocabulary) array or a list of arrays, padded frames
+        are cut off when the lengths are given
+        """
+        if lengths is not None:
+            logits = [lg[:n] for lg, n in zip(logits, lengths)]
+        return DecoderOutput([self.decode(lg) for lg in logits])
@@ -0,0 +1,50 @@
+from typing import List
+
+import numpy as np
+
+METHODS = ["max_posterior", "entropy"]
+
+# index of the CTC blank (<pad>) in the wav2vec2 vocabulary
+BLANK = 0
+WORD_DELIMITER = "|"
+
+
+def log_softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+
+
+def greedy_decode(logits: np.ndarray, labels: List[str]) -> str:
+    """
+    Best path decoding, the argmax of every frame with repeats merged and blanks removed
+    """
+    return tokens_to_text(logits.argmax(axis=-1), labels)
+
+
+def tokens_to_text(best: np.ndarray, labels: List[str]) -> str:
+    keep = np.ones(len(best), dtype=bool)
+    keep[1:] = best[1:] != best[:-1]
+    tokens = best[keep & (best != BLANK)]
+    chars = [labels[t] for t in tokens.tolist()]
+    # special tokens (<s>, </s>, <unk>) are not characters
+    text = "".join(" " if c == WORD_DELIMITER else c for c in chars if len(c) == 1)
+    return " ".join(text.split())
+
+
+def ctc_confidence(logits: np.ndarray, method: str = "max_posterior") -> float:
+    """
+    Confidence of the acoustic model in an utterance, between 0 and 1
+
+    max_posterior is the mean probability of the best token over the frames which do not emit a blank
+    (blank frames are almost always certain and would hide the uncertain ones), entropy is one minus
+    the mean entropy of the frames normalized by its maximum
+    """
+    logp = log_softmax(logits.astype(np.float64))
+    if method == "max_posterior":
+        best = logp.max(axis=-1)
+        emitting = logp.argmax(axis=-1) != BLANK
+        return float(np.exp(best[emitting] if emitting.any() else best).mean()) if len(best) else 0.0
+    if method == "entropy":
+        entropy = -(np.exp(logp) * logp).sum(axis=-1) / np.log(logp.shape[-1])
+        return float(1 - entropy.mean()) if len(entropy) else 0.0
+    raise ValueError(f"unknown confidence method {method!r}, expected one of {', '.join(METHODS)}")
@@ -0,0 +1,100 @@
+import multiprocessing
+import time
+from typing import Dict, Hashable, List, Optional, Sequence
+
+from .logits import LogitStore
+
+# beam search parameters of both backends, alpha and beta are the LM weight and the word insertion bonus
+DEFAULT_PARAMS = {"alpha": 0.5, "beta": 1.5, "beam_width": 100, "beam_prune_logp": -10.0, "token_min_logp": -5.0}
+
+# per-process state of the decoding workers
+_registry = None
+_store: Optional[LogitStore] = None
+
+
+def _init_worker(registry, store: LogitStore):
+    global _registry, _store
+    _registry = registry
+    _store = store
+
+
+def _decode_job(job):
+    key, lm_path, params, sample_ids = job
+    # decoders are built on first use in this process and kept for the lifetime of the pool
+    decoder = _registry.decoder(lm_path, **params)
+
+    texts = []
+    seconds = 0.0
+    for s in sample_ids:
+        logits = _store.read(s)
+        start = time.perf_counter()
+        texts.append(decoder.decode(logits))
+        seconds += time.perf_counter() - start
+    return key, sample_ids, texts, seconds
+
+
+class DecoderPool:
+    """
+    Persistent pool of worker processes running the LM beam search over stored logits
+
+    Every worker gets its decoders from its copy of the model registry, which builds each of them
+    once for the lifetime of the pool with the backend of the registry (pyctcdecode or the native
+    BeamSearchDecoder), all (LM, order) combinations are scheduled in one shared job queue
+    """
+
+    def __init__(self, registry, store: LogitStore, processes: Optional[int] = None, chunk_size: int = 8):
+        self._registry = registry
+        self._chunk_size = chunk_size
+        self._processes = multiprocessing.cpu_count() if processes is None else processes
+        self._pool = None
+        # beam search time of every key in the last decode() call, summed over the workers
+        self.seconds: Dict[Hashable, float] = {}
+        if self._processes > 0:
+            self._pool = multiprocessing.Pool(self._processes, initializer=_init_worker, initargs=(registry, store))
+        else:
+            # processes=0 decodes in the calling process, which is easier to debug
+            _init_worker(registry, store)
+
+    @property
+    def processes(self) -> int:
+        return self._processes
+
+    def decode(self, lm_paths: Dict[Hashable, str], sample_ids: Sequence[str],
+               params: Dict[Hashable, dict] = None) -> Dict[Hashable, List[str]]:
+        """
+        Decode the stored logits of every sample with every LM, params optionally overrides
+        the beam search parameters (DEFAULT_PARAMS) of some of the keys,
+        returns the transcripts of each LM key in the order of sample_ids
+        """
+        params = params or {}
+        # binaries are converted here once, rather than by every worker at the same time
+        self._registry.prepare(sorted(set(map(str, lm_paths.values()))))
+        jobs = [
+            (key, str(path), params.get(key, {}), list(sample_ids[c:c + self._chunk_size]))
+            for c in range(0, len(sample_ids), self._chunk_size)
+            for key, path in lm_paths.items()
+        ]
+
+        transcripts = {key: {} for key in lm_paths}
+        self.seconds = {key: 0.0 for key in lm_paths}
+        for key, ids, texts, seconds in self.__run(jobs):
+            transcripts[key].update(zip(ids, texts))
+            self.seconds[key] += seconds
+        return {key: [texts[s] for s in sample_ids] for key, texts in transcripts.items()}
+
+    def __run(self, jobs):
+        if self._pool is None:
+            return map(_decode_job, jobs)
+        return self._pool.imap_unordered(_decode_job, jobs)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
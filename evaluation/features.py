@@ -0,0 +1,52 @@
+from pathlib import Path
+
+import numpy as np
+from metadata import FeatureStore
+from metadata.manifest import Manifest
+
+DATA_DIR = Path("hf-primock57") / "data"
+
+
+class FeatureReader:
+    """
+    Read-only access to the feature store written by `python asr-project data` (cache/features),
+    which holds every source recording resampled once, the audio of a dataset row is a zero-copy
+    slice of its memory-mapped recording instead of a decoded WAV file
+
+    The sampling rate and the normalization are the ones the dataset was exported with, as
+    recorded in the manifest of the export.
+    """
+
+    def __init__(self, root: Path = Path("cache") / "features", data_dir: Path = DATA_DIR):
+        settings = Manifest.load(Path(data_dir) / "manifest.json").settings
+        if not settings:
+            raise FileNotFoundError(f"no export manifest in {data_dir}, run `python asr-project data` first")
+        self.store = FeatureStore(root, settings["sampling_rate"], settings["normalization"])
+        if not self.store.index:
+            raise FileNotFoundError(f"no recordings in {self.store}")
+        self.sampling_rate = self.store.sampling_rate
+        self._recordings = {}
+
+    def recording(self, stem: str) -> np.ndarray:
+        audio = self._recordings.get(stem)
+        if audio is None:
+            audio = self._recordings[stem] = self.store[stem]
+        return audio
+
+    def interval(self, fname: str, start_time: float, end_time: float) -> np.ndarray:
+        """
+        Audio of an exported interval, e.g. day1_consultation01_doctor_3.wav, the time range
+        is aligned to the samples of the recording
+        """
+        stem = Path(fname).stem.rsplit("_", 1)[0]
+        return self.recording(stem)[round(start_time * self.sampling_rate):round(end_time * self.sampling_rate)]
+
+    def audio(self, row: dict) -> dict:
+        """
+        The audio of a row of the huggingface dataset, like the decoded audio feature
+        """
+        return {
+            "path": row["path"],
+            "array": self.interval(row["path"], row["start_time"], row["end_time"]),
+            "sampling_rate": self.sampling_rate,
+        }
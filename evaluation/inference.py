@@ -0,0 +1,157 @@
+import time
+from typing import List, Sequence
+
+import numpy as np
+import torch
+from metadata.audio import SAMPLING_RATE
+from torch.nn.utils.rnn import pad_sequence
+
+# shortest input of wav2vec2, the receptive field of one logit frame
+MIN_SAMPLES = 400
+
+
+def make_buckets(lengths: Sequence[int], max_samples: int) -> List[List[int]]:
+    """
+    Group sample indices into batches of similar length, so that the padded size
+    (batch size * longest sample) of every batch stays under max_samples,
+    a sample longer than the budget gets a batch of its own
+    """
+    order = np.argsort(np.asarray(lengths), kind="stable")
+    buckets = []
+    current = []
+    longest = 0
+    for i in order:
+        length = int(lengths[i])
+        if current and max(longest, length) * (len(current) + 1) > max_samples:
+            buckets.append(current)
+            current = []
+            longest = 0
+        current.append(int(i))
+        longest = max(longest, length)
+
+    if current:
+        buckets.append(current)
+    return buckets
+
+
+class Throughput:
+    """
+    Accumulates the amount of processed audio and the time it took
+    """
+
+    def __init__(self, sampling_rate: int = SAMPLING_RATE):
+        self.sampling_rate = sampling_rate
+        self.utterances = 0
+        self.audio_samples = 0
+        self.seconds = 0.0
+
+    def add(self, utterances: int, audio_samples: int, seconds: float):
+        self.utterances += utterances
+        self.audio_samples += audio_samples
+        self.seconds += seconds
+
+    @property
+    def audio_seconds(self) -> float:
+        return self.audio_samples / self.sampling_rate
+
+    @property
+    def utterances_per_sec(self) -> float:
+        return self.utterances / self.seconds if self.seconds else 0.0
+
+    @property
+    def rtf(self) -> float:
+        """
+        Real-time factor, processing time divided by the duration of the processed audio
+        """
+        return self.seconds / self.audio_seconds if self.audio_samples else 0.0
+
+    def __str__(self):
+        return f"{self.utterances} utterances, {self.utterances_per_sec:.2f} utt/s, RTF {self.rtf:.3f}"
+
+
+class BatchedInference:
+    """
+    Runs the acoustic model over length-bucketed, padded batches of utterances
+
+    The logits of an utterance do not depend on the others in its batch. Models with group norm in
+    the feature encoder (e.g. wav2vec2-base) were trained without attention masks, and the group norm
+    of their first conv layer normalizes every channel over the whole input, padding included. That
+    layer runs on every utterance alone, the rest of the model (convolutions without padding, and the
+    transformer with a mask of the valid frames) runs on the padded batch.
+    """
+
+    def __init__(self, model, feature_extractor, max_samples: int = 16000 * 60):
+        self.model = model
+        self.feature_extractor = feature_extractor
+        self.max_samples = max_samples
+        self.throughput = Throughput(feature_extractor.sampling_rate)
+
+    def buckets(self, lengths: Sequence[int]) -> List[List[int]]:
+        return make_buckets(lengths, self.max_samples)
+
+    def __call__(self, audios: List[np.ndarray], sampling_rate: int) -> List[np.ndarray]:
+        """
+        Compute the logits of every utterance, returned in the order of the input
+        """
+        logits = [None] * len(audios)
+        for bucket in self.buckets([len(a) for a in audios]):
+            for i, lg in zip(bucket, self.forward([audios[i] for i in bucket], sampling_rate)):
+                logits[i] = lg
+        return logits
+
+    def forward(self, audios: List[np.ndarray], sampling_rate: int) -> List[np.ndarray]:
+        """
+        Run one batch through the model and strip the padding from the output
+        """
+        start = time.perf_counter()
+        # the feature extractor normalizes every utterance over its own samples
+        inputs = self.feature_extractor(audios, sampling_rate=sampling_rate, padding=True,
+                                        return_attention_mask=True, return_tensors="pt")
+        logits = self._logits([v[:len(a)] for v, a in zip(inputs["input_values"], audios)])
+        self.throughput.add(len(audios), sum(len(a) for a in audios), time.perf_counter() - start)
+        return logits
+
+    def extract(self, audio: np.ndarray, sampling_rate: int) -> np.ndarray:
+        """
+        Input values of one utterance, normalized by the feature extractor but not padded
+        """
+        return self.feature_extractor(audio, sampling_rate=sampling_rate, return_tensors="np")["input_values"][0]
+
+    def forward_features(self, values: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        Run one batch of input values from extract() through the model, the same as forward() on the audio
+        """
+        start = time.perf_counter()
+        logits = self._logits([torch.from_numpy(np.asarray(v, dtype=np.float32)) for v in values])
+        self.throughput.add(len(values), sum(len(v) for v in values), time.perf_counter() - start)
+        return logits
+
+    def _logits(self, values: List[torch.Tensor]) -> List[np.ndarray]:
+        lengths = torch.tensor([len(v) for v in values])
+        frames = self.model._get_feat_extract_output_lengths(lengths)
+        with torch.no_grad():
+            if self.feature_extractor.return_attention_mask:
+                input_values = pad_sequence(values, batch_first=True, padding_value=self.feature_extractor.padding_value)
+                attention_mask = (torch.arange(input_values.shape[1])[None, :] < lengths[:, None]).long()
+                logits = self.model(input_values, attention_mask=attention_mask).logits
+            else:
+                logits = self._unmasked_logits(values, frames)
+        return [lg[:n] for lg, n in zip(logits.numpy(), frames.tolist())]
+
+    def _unmasked_logits(self, values: List[torch.Tensor], frames: torch.Tensor) -> torch.Tensor:
+        """
+        Wav2Vec2ForCTC.forward with the group norm layer applied to every utterance alone
+        """
+        base = self.model.base_model
+        conv = base.feature_extractor.conv_layers
+        first = [conv[0](v[None, None])[0].T for v in values]
+        hidden = pad_sequence(first, batch_first=True).transpose(1, 2)
+        for layer in conv[1:]:
+            hidden = layer(hidden)
+
+        mask = torch.arange(hidden.shape[-1])[None, :] < frames[:, None]
+        hidden, _ = base.feature_projection(hidden.transpose(1, 2))
+        hidden = base.encoder(hidden, attention_mask=mask).last_hidden_state
+        if base.adapter is not None:
+            hidden = base.adapter(hidden)
+        return self.model.lm_head(hidden)
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import re
+from pathlib import Path
+from typing import Iterable, List
+
+import numpy as np
+
+
+class LogitStore:
+    """
+    On-disk store of acoustic model logits, keyed by (acoustic model id, sample id)
+
+    Every sample is kept in its own .npy file, so it can be memory-mapped back
+    without touching the rest of the store
+    """
+
+    __slug_re = re.compile(r"[^\w.-]+")
+
+    def __init__(self, root: Path, model_id: str, dtype="float32"):
+        self._model_id = model_id
+        self._dtype = np.dtype(dtype)
+        self._path = Path(root) / re.sub(self.__slug_re, "_", model_id) / self._dtype.name
+        self._path.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def model_id(self) -> str:
+        return self._model_id
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    def path(self, sample_id: str) -> Path:
+        digest = hashlib.sha1(sample_id.encode()).hexdigest()
+        return self._path / digest[:2] / f"{digest}.npy"
+
+    def missing(self, sample_ids: Iterable[str]) -> List[str]:
+        return [s for s in sample_ids if s not in self]
+
+    def read(self, sample_id: str, dtype="float32") -> np.ndarray:
+        """
+        Return the logits of a sample as an array of the requested dtype,
+        this is a zero-copy view of the memory-mapped file when the dtypes match
+        """
+        return np.asarray(self[sample_id], dtype=dtype)
+
+    def __contains__(self, sample_id: str) -> bool:
+        return self.path(sample_id).exists()
+
+    def __getitem__(self, sample_id: str) -> np.ndarray:
+        path = self.path(sample_id)
+        if not path.exists():
+            raise KeyError(sample_id)
+        return np.load(path, mmap_mode="r")
+
+    def __setitem__(self, sample_id: str, logits: np.ndarray):
+        logits = np.asarray(logits)
+        if logits.ndim == 3:
+            # drop the batch dimension of a single utterance
+            if logits.shape[0] != 1:
+                raise ValueError(f"Expected logits of one utterance, got shape {logits.shape}")
+            logits = logits[0]
+
+        path = self.path(sample_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first, so that an interrupted run never leaves a truncated entry
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            np.save(f, logits.astype(self._dtype, copy=False))
+        os.replace(tmp, path)
+
+    def __str__(self):
+        return f"LogitStore(model={self._model_id}, dtype={self._dtype.name}, path={self._path})"
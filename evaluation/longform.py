@@ -0,0 +1,172 @@
+import argparse
+import time
+import warnings
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from metadata.audio import SAMPLING_RATE, read_frames
+
+from .confidence import tokens_to_text
+from .inference import MIN_SAMPLES, BatchedInference, Throughput
+
+
+class AudioReader:
+    """
+    Reads sample ranges of a long recording at the sampling rate of the model,
+    without decoding the rest of the file
+    """
+
+    def __init__(self, path: Path, sampling_rate: int = SAMPLING_RATE):
+        import soundfile
+
+        self._file = soundfile.SoundFile(str(path))
+        self.sampling_rate = sampling_rate
+        # length of the recording at the target rate
+        self.samples = -(-self._file.frames * sampling_rate // self._file.samplerate)
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        return read_frames(self._file, start, end, self.sampling_rate)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def chunk_windows(total: int, chunk: int, left: int, right: int) -> List[Tuple[int, int, int, int]]:
+    """
+    (start, end, keep_start, keep_end) sample ranges of overlapping windows over a recording,
+    consecutive windows overlap by left + right samples and the kept ranges tile the recording
+
+    A last window shorter than the input the model accepts is merged into the one before it.
+    """
+    step = chunk - left - right
+    if step <= 0:
+        raise ValueError("the chunk must be longer than the two strides")
+    if chunk < MIN_SAMPLES:
+        raise ValueError(f"the chunk must be at least {MIN_SAMPLES} samples")
+    if total < MIN_SAMPLES:
+        raise ValueError(f"the recording is shorter than {MIN_SAMPLES} samples")
+
+    windows = []
+    start = 0
+    while True:
+        end = min(start + chunk, total)
+        keep_start = start + left if start > 0 else 0
+        keep_end = end - right if end < total else total
+        if end - start < MIN_SAMPLES:
+            start, _, keep_start, _ = windows.pop()
+        windows.append((start, end, keep_start, keep_end))
+        if end >= total:
+            return windows
+        start += step
+
+
+class LongFormInference:
+    """
+    Runs the acoustic model over a whole recording in overlapping fixed-size chunks
+
+    Every chunk keeps only the logits of its middle part, the frames next to a chunk boundary
+    have seen too little context and are taken from the neighbouring chunk instead. Chunks are
+    batched, so memory only depends on the chunk size and the batch size.
+    """
+
+    def __init__(self, model, feature_extractor, chunk_s: float = 20.0, stride_s: Tuple[float, float] = (4.0, 4.0),
+                 batch_size: int = 4):
+        self.sampling_rate = feature_extractor.sampling_rate
+        # samples per logit frame, 320 for wav2vec2, every boundary is aligned to it
+        self.ratio = model.config.inputs_to_logits_ratio
+
+        def samples(seconds):
+            return int(round(seconds * self.sampling_rate / self.ratio)) * self.ratio
+
+        self.chunk = samples(chunk_s)
+        self.left, self.right = samples(stride_s[0]), samples(stride_s[1])
+        self.batch_size = batch_size
+        self.inference = BatchedInference(model, feature_extractor, max_samples=self.chunk * batch_size)
+
+    @property
+    def throughput(self) -> Throughput:
+        return self.inference.throughput
+
+    def logits(self, path: Path) -> Iterator[np.ndarray]:
+        """
+        Logits of a recording, one stitched piece per chunk in the order of the audio
+        """
+        with AudioReader(path, self.sampling_rate) as audio:
+            windows = chunk_windows(audio.samples, self.chunk, self.left, self.right)
+            for b in range(0, len(windows), self.batch_size):
+                batch = windows[b:b + self.batch_size]
+                logits = self.inference([audio.read(start, end) for start, end, _, _ in batch], self.sampling_rate)
+                for (start, end, keep_start, keep_end), lg in zip(batch, logits):
+                    stop = None if keep_end >= audio.samples else (keep_end - start) // self.ratio
+                    yield lg[(keep_start - start) // self.ratio:stop]
+
+    def transcribe(self, path: Path, labels: List[str], decoder=None) -> str:
+        """
+        Decode a recording while its logits are computed, with the streaming beam search of a
+        native decoder or greedily when there is none, the stream commits the text all its beams
+        agree on so that its memory does not grow with the recording
+        """
+        if decoder is not None:
+            stream = decoder.stream()
+            for lg in self.logits(path):
+                stream.feed(lg)
+            return stream.finalize()
+
+        best = [lg.argmax(axis=-1) for lg in self.logits(path)]
+        return tokens_to_text(np.concatenate(best) if best else np.zeros(0, dtype=np.int64), labels)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m evaluation.longform",
+                                     description="Transcribe whole recordings in overlapping chunks")
+    parser.add_argument("audio", type=Path, nargs="+", help="e.g. primock57/audio/day1_consultation01_doctor.wav")
+    parser.add_argument("--lm", type=Path, help="ARPA model for the beam search (default: greedy decoding)")
+    parser.add_argument("--chunk", type=float, default=20.0, help="chunk length in seconds")
+    parser.add_argument("--stride", type=float, nargs=2, default=[4.0, 4.0], metavar=("LEFT", "RIGHT"),
+                        help="seconds of context dropped on each side of a chunk")
+    parser.add_argument("--batch", type=int, default=4, help="chunks per acoustic model batch")
+    parser.add_argument("--out-dir", type=Path, default=Path("outputs") / "longform",
+                        help="transcripts are written to <out-dir>/<audio stem>.txt")
+    args = parser.parse_args(argv)
+
+    import soundfile
+    from transformers import AutoProcessor, Wav2Vec2ForCTC
+
+    from .registry import ModelRegistry
+
+    pre_trained_model = "facebook/wav2vec2-base-960h"
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        processor = AutoProcessor.from_pretrained(pre_trained_model)
+        model = Wav2Vec2ForCTC.from_pretrained(pre_trained_model)
+    model.eval()
+    vocab = processor.tokenizer.get_vocab()
+    labels = [k.lower() for k, _ in sorted(vocab.items(), key=lambda item: item[1])]
+
+    decoder = None
+    if args.lm is not None:
+        decoder = ModelRegistry(labels, backend="native").decoder(args.lm)
+
+    longform = LongFormInference(model, processor.feature_extractor, args.chunk, tuple(args.stride), args.batch)
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    for path in args.audio:
+        start = time.perf_counter()
+        text = longform.transcribe(path, labels, decoder)
+        seconds = time.perf_counter() - start
+        (args.out_dir / f"{path.stem}.txt").write_text(text + "\n")
+        duration = soundfile.info(str(path)).duration
+        print(f"{path}: {len(text.split())} words, {duration:.0f}s of audio in {seconds:.1f}s "
+              f"(RTF {seconds / duration:.3f})")
+    print(f"Acoustic model: RTF {longform.throughput.rtf:.3f}")
+    print(f"[DONE] transcripts in {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
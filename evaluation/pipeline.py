@@ -0,0 +1,241 @@
+import multiprocessing
+import queue
+import threading
+import time
+from functools import partial
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Sequence
+
+from .decoding import _decode_job, _init_worker
+
+# marks the end of the stream on a queue, one per worker of the consuming stage
+_END = object()
+
+
+def _init_process(threads: Optional[int], initializer: Optional[Callable], initargs: tuple):
+    if threads is not None:
+        import torch
+
+        torch.set_num_threads(threads)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+class Stage:
+    """
+    One step of a pipeline, its workers take up to batch_size items from the input queue, map them
+    with fn (a list of items to a list of outputs) and put the outputs on the queue of the next stage
+
+    The workers are threads, with processes=True every thread hands its batches to a pool of as many
+    worker processes (fn must then be picklable), which is what GIL-bound Python code needs
+
+    threads is the intra-op thread budget of torch for the stage, every worker process of a process
+    stage gets its own, torch has only one budget for all the threads of a process, which goes to
+    the one thread stage with a budget (see Pipeline)
+    """
+
+    def __init__(self, name: str, fn: Callable[[list], list], workers: int = 1, batch_size: int = 1,
+                 queue_size: int = 8, processes: bool = False, initializer: Callable = None, initargs: tuple = (),
+                 threads: Optional[int] = None):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.batch_size = batch_size
+        self.processes = processes
+        self.threads = threads
+        self.initializer = initializer
+        self.initargs = initargs
+        self.input = queue.Queue(maxsize=queue_size)
+
+        self._pool = None
+        self._lock = threading.Lock()
+        self._running = 0
+        self.items = 0
+        self.busy = 0.0
+        self.depth_sum = 0
+        self.depth_max = 0
+        self.gets = 0
+
+    def start(self, output: queue.Queue, consumers: int, errors: list) -> List[threading.Thread]:
+        if self.processes:
+            self._pool = multiprocessing.Pool(self.workers, initializer=_init_process,
+                                              initargs=(self.threads, self.initializer, self.initargs))
+        elif self.initializer is not None:
+            self.initializer(*self.initargs)
+
+        self._running = self.workers
+        threads = [threading.Thread(target=self._work, args=(output, consumers, errors), daemon=True,
+                                    name=f"{self.name}-{i}") for i in range(self.workers)]
+        for t in threads:
+            t.start()
+        return threads
+
+    def _get(self):
+        depth = self.input.qsize()
+        item = self.input.get()
+        with self._lock:
+            self.gets += 1
+            self.depth_sum += depth
+            self.depth_max = max(self.depth_max, depth)
+        return item
+
+    def _work(self, output: queue.Queue, consumers: int, errors: list):
+        done = False
+        while not done:
+            batch = []
+            item = self._get()
+            # take what is already waiting, without holding back the first item
+            while item is not _END:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.input.get_nowait()
+                except queue.Empty:
+                    break
+            done = item is _END
+            if not batch or errors:
+                # after an error the stream is only drained, so that no producer blocks forever
+                continue
+
+            start = time.perf_counter()
+            try:
+                outputs = self._pool.apply(self.fn, (batch,)) if self._pool is not None else self.fn(batch)
+            except Exception as e:
+                errors.append(e)
+                continue
+            with self._lock:
+                self.busy += time.perf_counter() - start
+                self.items += len(batch)
+            for out in outputs:
+                output.put(out)
+
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if last:
+            for _ in range(consumers):
+                output.put(_END)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    @property
+    def mean_depth(self) -> float:
+        return self.depth_sum / self.gets if self.gets else 0.0
+
+    def utilization(self, seconds: float) -> float:
+        """
+        Fraction of the time the workers of the stage were busy
+        """
+        return self.busy / (self.workers * seconds) if seconds else 0.0
+
+
+class Pipeline:
+    """
+    Stages connected by bounded queues, every stage runs concurrently with the others, so reading,
+    feature extraction, inference and decoding overlap instead of running one phase after the other
+
+    A full queue blocks the stage feeding it, so memory stays bounded by the queue sizes. The thread
+    budget of torch in this process is the one of the thread stage which has one, e.g. the stage
+    running the acoustic model, while the others (feature extraction, WER) do not run torch.
+    """
+
+    def __init__(self, stages: Sequence[Stage]):
+        self.stages = list(stages)
+        budgets = [st for st in self.stages if not st.processes and st.threads is not None]
+        if len(budgets) > 1:
+            raise ValueError(f"torch has one thread budget per process, only one of the thread stages "
+                             f"{', '.join(st.name for st in budgets)} can have one")
+        self.torch_threads = budgets[0].threads if budgets else None
+        self.seconds = 0.0
+
+    def run(self, source: Iterable) -> Iterator:
+        """
+        Feed the items of source through the stages, yields the outputs of the last stage as they come
+        """
+        import torch
+
+        threads = torch.get_num_threads()
+        if self.torch_threads is not None:
+            torch.set_num_threads(self.torch_threads)
+
+        errors = []
+        output = queue.Queue()
+        start = time.perf_counter()
+        try:
+            workers = []
+            for stage, after in zip(self.stages, self.stages[1:] + [None]):
+                workers += stage.start(after.input if after else output, after.workers if after else 1, errors)
+
+            def feed():
+                first = self.stages[0]
+                try:
+                    for item in source:
+                        if errors:
+                            break
+                        first.input.put(item)
+                except Exception as e:
+                    errors.append(e)
+                for _ in range(first.workers):
+                    first.input.put(_END)
+
+            feeder = threading.Thread(target=feed, daemon=True, name="source")
+            feeder.start()
+            try:
+                while (item := output.get()) is not _END:
+                    yield item
+            except GeneratorExit:
+                # closed before the end of the stream, the stages drop what is left as after an error,
+                # so that no thread stays blocked on a full queue when the pools are shut down
+                errors.append(GeneratorExit())
+                raise
+            finally:
+                feeder.join()
+                for t in workers:
+                    t.join()
+        finally:
+            self.seconds = time.perf_counter() - start
+            for stage in self.stages:
+                stage.close()
+            torch.set_num_threads(threads)
+        if errors:
+            raise errors[0]
+
+    def report(self) -> str:
+        """
+        Table of the stages, the busiest one is the bottleneck: give it more workers (or the others fewer)
+        """
+        lines = [f"{'stage':>10} {'workers':>8} {'items':>7} {'busy':>8} {'util':>6} {'queue':>12}"]
+        for stage in self.stages:
+            lines.append(f"{stage.name:>10} {stage.workers:>8} {stage.items:>7} {stage.busy:>7.2f}s "
+                         f"{100 * stage.utilization(self.seconds):>5.1f}% "
+                         f"{stage.mean_depth:>5.1f}/{stage.input.maxsize:<3} max {stage.depth_max}")
+        bottleneck = max(self.stages, key=lambda s: s.utilization(self.seconds))
+        lines.append(f"{self.seconds:.2f}s in total, bottleneck: {bottleneck.name}")
+        return "\n".join(lines)
+
+
+def _decode_samples(lm_paths: Dict[Hashable, str], params: dict, samples: list) -> list:
+    """
+    Decode a batch of (sample id, reference) with every LM, returns (sample id, reference, {key: text})
+    """
+    ids = [s for s, _ in samples]
+    texts = {key: _decode_job((key, path, params, ids))[2] for key, path in lm_paths.items()}
+    return [(s, ref, {key: texts[key][i] for key in lm_paths}) for i, (s, ref) in enumerate(samples)]
+
+
+def decode_stage(registry, store, lm_paths: Dict[Hashable, str], workers: int, batch_size: int = 8,
+                 queue_size: int = 32, params: dict = None) -> Stage:
+    """
+    Beam search stage over the stored logits of (sample id, reference) items, in worker processes
+    which build their decoders once from their copy of the model registry, workers=0 decodes in a thread
+    """
+    lm_paths = {key: str(path) for key, path in lm_paths.items()}
+    # binaries are converted here once, rather than by every worker at the same time
+    registry.prepare(sorted(set(lm_paths.values())))
+    return Stage("decode", partial(_decode_samples, lm_paths, params or {}), workers=max(workers, 1),
+                 batch_size=batch_size, queue_size=queue_size, processes=workers > 0,
+                 initializer=_init_worker, initargs=(registry, store))
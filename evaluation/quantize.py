@@ -0,0 +1,114 @@
+import itertools
+import os
+import re
+import resource
+import warnings
+from pathlib import Path
+from typing import Optional
+
+PRECISIONS = ["fp32", "int8"]
+
+
+def set_threads(intra_op: Optional[int] = None, inter_op: Optional[int] = None):
+    """
+    Thread pools of torch, intra_op threads run one operator and inter_op threads run independent
+    operators, the inter-op pool can only be sized before torch runs anything in parallel
+    """
+    import torch
+
+    if intra_op is not None:
+        torch.set_num_threads(intra_op)
+    if inter_op is not None:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError as e:
+            warnings.warn(f"cannot set the inter-op threads: {e}")
+
+
+def quantize(model):
+    """
+    Dynamic int8 quantization of the linear layers (attention and feed-forward of the transformer),
+    weights are stored as int8 and activations are quantized on the fly, the convolutional
+    feature encoder stays in fp32
+    """
+    import torch
+    from torch.ao.quantization import quantize_dynamic
+
+    return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _save(model, path: Path):
+    """
+    The fp32 tensors of a quantized model and the int8 weights, scales and zero points of its
+    linear layers, everything as plain tensors
+    """
+    import torch
+    from torch.ao.nn.quantized.dynamic import Linear
+
+    int8 = {}
+    for name, module in model.named_modules():
+        if isinstance(module, Linear):
+            weight, bias = module._weight_bias()
+            int8[name] = {"int_repr": weight.int_repr(), "scale": weight.q_scale(),
+                          "zero_point": weight.q_zero_point(), "bias": bias}
+    fp32 = {k: v for k, v in model.state_dict().items() if isinstance(v, torch.Tensor) and not v.is_quantized
+            and k.rpartition("._packed_params")[0] not in int8}
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    torch.save({"fp32": fp32, "int8": int8}, tmp)
+    os.replace(tmp, path)
+
+
+def _load(config, path: Path):
+    import torch
+    from torch.ao.nn.quantized.dynamic import Linear
+    from transformers import Wav2Vec2ForCTC
+
+    cached = torch.load(path)
+    # the structure of the model without allocating (or initializing) any weight
+    with torch.device("meta"):
+        model = Wav2Vec2ForCTC(config)
+    # the linear layers which are replaced below stay on the meta device
+    model.load_state_dict(cached["fp32"], strict=False, assign=True)
+    for name, w in cached["int8"].items():
+        parent, _, attr = name.rpartition(".")
+        linear = model.get_submodule(name)
+        quantized = Linear(linear.in_features, linear.out_features, bias_=linear.bias is not None, dtype=torch.qint8)
+        weight = torch._make_per_tensor_quantized_tensor(w["int_repr"], w["scale"], w["zero_point"])
+        quantized.set_weight_bias(weight, w["bias"])
+        setattr(model.get_submodule(parent) if parent else model, attr, quantized)
+
+    if any(t.is_meta for t in itertools.chain(model.parameters(), model.buffers())):
+        raise ValueError(f"{path} does not hold every weight of the model")
+    return model.eval()
+
+
+def load_acoustic_model(name: str, precision: str = "fp32", cache_dir: Path = Path("cache") / "quantized"):
+    """
+    Wav2Vec2ForCTC in eval mode, the int8 model is quantized once and kept in cache_dir,
+    from where it loads without reading the fp32 checkpoint
+    """
+    from transformers import AutoConfig, Wav2Vec2ForCTC
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"unknown precision {precision!r}, expected one of {', '.join(PRECISIONS)}")
+    if precision == "fp32":
+        return Wav2Vec2ForCTC.from_pretrained(name).eval()
+
+    slug = re.sub(r"[^\w.-]+", "_", name)
+    path = Path(cache_dir) / f"{slug}-int8.pt"
+    if path.exists():
+        return _load(AutoConfig.from_pretrained(name), path)
+
+    model = quantize(Wav2Vec2ForCTC.from_pretrained(name).eval())
+    _save(model, path)
+    return model
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident memory of this process
+    """
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import warnings
+from pathlib import Path
+from typing import List, Optional, Union
+
+from .beam_search import BeamSearchDecoder, ScoreCache
+from .decoding import DEFAULT_PARAMS
+
+BACKENDS = ["pyctcdecode", "native"]
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha1()
+    with Path(path).open("rb") as f:
+        while chunk := f.read(2 ** 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Decoder:
+    """
+    pyctcdecode beam search with a fixed set of decoding parameters
+    """
+
+    def __init__(self, beam_search, params: dict):
+        self.beam_search = beam_search
+        self.params = params
+
+    def decode(self, logits) -> str:
+        return self.beam_search.decode(logits, **self.params)
+
+
+class ModelRegistry:
+    """
+    Hands out KenLM models and ready-to-use decoders
+
+    ARPA files are converted to the binary format once, the binaries are kept in cache_dir
+    under the hash of the ARPA file, together with the unigrams the decoder needs (a binary
+    model does not list them). Models and decoders are built once per process and shared
+    by every caller asking for the same LM and parameters.
+
+    The decoders are pyctcdecode beam searches, or with backend="native" the in-project
+    BeamSearchDecoder, whose decoders of the same LM share one cache of LM scores.
+    """
+
+    def __init__(self, labels: Optional[List[str]] = None, models_dir: Path = Path("models"),
+                 cache_dir: Path = Path("cache") / "kenlm", binary: bool = True, build_binary: Optional[str] = None,
+                 data_structure: str = "trie", quantize: Optional[int] = 8, backend: str = "pyctcdecode"):
+        if backend not in BACKENDS:
+            raise ValueError(f"unknown decoder backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+        self.labels = labels
+        self.backend = backend
+        self.models_dir = Path(models_dir)
+        self.cache_dir = Path(cache_dir)
+        self.binary = binary
+        self.build_binary = build_binary or shutil.which("build_binary")
+        self.data_structure = data_structure
+        # bits of the quantized probabilities and backoffs, only the trie supports quantization
+        self.quantize = quantize if data_structure == "trie" else None
+        # str(arpa path) -> {"size", "mtime_ns", "sha1"}, read from cache_dir on first use
+        self._index = None
+        self._models = {}
+        self._unigrams = {}
+        self._decoders = {}
+        self._caches = {}
+        self._warned = False
+
+    def __getstate__(self):
+        # loaded models cannot be pickled, worker processes load their own
+        state = self.__dict__.copy()
+        state.update(_index=None, _models={}, _unigrams={}, _decoders={}, _caches={})
+        return state
+
+    def arpa_path(self, name: str, n: int) -> Path:
+        return self.models_dir / f"{n}gram_{name}_lm.arpa"
+
+    def digest(self, arpa: Path) -> str:
+        """
+        Hash of an ARPA file, only recomputed when its size or modification time changed
+        """
+        index_path = self.cache_dir / "index.json"
+        if self._index is None:
+            self._index = json.loads(index_path.read_text()) if index_path.exists() else {}
+
+        st = arpa.stat()
+        rec = self._index.get(str(arpa))
+        if rec is None or rec["size"] != st.st_size or rec["mtime_ns"] != st.st_mtime_ns:
+            rec = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": _file_digest(arpa)}
+            self._index[str(arpa)] = rec
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp = index_path.with_name(f".{index_path.name}.{os.getpid()}")
+            tmp.write_text(json.dumps(self._index))
+            os.replace(tmp, index_path)
+        return rec["sha1"]
+
+    def binary_path(self, arpa: Path) -> Path:
+        suffix = f".q{self.quantize}" if self.quantize else ""
+        return self.cache_dir / f"{self.digest(arpa)}.{self.data_structure}{suffix}.binary"
+
+    def resolve(self, arpa: Union[str, Path]) -> Path:
+        """
+        Path of the model KenLM should load for an ARPA file, its binary (converted on first use)
+        or the ARPA file itself when binaries are disabled or build_binary is not installed
+        """
+        arpa = Path(arpa)
+        if not self.binary:
+            return arpa
+        path = self.binary_path(arpa)
+        if path.exists():
+            return path
+
+        if self.build_binary is None:
+            if not self._warned:
+                warnings.warn("KenLM build_binary was not found on PATH, the ARPA models are loaded as text")
+                self._warned = True
+            return arpa
+
+        cmd = [self.build_binary, "-s"]
+        if self.quantize:
+            cmd += ["-q", str(self.quantize), "-b", str(self.quantize)]
+        tmp = path.with_name(f".{path.name}.{os.getpid()}")
+        print(f"Converting {arpa} to {self.data_structure} binary...", end=" ")
+        subprocess.run(cmd + [self.data_structure, str(arpa), str(tmp)], check=True, stdout=subprocess.DEVNULL)
+        os.replace(tmp, path)
+        print("[DONE]")
+        return path
+
+    def prepare(self, arpas: List[Union[str, Path]]):
+        """
+        Convert models and extract their unigrams up front, so that worker processes only read the cache
+        """
+        for arpa in arpas:
+            self.resolve(arpa)
+            self.unigrams(arpa)
+
+    def unigrams(self, arpa: Union[str, Path]) -> List[str]:
+        arpa = Path(arpa)
+        if str(arpa) not in self._unigrams:
+            path = self.cache_dir / f"{self.digest(arpa)}.unigrams"
+            if path.exists():
+                unigrams = path.read_text(encoding="utf-8").split("\n")
+            else:
+                from pyctcdecode.language_model import load_unigram_set_from_arpa
+                unigrams = sorted(load_unigram_set_from_arpa(str(arpa)))
+                tmp = path.with_name(f".{path.name}.{os.getpid()}")
+                tmp.write_text("\n".join(unigrams), encoding="utf-8")
+                os.replace(tmp, path)
+            self._unigrams[str(arpa)] = unigrams
+        return self._unigrams[str(arpa)]
+
+    def model(self, arpa: Union[str, Path]):
+        """
+        KenLM model of an ARPA file, loaded once per process
+        """
+        import kenlm
+
+        if str(arpa) not in self._models:
+            self._models[str(arpa)] = kenlm.Model(str(self.resolve(arpa)))
+        return self._models[str(arpa)]
+
+    def score_cache(self, arpa: Union[str, Path]) -> ScoreCache:
+        if str(arpa) not in self._caches:
+            self._caches[str(arpa)] = ScoreCache(self.model(arpa))
+        return self._caches[str(arpa)]
+
+    def decoder(self, lm: Union[str, Path], n: Optional[int] = None, **params) -> Union[Decoder, BeamSearchDecoder]:
+        """
+        Decoder of an LM, given by name and order or by the path of its ARPA file, with the
+        beam search parameters of DEFAULT_PARAMS overridden by params
+
+        Decoders of the same LM share one loaded model whatever their parameters
+        """
+        if self.labels is None:
+            raise ValueError("the registry needs the labels of the acoustic model to build decoders")
+        arpa = self.arpa_path(lm, n) if n is not None else Path(lm)
+        params = {**DEFAULT_PARAMS, **params}
+        key = (str(arpa), *sorted(params.items()))
+        if key not in self._decoders and self.backend == "native":
+            self._decoders[key] = BeamSearchDecoder(self.labels, self.score_cache(arpa), self.unigrams(arpa), **params)
+        elif key not in self._decoders:
+            from pyctcdecode.alphabet import Alphabet
+            from pyctcdecode.decoder import BeamSearchDecoderCTC
+            from pyctcdecode.language_model import LanguageModel
+
+            language_model = LanguageModel(self.model(arpa), self.unigrams(arpa),
+                                           alpha=params.pop("alpha"), beta=params.pop("beta"))
+            beam_search = BeamSearchDecoderCTC(Alphabet.build_alphabet(self.labels), language_model)
+            self._decoders[key] = Decoder(beam_search, params)
+        return self._decoders[key]
@@ -0,0 +1,298 @@
+import argparse
+import asyncio
+import io
+import json
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+from metadata.audio import SAMPLING_RATE, decode_audio
+
+from .confidence import greedy_decode
+from .inference import MIN_SAMPLES, BatchedInference
+
+# larger uploads are refused, about 25 minutes of 16-bit stereo audio at 16 kHz
+MAX_BODY = 100 * 2 ** 20
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 411: "Length Required",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+def read_wav(data: bytes, sampling_rate: int = SAMPLING_RATE) -> np.ndarray:
+    """
+    Decode an uploaded audio file to mono float32 at the sampling rate of the model
+    """
+    return decode_audio(io.BytesIO(data), sampling_rate)
+
+
+class ServiceMetrics:
+    """
+    Latency of the last requests and throughput since the start of the service
+    """
+
+    def __init__(self, window: int = 10000, sampling_rate: int = SAMPLING_RATE):
+        self.sampling_rate = sampling_rate
+        self.started = time.monotonic()
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.audio_samples = 0
+        # requests coalesced by the micro-batcher, and the forward passes of the model they were split into
+        self.micro_batches = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.batched = 0
+
+    def add_batch(self, requests: int, forward_sizes: List[int]):
+        self.micro_batches += 1
+        self.coalesced += requests
+        self.batches += len(forward_sizes)
+        self.batched += sum(forward_sizes)
+
+    def add_request(self, seconds: float, samples: int):
+        self.requests += 1
+        self.audio_samples += samples
+        self.latencies.append(seconds)
+
+    def to_dict(self) -> dict:
+        uptime = time.monotonic() - self.started
+        latencies = np.asarray(self.latencies) * 1000
+        p50, p95 = np.percentile(latencies, [50, 95]) if len(latencies) else (0.0, 0.0)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "uptime_s": round(uptime, 3),
+            "latency_p50_ms": round(float(p50), 2),
+            "latency_p95_ms": round(float(p95), 2),
+            "requests_per_s": round(self.requests / uptime, 3) if uptime else 0.0,
+            "audio_s_per_s": round(self.audio_samples / self.sampling_rate / uptime, 3) if uptime else 0.0,
+            "micro_batches": self.micro_batches,
+            "mean_micro_batch_size": round(self.coalesced / self.micro_batches, 2) if self.micro_batches else 0.0,
+            "batches": self.batches,
+            "mean_batch_size": round(self.batched / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+class TranscriptionService:
+    """
+    Transcribes concurrent requests with one acoustic model and one decoder loaded for the lifetime
+    of the service
+
+    Requests are coalesced into micro-batches, a batch is run as soon as it has max_batch utterances
+    or max_wait seconds after its first one arrived, and is split into length buckets for the model
+    (batch_size of a response is the size of its forward pass). The uploads are decoded in a thread
+    pool, the acoustic model runs in one thread, the beam search of a batch in another pool, so the
+    event loop keeps serving and the next batch can go through the model meanwhile (the decoders
+    share their LM caches, more than one decode thread needs a thread-safe decoder).
+    """
+
+    def __init__(self, model, feature_extractor, labels: List[str], decoder=None, max_batch: int = 8,
+                 max_wait: float = 0.02, decode_threads: int = 1, max_samples: int = 16000 * 120):
+        self.labels = labels
+        self.decoder = decoder
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.sampling_rate = feature_extractor.sampling_rate
+        self.inference = BatchedInference(model, feature_extractor, max_samples=max_samples)
+        self.metrics = ServiceMetrics(sampling_rate=self.sampling_rate)
+        self._audio_executor = ThreadPoolExecutor(2, thread_name_prefix="audio")
+        self._model_executor = ThreadPoolExecutor(1, thread_name_prefix="model")
+        self._decode_executor = ThreadPoolExecutor(decode_threads, thread_name_prefix="decode")
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher = None
+        self._tasks = set()
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+            await asyncio.gather(self._batcher, *self._tasks, return_exceptions=True)
+            self._batcher = None
+        self._audio_executor.shutdown()
+        self._model_executor.shutdown()
+        self._decode_executor.shutdown()
+
+    async def transcribe(self, audio: np.ndarray) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((audio, future))
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[np.ndarray, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            audios = [audio for audio, _ in batch]
+            # the same buckets as the model runs
+            buckets = self.inference.buckets([len(a) for a in audios])
+            self.metrics.add_batch(len(batch), [len(b) for b in buckets])
+            sizes = {i: len(b) for b in buckets for i in b}
+            try:
+                logits = await loop.run_in_executor(self._model_executor, self.inference, audios, self.sampling_rate)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            task = loop.create_task(self._decode(batch, logits, [sizes[i] for i in range(len(batch))]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _decode_one(self, logits: np.ndarray) -> str:
+        if self.decoder is None:
+            return greedy_decode(logits, self.labels)
+        return self.decoder.decode(logits)
+
+    async def _decode(self, batch, logits: List[np.ndarray], sizes: List[int]):
+        loop = asyncio.get_running_loop()
+        texts = await asyncio.gather(*(loop.run_in_executor(self._decode_executor, self._decode_one, lg)
+                                       for lg in logits), return_exceptions=True)
+        for (_, future), text, size in zip(batch, texts, sizes):
+            if future.done():
+                continue
+            if isinstance(text, Exception):
+                future.set_exception(text)
+            else:
+                future.set_result({"text": text, "batch_size": size, "micro_batch_size": len(batch)})
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        One HTTP/1.1 exchange per connection: POST /transcribe with the audio file as the body,
+        GET /metrics and GET /health
+        """
+        start = time.monotonic()
+        try:
+            status, body = await self._respond(reader, start)
+        except Exception as e:
+            status, body = 500, {"error": str(e)}
+        if status != 200:
+            self.metrics.errors += 1
+
+        data = json.dumps(body).encode()
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _respond(self, reader: asyncio.StreamReader, start: float) -> Tuple[int, dict]:
+        request = await reader.readline()
+        try:
+            method, target, _ = request.decode("latin-1").split()
+        except ValueError:
+            return 400, {"error": "malformed request line"}
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        url = urlsplit(target)
+        if url.path == "/health":
+            return 200, {"status": "ok"}
+        if url.path == "/metrics":
+            return (200, self.metrics.to_dict()) if method == "GET" else (405, {"error": "use GET"})
+        if url.path != "/transcribe":
+            return 404, {"error": f"no such endpoint {url.path}"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+
+        if "content-length" not in headers:
+            return 411, {"error": "the audio has to be sent with a Content-Length"}
+        length = headers["content-length"]
+        if not (length.isascii() and length.isdigit()):
+            return 400, {"error": f"invalid Content-Length {length!r}"}
+        length = int(length)
+        if length > MAX_BODY:
+            return 413, {"error": f"the audio is larger than {MAX_BODY} bytes"}
+        try:
+            data = await reader.readexactly(length)
+        except asyncio.IncompleteReadError as e:
+            return 400, {"error": f"the body ended after {len(e.partial)} of {length} bytes"}
+        try:
+            # decoding and resampling a long upload would stall every other connection
+            audio = await asyncio.get_running_loop().run_in_executor(self._audio_executor, read_wav, data,
+                                                                     self.sampling_rate)
+        except Exception as e:
+            return 400, {"error": f"cannot read the audio: {e}"}
+        if len(audio) < MIN_SAMPLES:
+            return 400, {"error": "the audio is too short"}
+
+        result = await self.transcribe(audio)
+        seconds = time.monotonic() - start
+        self.metrics.add_request(seconds, len(audio))
+        return 200, {**result, "audio_s": round(len(audio) / self.sampling_rate, 3),
+                     "latency_ms": round(1000 * seconds, 2)}
+
+
+async def serve(service: TranscriptionService, host: str, port: int):
+    service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"Listening on http://{host}:{port} (POST /transcribe, GET /metrics)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m evaluation.service",
+                                     description="Transcription service with dynamic micro-batching")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--lm", type=Path, help="ARPA model for the beam search (default: greedy decoding)")
+    parser.add_argument("--decoder", choices=["pyctcdecode", "native"], default="pyctcdecode",
+                        help="beam search implementation")
+    parser.add_argument("--max-batch", type=int, default=8, help="utterances per micro-batch")
+    parser.add_argument("--max-wait", type=float, default=20.0,
+                        help="milliseconds a micro-batch waits for more requests after its first one")
+    args = parser.parse_args(argv)
+
+    from transformers import AutoProcessor, Wav2Vec2ForCTC
+
+    from .registry import ModelRegistry
+
+    pre_trained_model = "facebook/wav2vec2-base-960h"
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        processor = AutoProcessor.from_pretrained(pre_trained_model)
+        model = Wav2Vec2ForCTC.from_pretrained(pre_trained_model)
+    model.eval()
+    vocab = processor.tokenizer.get_vocab()
+    labels = [k.lower() for k, _ in sorted(vocab.items(), key=lambda item: item[1])]
+
+    decoder = None
+    if args.lm is not None:
+        decoder = ModelRegistry(labels, backend=args.decoder).decoder(args.lm)
+
+    service = TranscriptionService(model, processor.feature_extractor, labels, decoder, args.max_batch,
+                                   args.max_wait / 1000)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    print("[DONE]")
+
+
+if __name__ == "__main__":
+    main()
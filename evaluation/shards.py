@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import socket
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .wer import WerBreakdown
+
+VERSION = 1
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """
+    "i/N", the i-th (from 0) of N shards
+    """
+    index, _, count = spec.partition("/")
+    if not index.isdigit() or not count.isdigit() or not 0 <= int(index) < int(count):
+        raise ValueError(f"invalid shard {spec!r}, expected i/N with 0 <= i < N")
+    return int(index), int(count)
+
+
+def shard_path(out_dir: Path, index: int, count: int) -> Path:
+    return Path(out_dir) / f"shard-{index:03d}-of-{count:03d}.json"
+
+
+def write_shard(path: Path, index: int, count: int, config: dict, references: Dict[str, str],
+                hypotheses: Dict[str, Dict[str, str]], wer: Dict[str, WerBreakdown], timings: dict):
+    """
+    The partial result of one shard, hypotheses and references by interval and the raw error counts
+    of every LM configuration, config has to be the same for all shards of an evaluation
+    """
+    shard = {
+        "version": VERSION,
+        "shard": [index, count],
+        "host": socket.gethostname(),
+        "config": config,
+        "timings": timings,
+        "references": references,
+        "hypotheses": hypotheses,
+        "wer": {key: b.to_dict() for key, b in wer.items()},
+    }
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}")
+    tmp.write_text(json.dumps(shard, indent=1))
+    os.replace(tmp, path)
+
+
+def merge_shards(paths: List[Path], partial: bool = False) -> dict:
+    """
+    Combine shard files into the result of the whole split, the error counts are added up interval
+    by interval, so the merged WER is the one of a single run over all the intervals
+    """
+    if not paths:
+        raise ValueError("no shard files to merge")
+    shards = []
+    for path in paths:
+        with open(path) as f:
+            shard = json.load(f)
+        if shard.get("version") != VERSION:
+            raise ValueError(f"{path} has version {shard.get('version')}, expected {VERSION}")
+        shards.append((Path(path), shard))
+
+    first, base = shards[0]
+    count = base["shard"][1]
+    seen = {}
+    for path, shard in shards:
+        if shard["config"] != base["config"]:
+            raise ValueError(f"{path} was evaluated with another configuration than {first}")
+        index, n = shard["shard"]
+        if n != count:
+            raise ValueError(f"{path} is a shard of {n}, {first} one of {count}")
+        if index in seen:
+            raise ValueError(f"{path} and {seen[index]} are both shard {index}/{count}")
+        seen[index] = path
+    missing = sorted(set(range(count)) - set(seen))
+    if missing and not partial:
+        raise ValueError(f"missing shards {', '.join(f'{i}/{count}' for i in missing)}")
+
+    wer = {key: WerBreakdown() for key in base["wer"]}
+    references, hypotheses = {}, {key: {} for key in base["hypotheses"]}
+    for path, shard in shards:
+        for key, breakdown in shard["wer"].items():
+            for name, counts in breakdown["intervals"].items():
+                if name in wer[key].intervals:
+                    raise ValueError(f"{name} is in more than one shard ({path})")
+                wer[key].add_interval(name, counts)
+        references.update(shard["references"])
+        for key, texts in shard["hypotheses"].items():
+            hypotheses[key].update(texts)
+
+    timings = [shard["timings"] for _, shard in shards]
+    acoustic = {k: sum(t["acoustic"][k] for t in timings) for k in ("utterances", "audio_seconds", "seconds")}
+    return {
+        "config": base["config"],
+        "shards": sorted(seen),
+        "missing": missing,
+        "timings": {
+            # the shards run side by side, the evaluation takes as long as the slowest one
+            "wall_seconds": max(t["seconds"] for t in timings),
+            "total_seconds": sum(t["seconds"] for t in timings),
+            "decode_seconds": sum(t["decode_seconds"] for t in timings),
+            "acoustic": acoustic,
+        },
+        "references": references,
+        "hypotheses": hypotheses,
+        "wer": wer,
+    }
+
+
+def merge_report(merged: dict, by: Optional[str] = "roles") -> str:
+    count = len(merged["shards"]) + len(merged["missing"])
+    lines = [f"{len(merged['shards'])}/{count} shards, {len(merged['references'])} intervals"]
+    if merged["missing"]:
+        lines.append(f"PARTIAL: shards {', '.join(map(str, merged['missing']))} are missing")
+    for key, breakdown in merged["wer"].items():
+        lines.append(f"{key}: {breakdown.total}")
+        if by is not None:
+            lines += [f"\t{group}: {acc}" for group, acc in sorted(getattr(breakdown, by).items())]
+
+    t = merged["timings"]
+    rtf = t["acoustic"]["seconds"] / t["acoustic"]["audio_seconds"] if t["acoustic"]["audio_seconds"] else 0.0
+    lines.append(f"{t['wall_seconds']:.1f}s wall time ({t['total_seconds']:.1f}s over all shards), "
+                 f"acoustic model RTF {rtf:.3f}, beam search {t['decode_seconds']:.1f}s")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m evaluation.shards",
+                                     description="Merge the shard files of a sharded evaluation (eval3.py --shard)")
+    parser.add_argument("shards", type=Path, nargs="+", help="shard files, or directories of shard files")
+    parser.add_argument("--by", choices=["roles", "transcripts", "none"], default="roles",
+                        help="breakdown printed under the WER of every LM configuration")
+    parser.add_argument("--partial", action="store_true", help="merge even if some shards are missing")
+    parser.add_argument("-o", "--out", type=Path, default=None,
+                        help="write the merged hypotheses and error counts to this JSON file")
+    args = parser.parse_args(argv)
+
+    paths = [p for path in args.shards for p in (sorted(path.glob("shard-*.json")) if path.is_dir() else [path])]
+    try:
+        merged = merge_shards(paths, args.partial)
+    except ValueError as e:
+        parser.error(str(e))
+    print(merge_report(merged, None if args.by == "none" else args.by))
+
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump({**merged, "wer": {key: b.to_dict() for key, b in merged["wer"].items()}}, f, indent=1)
+        print(f"Merged result written to {args.out}")
+    print("[DONE]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import itertools
+import random
+from typing import Dict, Hashable, List, Sequence, Tuple, Union
+
+from .decoding import DEFAULT_PARAMS
+from .wer import WerAccumulator
+
+# a list of values for a grid, or a (low, high) range for a random search
+Space = Dict[str, Union[List[float], Tuple[float, float]]]
+
+INT_PARAMS = {"beam_width"}
+
+
+def parse_space(specs: Sequence[str]) -> Space:
+    """
+    Parse search space arguments, "alpha=0.3,0.5,0.7" lists the values of a grid
+    and "alpha=0.1:2" is a range to sample from in a random search
+    """
+    space = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in DEFAULT_PARAMS:
+            raise ValueError(f"unknown decoder parameter {name!r}, expected one of {', '.join(DEFAULT_PARAMS)}")
+        cast = int if name in INT_PARAMS else float
+        if ":" in values:
+            low, high = values.split(":")
+            space[name] = (cast(low), cast(high))
+        else:
+            space[name] = [cast(v) for v in values.split(",")]
+    return space
+
+
+def grid(space: Space) -> List[dict]:
+    """
+    Every combination of the listed values, ranges contribute their two ends
+    """
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(list(space[n]) for n in names))]
+
+
+def random_points(space: Space, n: int, seed: int = 0) -> List[dict]:
+    """
+    n points drawn uniformly, from the ranges or from the listed values
+    """
+    rng = random.Random(seed)
+    points = []
+    for _ in range(n):
+        point = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                point[name] = rng.randint(low, high) if name in INT_PARAMS else rng.uniform(low, high)
+            else:
+                point[name] = rng.choice(values)
+        points.append(point)
+    return points
+
+
+class SweepResult:
+    """
+    Accuracy and beam search time of one LM with one set of decoder parameters
+    """
+
+    def __init__(self, lm: Hashable, params: dict, wer: WerAccumulator, seconds: float, utterances: int):
+        self.lm = lm
+        self.params = {**DEFAULT_PARAMS, **params}
+        self.wer = wer
+        self.seconds = seconds
+        self.utterances = utterances
+
+    @property
+    def ms_per_utterance(self) -> float:
+        return 1000 * self.seconds / self.utterances if self.utterances else 0.0
+
+    def to_dict(self) -> dict:
+        return {"lm": list(self.lm) if isinstance(self.lm, tuple) else self.lm, "params": self.params,
+                "wer": self.wer.wer, "errors": self.wer.errors, "words": self.wer.words,
+                "seconds": self.seconds, "ms_per_utterance": self.ms_per_utterance}
+
+    def __str__(self):
+        params = ", ".join(f"{k}={v:g}" for k, v in self.params.items())
+        return f"WER {self.wer.wer:.4f}  {self.ms_per_utterance:8.1f} ms/utt  {params}"
+
+
+def pareto_front(results: List[SweepResult]) -> List[SweepResult]:
+    """
+    Results which no other result beats on both WER and decode time, fastest first
+    """
+    front = []
+    for r in sorted(results, key=lambda r: (r.seconds, r.wer.wer)):
+        if not front or r.wer.wer < front[-1].wer.wer:
+            front.append(r)
+    return front
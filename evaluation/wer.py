@@ -0,0 +1,221 @@
+import re
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# counts of one alignment, in the columns of edit_counts()
+S, D, I, H = range(4)
+# utterances aligned at once, sorted by length so that little of the DP is padding
+BATCH = 256
+
+_name_re = re.compile(r"day(\d+)_consultation(\d+)_(doctor|patient)")
+# transcript and role of intervals of other datasets
+UNKNOWN = "unknown"
+
+
+class Vocabulary:
+    """
+    Integer ids of words, shared by every alignment so that each word is looked up once
+    """
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+
+    def encode(self, sentence: str) -> np.ndarray:
+        ids = self.ids
+        return np.asarray([ids.setdefault(w, len(ids)) for w in sentence.split()], dtype=np.int32)
+
+
+def _align(refs: List[np.ndarray], hyps: List[np.ndarray]) -> np.ndarray:
+    """
+    Minimum edit distance alignment of every pair, row by row over the whole batch
+
+    Each cell carries the substitutions, deletions and insertions of its best path, which is what a
+    backtrace would count. A row depends on itself only through insertions, cost[j] = min over k <= j
+    of a[k] + (j - k), which is a running minimum of a[k] - k.
+    """
+    n = len(refs)
+    max_ref = max(map(len, refs), default=0)
+    max_hyp = max(map(len, hyps), default=0)
+    # padding never matches, and cells past the end of a pair never feed the cells before it
+    ref = np.full((n, max_ref), -1, dtype=np.int32)
+    hyp = np.full((n, max_hyp), -2, dtype=np.int32)
+    for k, (r, h) in enumerate(zip(refs, hyps)):
+        ref[k, :len(r)] = r
+        hyp[k, :len(h)] = h
+
+    cols = np.arange(max_hyp + 1)
+    cost = np.broadcast_to(cols, (n, max_hyp + 1)).copy()
+    subs = np.zeros_like(cost)
+    dels = np.zeros_like(cost)
+    ins = cost.copy()
+    rows = np.arange(n)[:, None]
+    ref_len = np.asarray([len(r) for r in refs])
+    hyp_len = np.asarray([len(h) for h in hyps])
+    result = np.zeros((n, 3), dtype=np.int64)
+    # a pair with an empty reference is all insertions
+    result[ref_len == 0, I] = hyp_len[ref_len == 0]
+
+    for i in range(max_ref):
+        mismatch = (ref[:, i, None] != hyp).astype(cost.dtype)
+        # a[j]: reach (i + 1, j) by a match or substitution from (i, j - 1), or a deletion from (i, j)
+        diag = cost[:, :-1] + mismatch
+        up = cost + 1
+        use_diag = np.concatenate([np.zeros((n, 1), dtype=bool), diag <= up[:, 1:]], axis=1)
+        a = up.copy()
+        a[:, 1:] = np.where(use_diag[:, 1:], diag, up[:, 1:])
+        a_subs = np.where(use_diag, np.pad(subs[:, :-1] + mismatch, ((0, 0), (1, 0))), subs)
+        a_dels = np.where(use_diag, np.pad(dels[:, :-1], ((0, 0), (1, 0))), dels + 1)
+        a_ins = np.where(use_diag, np.pad(ins[:, :-1], ((0, 0), (1, 0))), ins)
+
+        # insertions along the row, the latest k reaching the minimum takes the fewest of them
+        vals = a - cols
+        best = np.minimum.accumulate(vals, axis=1)
+        k = np.maximum.accumulate(np.where(vals == best, cols, 0), axis=1)
+        cost = best + cols
+        subs = a_subs[rows, k]
+        dels = a_dels[rows, k]
+        ins = a_ins[rows, k] + (cols - k)
+
+        end = ref_len == i + 1
+        if end.any():
+            last = hyp_len[end]
+            result[end] = np.stack([subs[end, last], dels[end, last], ins[end, last]], axis=-1)
+    return result
+
+
+def edit_counts(references: Sequence[str], predictions: Sequence[str],
+                vocab: Optional[Vocabulary] = None) -> np.ndarray:
+    """
+    (substitutions, deletions, insertions, hits) of every reference and prediction pair, words are
+    split on whitespace
+    """
+    if len(references) != len(predictions):
+        raise ValueError(f"{len(references)} references for {len(predictions)} predictions")
+    vocab = vocab or Vocabulary()
+    refs = [vocab.encode(r) for r in references]
+    hyps = [vocab.encode(p) for p in predictions]
+
+    counts = np.zeros((len(refs), 4), dtype=np.int64)
+    order = np.argsort([len(r) for r in refs], kind="stable")
+    for c in range(0, len(order), BATCH):
+        idx = order[c:c + BATCH]
+        counts[idx, :3] = _align([refs[i] for i in idx], [hyps[i] for i in idx])
+    counts[:, H] = np.asarray([len(r) for r in refs], dtype=np.int64) - counts[:, S] - counts[:, D]
+    return counts
+
+
+def utterance_wer(references: Sequence[str], predictions: Sequence[str]) -> np.ndarray:
+    """
+    WER of every pair on its own
+    """
+    counts = edit_counts(references, predictions)
+    words = counts[:, S] + counts[:, D] + counts[:, H]
+    return np.where(words > 0, counts[:, :3].sum(axis=1) / np.maximum(words, 1), 0.0)
+
+
+def parse_name(name: str) -> Optional[dict]:
+    """
+    day, consultation and role of an interval file name, e.g. day1_consultation01_doctor_3.wav,
+    None for names of other datasets
+    """
+    match = _name_re.search(name)
+    if match is None:
+        return None
+    return {"day": int(match.group(1)), "consultation": int(match.group(2)), "role": match.group(3)}
+
+
+class WerAccumulator:
+    """
+    Accumulates raw error counts, so that the corpus WER can be computed
+    from hypotheses arriving in any number of batches
+    """
+
+    def __init__(self, vocab: Optional[Vocabulary] = None):
+        self.vocab = vocab or Vocabulary()
+        self.substitutions = 0
+        self.deletions = 0
+        self.insertions = 0
+        self.hits = 0
+
+    def add(self, references: List[str], predictions: List[str]) -> np.ndarray:
+        counts = edit_counts(references, predictions, self.vocab)
+        self.add_counts(counts.sum(axis=0))
+        return counts
+
+    def add_counts(self, counts: Sequence[int]):
+        self.substitutions += int(counts[S])
+        self.deletions += int(counts[D])
+        self.insertions += int(counts[I])
+        self.hits += int(counts[H])
+
+    def counts(self) -> List[int]:
+        return [self.substitutions, self.deletions, self.insertions, self.hits]
+
+    @property
+    def errors(self) -> int:
+        return self.substitutions + self.deletions + self.insertions
+
+    @property
+    def words(self) -> int:
+        return self.substitutions + self.deletions + self.hits
+
+    @property
+    def wer(self) -> float:
+        return self.errors / self.words if self.words else 0.0
+
+    def __str__(self):
+        return f"WER {self.wer:.4f} (S={self.substitutions}, D={self.deletions}, I={self.insertions}, N={self.words})"
+
+
+class WerBreakdown:
+    """
+    Error counts of a corpus, of every interval, of every transcript (Transcript.sid, one speaker of
+    one consultation) and of every role, from interval file names like day1_consultation01_doctor_3.wav
+    """
+
+    def __init__(self):
+        self.vocab = Vocabulary()
+        self.total = WerAccumulator(self.vocab)
+        self.intervals: Dict[str, List[int]] = {}
+        self.transcripts: Dict[str, WerAccumulator] = {}
+        self.roles: Dict[str, WerAccumulator] = {}
+
+    def add(self, names: List[str], references: List[str], predictions: List[str]):
+        for name, c in zip(names, edit_counts(references, predictions, self.vocab)):
+            self.add_interval(name, c)
+
+    def add_interval(self, name: str, counts: Sequence[int]):
+        """
+        Counts of one interval, also those of an interval aligned elsewhere (e.g. by another shard),
+        intervals whose name is not a primock57 one are grouped under "unknown"
+        """
+        if name in self.intervals:
+            raise ValueError(f"the interval {name!r} was already counted")
+        self.intervals[name] = [int(c) for c in counts]
+        self.total.add_counts(counts)
+        info = parse_name(name)
+        if info is None:
+            sid = role = UNKNOWN
+        else:
+            # the same key as Transcript.sid
+            sid = f"{info['day']}:{info['consultation']}:{int(info['role'] == 'doctor')}"
+            role = info["role"]
+        self.transcripts.setdefault(sid, WerAccumulator(self.vocab)).add_counts(counts)
+        self.roles.setdefault(role, WerAccumulator(self.vocab)).add_counts(counts)
+
+    def to_dict(self) -> dict:
+        """
+        Raw (substitutions, deletions, insertions, hits) of the corpus and of every group
+        """
+        return {
+            "total": self.total.counts(),
+            "roles": {key: acc.counts() for key, acc in sorted(self.roles.items())},
+            "transcripts": {key: acc.counts() for key, acc in sorted(self.transcripts.items())},
+            "intervals": dict(sorted(self.intervals.items())),
+        }
+
+    def table(self, by: str = "roles") -> str:
+        groups = getattr(self, by)
+        lines = [f"{key:>12} {acc}" for key, acc in sorted(groups.items())]
+        return "\n".join(lines + [f"{'total':>12} {self.total}"])
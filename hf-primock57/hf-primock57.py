@@ -1,3 +1,6 @@
+import csv
+import json
+
 import datasets
 
 
@@ -8,8 +11,9 @@ class Primock57Dataset(datasets.GeneratorBasedBuilder):
     """
     DEFAULT_CONFIG_NAME = "all"
     SPLITS = ["train", "test", "eval"]
+    SPLIT_NAMES = {"train": datasets.Split.TRAIN, "test": datasets.Split.TEST, "eval": datasets.Split.VALIDATION}
     CSV_PATHS = {s: f"data/{s}.csv" for s in SPLITS}
-    TAR_PATHS = {s: f"data/{s}.tar.gz" for s in SPLITS}
+    SHARDS_PATH = "data/shards.json"
 
     def _info(self):
         return datasets.DatasetInfo(
@@ -19,6 +23,10 @@ class Primock57Dataset(datasets.GeneratorBasedBuilder):
                     "path": datasets.Value("string"),
                     "audio": datasets.Audio(sampling_rate=16_000),
                     "transcription": datasets.Value("string"),
+                    # time range of the exported audio in the source recording, after silence trimming,
+                    # float32 steps by ~0.25 ms an hour into a recording, which is 4 samples at 16 kHz
+                    "start_time": datasets.Value("float64"),
+                    "end_time": datasets.Value("float64"),
                 }
             ),
             supervised_keys=None,
@@ -30,45 +38,36 @@ class Primock57Dataset(datasets.GeneratorBasedBuilder):
     def _split_generators(self, dl_manager):
         """Returns SplitGenerators."""
         prompts_paths = dl_manager.download(self.CSV_PATHS)
-        archive = dl_manager.download(self.TAR_PATHS)
+        with open(dl_manager.download(self.SHARDS_PATH), encoding="utf-8") as f:
+            shards = json.load(f)
+        archives = dl_manager.download({s: [f"data/{name}" for name in shards[s]] for s in self.SPLITS})
 
+        # one archive iterator per shard, so that the shards can be read by several processes (num_proc)
         return [
             datasets.SplitGenerator(
-                name=datasets.Split.TRAIN,
-                gen_kwargs={
-                    "prompts_path": prompts_paths["train"],
-                    "audio_files": dl_manager.iter_archive(archive["train"]),
-                },
-            ),
-            datasets.SplitGenerator(
-                name=datasets.Split.TEST,
+                name=self.SPLIT_NAMES[s],
                 gen_kwargs={
-                    "prompts_path": prompts_paths["test"],
-                    "audio_files": dl_manager.iter_archive(archive["test"]),
+                    "prompts_path": prompts_paths[s],
+                    "audio_files": [dl_manager.iter_archive(a) for a in archives[s]],
                 },
-            ),
-            datasets.SplitGenerator(
-                name=datasets.Split.VALIDATION,
-                gen_kwargs={
-                    "prompts_path": prompts_paths["eval"],
-                    "audio_files": dl_manager.iter_archive(archive["eval"]),
-                },
-            ),
+            )
+            for s in self.SPLITS
         ]
 
     def _generate_examples(self, prompts_path, audio_files):
         """Yields examples as (key, example) tuples."""
         examples = {}
         with open(prompts_path, encoding="utf-8") as f:
-            for row in f:
-                audio_path, transcript = row.strip("\n").split(",")
-                examples[audio_path] = {
-                    "path": audio_path,
-                    "transcription": transcript,
+            for row in csv.DictReader(f):
+                examples[row["file_name"]] = {
+                    "path": row["file_name"],
+                    "transcription": row["transcription"],
+                    "start_time": float(row["start_time"]),
+                    "end_time": float(row["end_time"]),
                 }
-        id_ = 0
-        for path, f in audio_files:
-            if path in examples:
-                audio = {"path": path, "bytes": f.read()}
-                yield id_, {**examples[path], "audio": audio}
-                id_ += 1
+        for archive in audio_files:
+            for path, f in archive:
+                if path in examples:
+                    audio = {"path": path, "bytes": f.read()}
+                    # file names are unique across shards
+                    yield path, {**examples[path], "audio": audio}
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the dataset generator (lm, metadata) is run from its own directory, see asr-project/__main__.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "asr-project"))
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+kenlm = pytest.importorskip("kenlm")
+
+from evaluation import beam_search
+from evaluation.beam_search import BeamSearchDecoder, ScoreCache
+from evaluation.confidence import greedy_decode
+
+LABELS = ["<pad>", "<s>", "</s>", "<unk>", "|", "a", "b", "c"]
+WORDS = ["ab", "ba", "cab"]
+ARPA = """\\data\\
+ngram 1=6
+ngram 2=5
+
+\\1-grams:
+-1.5\t<unk>
+-99\t<s>\t-0.3
+-0.8\t</s>
+-0.6\tab\t-0.2
+-0.7\tba\t-0.2
+-0.9\tcab\t-0.2
+
+\\2-grams:
+-0.3\t<s> ab
+-0.4\t<s> cab
+-0.3\tab ba
+-0.3\tba ab
+-0.5\tcab </s>
+
+\\end\\
+"""
+
+
+@pytest.fixture(scope="module")
+def model(tmp_path_factory):
+    path = tmp_path_factory.mktemp("lm") / "2gram_test_lm.arpa"
+    path.write_text(ARPA)
+    return kenlm.Model(str(path))
+
+
+def logits(frames: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    lg = rng.normal(0, 3, (frames, len(LABELS)))
+    lg[:, 0] += 1.0
+    return lg
+
+
+def stream_text(decoder, lg, chunk=400):
+    stream = decoder.stream()
+    nodes = 0
+    for c in range(0, len(lg), chunk):
+        stream.feed(lg[c:c + chunk])
+        nodes = max(nodes, len(stream._parent))
+    return stream.finalize(), nodes
+
+
+def peaked_logits(rng, frames: int) -> np.ndarray:
+    """
+    One clearly best token per frame, so that the best path is also the most likely prefix
+    """
+    best = rng.integers(0, len(LABELS), frames)
+    best[np.isin(best, [1, 2, 3])] = 0
+    lg = rng.normal(0, 1, (frames, len(LABELS)))
+    lg[np.arange(frames), best] += 12
+    return lg
+
+
+def test_beam_search_without_lm_is_greedy(model):
+    """
+    With the LM weight, the word bonus and the unknown word penalty at zero the beam search finds the best path
+    """
+    rng = np.random.default_rng(0)
+    decoder = BeamSearchDecoder(LABELS, ScoreCache(model), WORDS, alpha=0.0, beta=0.0, unk_score_offset=0.0)
+    for _ in range(20):
+        lg = peaked_logits(rng, int(rng.integers(1, 200)))
+        assert decoder.decode(lg) == greedy_decode(lg, LABELS)
+
+
+def test_collection_keeps_the_transcript(model, monkeypatch):
+    """
+    Dropping unreachable nodes and committing the common prefix does not change the result
+    """
+    decoder = BeamSearchDecoder(LABELS, ScoreCache(model), WORDS, beam_width=16)
+    lg = logits(3000)
+    monkeypatch.setattr(beam_search, "COLLECT_MIN_NODES", 10 ** 9)
+    expected, grown = stream_text(decoder, lg)
+    monkeypatch.setattr(beam_search, "COLLECT_MIN_NODES", 64)
+    monkeypatch.setattr(beam_search, "COMMIT_LAG", 10 ** 9)
+    text, nodes = stream_text(decoder, lg)
+    assert text == expected
+    assert nodes < grown
+
+
+def test_long_stream_stays_bounded(model):
+    """
+    The prefix tree of an hour-long stream is as large as the one of a short utterance
+    """
+    width = 8
+    decoder = BeamSearchDecoder(LABELS, ScoreCache(model), WORDS, beam_width=width)
+    text, nodes = stream_text(decoder, logits(30000))
+    bound = 2 * max(beam_search.COLLECT_MIN_NODES, width * (beam_search.COMMIT_LAG + 1))
+    assert nodes <= bound
+    assert len(text.split()) > 100
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+soundfile = pytest.importorskip("soundfile")
+textgrid = pytest.importorskip("textgrid")
+
+import metadata
+from metadata import DataSet, FeatureStore
+
+TEXTS = ["the patient has pain", "", "since two days", "no fever"]
+
+
+@pytest.fixture
+def primock(tmp_path):
+    """
+    A primock57 checkout with one four-second recording and its transcript
+    """
+    (tmp_path / "audio").mkdir()
+    (tmp_path / "transcripts").mkdir()
+    rng = np.random.default_rng(0)
+    soundfile.write(tmp_path / "audio" / "day1_consultation01_doctor.wav",
+                    0.1 * rng.standard_normal(4 * 16000).astype(np.float32), 16000)
+    grid = textgrid.TextGrid(maxTime=4.0)
+    tier = textgrid.IntervalTier("doctor", 0.0, 4.0)
+    for i, text in enumerate(TEXTS):
+        tier.add(float(i), i + 1.0, text)
+    grid.append(tier)
+    grid.write(str(tmp_path / "transcripts" / "day1_consultation01_doctor.TextGrid"))
+    return tmp_path
+
+
+def shards(out):
+    return {p.name: (p.stat().st_ino, p.stat().st_mtime_ns)
+            for p in sorted((out / "hf-primock57" / "data").glob("*.tar*"))}
+
+
+def test_rerun_rewrites_no_shards(primock, tmp_path):
+    """
+    Generating the same dataset again keeps every shard file as it is
+    """
+    intervals = DataSet(primock, workers=1, index=None).table.non_empty()
+    splits = {"train": intervals[np.asarray([0, 1])].intervals(), "test": intervals[np.asarray([2])].intervals()}
+    out, store = tmp_path / "out", FeatureStore(tmp_path / "features")
+
+    metadata.generate(splits, out_dir=out, workers=1, vad=None, features=store)
+    first = shards(out)
+    assert first
+    metadata.generate(splits, out_dir=out, workers=1, vad=None, features=store)
+    assert shards(out) == first
+
+
+def test_feature_reader_follows_the_export(primock, tmp_path):
+    """
+    The evaluation reads the audio with the normalization the dataset was exported with
+    """
+    from evaluation.features import FeatureReader
+
+    intervals = DataSet(primock, workers=1, index=None).table.non_empty()
+    out, store = tmp_path / "out", FeatureStore(tmp_path / "features", normalization="peak")
+    metadata.generate({"test": intervals.intervals()}, out_dir=out, workers=1, vad=None, features=store)
+
+    reader = FeatureReader(tmp_path / "features", out / "hf-primock57" / "data")
+    audio = reader.audio({"path": "day1_consultation01_doctor_2.wav", "start_time": 2.0, "end_time": 3.0})
+    assert audio["sampling_rate"] == 16000
+    np.testing.assert_array_equal(audio["array"], store["day1_consultation01_doctor"][32000:48000])
+    assert np.abs(reader.recording("day1_consultation01_doctor")).max() == 1.0
+
+
+def test_intervals_without_speech_are_kept(primock, tmp_path, capsys):
+    """
+    Every interval with a transcription is exported, the ones the VAD finds no speech in untrimmed
+    """
+    intervals = DataSet(primock, workers=1, index=None).table.non_empty()
+    out = tmp_path / "out"
+    # more speech than any one-second interval can have
+    vad = metadata.VAD(min_speech=2.0)
+    metadata.generate({"test": intervals.intervals()}, out_dir=out, workers=1, vad=vad,
+                      features=FeatureStore(tmp_path / "features"))
+
+    manifest = metadata.manifest.Manifest.load(out / "hf-primock57" / "data" / "manifest.json")
+    assert sorted(manifest.intervals) == sorted(it.fname for it in intervals.intervals())
+    assert not any(rec["speech"] for rec in manifest.intervals.values())
+    assert all(rec["end_time"] - rec["start_time"] == 1.0 for rec in manifest.intervals.values())
+    assert f"{len(manifest.intervals)} intervals without detected speech kept whole" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_shards_are_reproducible(tmp_path, compress, monkeypatch):
+    """
+    Writing the same members again gives the same bytes, whenever it happens
+    """
+    from metadata.shards import write_shard
+
+    members = [("a.wav", b"\x01" * 1000), ("b.wav", b"\x02")]
+    write_shard(tmp_path / "a.tar", members, compress)
+    monkeypatch.setattr("time.time", lambda: 2 * 10 ** 9)
+    write_shard(tmp_path / "b.tar", members, compress)
+    assert (tmp_path / "a.tar").read_bytes() == (tmp_path / "b.tar").read_bytes()
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from evaluation import BatchedInference, make_buckets
+
+
+def tiny_model(feat_extract_norm: str):
+    torch.manual_seed(0)
+    config = transformers.Wav2Vec2Config(vocab_size=32, hidden_size=32, num_hidden_layers=1, num_attention_heads=2,
+                                         intermediate_size=64, conv_dim=(16,) * 7, num_conv_pos_embeddings=16,
+                                         num_conv_pos_embedding_groups=4, feat_extract_norm=feat_extract_norm,
+                                         do_stable_layer_norm=feat_extract_norm == "layer")
+    return transformers.Wav2Vec2ForCTC(config).eval()
+
+
+def audios():
+    rng = np.random.default_rng(0)
+    # two utterances of the same length and two shorter ones
+    return [rng.standard_normal(n).astype(np.float32) for n in (8000, 8000, 5000, 3210)]
+
+
+def test_make_buckets():
+    assert make_buckets([5, 3, 5, 4], 100) == [[1, 3, 0, 2]]
+    assert make_buckets([5, 3, 5, 4], 12) == [[1, 3], [0, 2]]
+
+
+@pytest.mark.parametrize("norm,mask", [("group", False), ("layer", True)])
+def test_batched_logits_match_unbatched(norm, mask):
+    """
+    The logits of an utterance do not depend on the utterances sharing its batch, all four share one
+    """
+    fe = transformers.Wav2Vec2FeatureExtractor(feature_size=1, sampling_rate=16000, padding_value=0.0,
+                                               do_normalize=True, return_attention_mask=mask)
+    model = tiny_model(norm)
+    inference = BatchedInference(model, fe, max_samples=10 ** 6)
+    assert len(inference.buckets([len(a) for a in audios()])) == 1
+    batched = inference(audios(), 16000)
+    features = [inference.extract(a, 16000) for a in audios()]
+    from_features = [None] * len(features)
+    for bucket in inference.buckets([len(v) for v in features]):
+        for i, lg in zip(bucket, inference.forward_features([features[i] for i in bucket])):
+            from_features[i] = lg
+
+    for audio, lg, lf in zip(audios(), batched, from_features):
+        with torch.no_grad():
+            alone = model(torch.from_numpy(inference.extract(audio, 16000))[None]).logits[0].numpy()
+        assert lg.shape == alone.shape
+        np.testing.assert_allclose(lg, alone, atol=1e-4)
+        np.testing.assert_allclose(lf, alone, atol=1e-4)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import lm
+from lm.counts import BOS
+
+
+@pytest.fixture(scope="module")
+def model(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    words = [f"w{i}" for i in range(30)]
+    sentences = [" ".join(rng.choice(words, rng.integers(1, 8))) for _ in range(400)]
+    out = tmp_path_factory.mktemp("models")
+    path, = lm.train(sentences, [3], "test", out)
+    return lm.ArpaModel.from_file(path)
+
+
+def total_probability(model: lm.ArpaModel, histories: np.ndarray) -> np.ndarray:
+    """
+    Sum of p(w | h) over the vocabulary of every history, from the probabilities as written in the ARPA file
+    """
+    words = np.asarray([i for i, w in enumerate(model.words) if w != BOS], dtype=np.int32)
+    rows = np.repeat(histories, len(words), axis=0)
+    grams = np.concatenate([rows, np.tile(words, len(histories))[:, None]], axis=1)
+    return np.power(10.0, model.logprob(grams)).reshape(len(histories), -1).sum(axis=1)
+
+
+def check_normalized(model: lm.ArpaModel):
+    for n in range(1, model.order):
+        histories = model.grams[n - 1]
+        # every known history, left-padded as a row of the highest order
+        padded = np.concatenate([np.full((len(histories), model.order - 1 - n), -1, dtype=np.int32), histories], axis=1)
+        np.testing.assert_allclose(total_probability(model, padded), 1.0, atol=1e-4)
+    np.testing.assert_allclose(total_probability(model, np.full((1, model.order - 1), -1, dtype=np.int32)), 1.0,
+                               atol=1e-4)
+
+
+def test_kneser_ney_is_normalized(model):
+    """
+    Every history of the written model, with its backoffs, is a distribution over the vocabulary
+    """
+    check_normalized(model)
+
+
+def test_pruned_model_is_normalized(model):
+    pruned = lm.prune(model, sum(map(len, model.grams)) // 2)
+    assert sum(map(len, pruned.grams)) <= sum(map(len, model.grams)) // 2
+    check_normalized(pruned)
@@ -0,0 +1,20 @@
+import pytest
+
+pytest.importorskip("torch")
+
+from evaluation.inference import MIN_SAMPLES
+from evaluation.longform import chunk_windows
+
+
+@pytest.mark.parametrize("total,left,right", [(16000 * 20 + 100, 0, 0), (16000 * 47, 64000, 64000), (16000, 0, 0),
+                                              (16000 * 60 + 1, 320, 0)])
+def test_chunk_windows_tile_the_recording(total, left, right):
+    """
+    The kept ranges cover every sample once and no window is too short for the model
+    """
+    windows = chunk_windows(total, 16000 * 20, left, right)
+    assert windows[0][2] == 0 and windows[-1][3] == total
+    for (_, _, _, keep_end), (_, _, keep_start, _) in zip(windows, windows[1:]):
+        assert keep_end == keep_start
+    assert all(end - start >= MIN_SAMPLES and start <= keep_start < keep_end <= end
+               for start, end, keep_start, keep_end in windows)
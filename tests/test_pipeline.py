@@ -0,0 +1,26 @@
+import threading
+
+import pytest
+
+pytest.importorskip("torch")
+
+from evaluation import Pipeline, Stage
+
+
+def test_closing_early_stops_every_stage():
+    """
+    A consumer that stops reading leaves no worker blocked on a full queue
+    """
+    pipeline = Pipeline([Stage("double", lambda xs: [2 * x for x in xs], workers=2, queue_size=1),
+                         Stage("fan", lambda xs: [x for x in xs for _ in range(4)], queue_size=1)])
+    outputs = pipeline.run(range(10 ** 6))
+    assert next(outputs) == 0
+    outputs.close()
+    assert not [t for t in threading.enumerate() if t.name.startswith(("source", "double-", "fan-"))]
+
+
+def test_one_torch_budget_per_process():
+    with pytest.raises(ValueError):
+        Pipeline([Stage("a", list, threads=1), Stage("b", list, threads=2)])
+    pipeline = Pipeline([Stage("a", list, threads=2), Stage("b", list, processes=True, threads=1)])
+    assert pipeline.torch_threads == 2
@@ -0,0 +1,94 @@
+import asyncio
+import io
+import threading
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+soundfile = pytest.importorskip("soundfile")
+
+from evaluation import TranscriptionService
+
+from .test_inference import tiny_model
+
+
+def wav(samples: int) -> bytes:
+    buffer = io.BytesIO()
+    soundfile.write(buffer, np.zeros(samples, dtype=np.float32), 16000, format="WAV")
+    return buffer.getvalue()
+
+
+def respond(request: bytes):
+    async def run():
+        fe = transformers.Wav2Vec2FeatureExtractor(feature_size=1, sampling_rate=16000, padding_value=0.0,
+                                                   do_normalize=True, return_attention_mask=False)
+        service = TranscriptionService(tiny_model("group"), fe, [f"<{i}>" for i in range(32)])
+        service.start()
+        reader = asyncio.StreamReader()
+        reader.feed_data(request)
+        reader.feed_eof()
+        try:
+            return await service._respond(reader, 0.0)
+        finally:
+            await service.stop()
+
+    return asyncio.run(run())
+
+
+def post(body: bytes, length=None) -> bytes:
+    header = b"" if length is None else f"Content-Length: {length}\r\n".encode()
+    return b"POST /transcribe HTTP/1.1\r\n" + header + b"\r\n" + body
+
+
+@pytest.mark.parametrize("request_,status", [
+    (post(wav(8000), len(wav(8000))), 200),
+    (post(wav(8000)), 411),
+    (post(wav(8000), "abc"), 400),
+    (post(wav(8000), -5), 400),
+    (post(wav(8000), "²"), 400),
+    (post(wav(8000)[:100], len(wav(8000))), 400),
+], ids=["valid", "missing", "non-numeric", "negative", "non-ascii", "truncated"])
+def test_content_length(request_, status):
+    """
+    Requests with a missing, invalid or wrong Content-Length are refused, not failed with a 500
+    """
+    assert respond(request_)[0] == status
+
+
+def test_upload_is_decoded_off_the_event_loop(monkeypatch):
+    from evaluation import service
+
+    threads = []
+
+    def read_wav(data, sampling_rate):
+        threads.append(threading.current_thread().name)
+        return np.zeros(8000, dtype=np.float32)
+
+    monkeypatch.setattr(service, "read_wav", read_wav)
+    assert respond(post(wav(8000), len(wav(8000))))[0] == 200
+    assert threads and threads[0].startswith("audio")
+
+
+def test_metrics_count_forward_passes():
+    """
+    A micro-batch of two uploads too long to share the model's budget is two forward passes
+    """
+    async def run():
+        fe = transformers.Wav2Vec2FeatureExtractor(feature_size=1, sampling_rate=16000, padding_value=0.0,
+                                                   do_normalize=True, return_attention_mask=False)
+        service = TranscriptionService(tiny_model("group"), fe, [f"<{i}>" for i in range(32)], max_wait=1.0,
+                                       max_batch=2, max_samples=10000)
+        service.start()
+        try:
+            results = await asyncio.gather(*(service.transcribe(np.zeros(n, dtype=np.float32)) for n in (8000, 6000)))
+        finally:
+            await service.stop()
+        return results, service.metrics.to_dict()
+
+    results, metrics = asyncio.run(run())
+    assert [r["micro_batch_size"] for r in results] == [2, 2]
+    assert [r["batch_size"] for r in results] == [1, 1]
+    assert (metrics["micro_batches"], metrics["mean_micro_batch_size"]) == (1, 2.0)
+    assert (metrics["batches"], metrics["mean_batch_size"]) == (2, 1.0)
@@ -0,0 +1,14 @@
+import subprocess
+import sys
+from pathlib import Path
+
+
+def test_merge_command_does_not_import_torch():
+    """
+    Merging shard files only needs the WER counts, not the acoustic model
+    """
+    code = "import sys, runpy; sys.argv = ['shards', '--help']\n" \
+           "try:\n    runpy.run_module('evaluation.shards', run_name='__main__')\nexcept SystemExit:\n    pass\n" \
+           "assert 'torch' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True, capture_output=True,
+                   cwd=Path(__file__).resolve().parent.parent)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from evaluation.wer import D, H, S, WerAccumulator, WerBreakdown, edit_counts
+
+
+def levenshtein(ref: list, hyp: list) -> int:
+    row = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (r != h))
+    return row[-1]
+
+
+def sentences(rng, count: int):
+    words = ["a", "b", "c", "d", "e"]
+    return [" ".join(rng.choice(words, rng.integers(0, 12))) for _ in range(count)]
+
+
+def test_edit_counts_match_reference_dp():
+    """
+    The batched alignment finds the minimum edit distance of every pair, whatever lengths share a batch
+    """
+    rng = np.random.default_rng(0)
+    refs, hyps = sentences(rng, 600), sentences(rng, 600)
+    counts = edit_counts(refs, hyps)
+    for (s, d, i, h), ref, hyp in zip(counts.tolist(), refs, hyps):
+        ref, hyp = ref.split(), hyp.split()
+        assert s + d + i == levenshtein(ref, hyp)
+        assert s + d + h == len(ref)
+        assert s + i + h == len(hyp)
+
+
+def test_accumulator_is_the_corpus_wer():
+    refs = ["the patient has pain", "no fever", ""]
+    hyps = ["the patient pain today", "no fever", "hello"]
+    acc = WerAccumulator()
+    acc.add(refs[:2], hyps[:2])
+    acc.add(refs[2:], hyps[2:])
+    counts = edit_counts(refs, hyps).sum(axis=0)
+    assert acc.counts() == counts.tolist()
+    errors = sum(levenshtein(r.split(), h.split()) for r, h in zip(refs, hyps))
+    assert acc.errors == errors
+    assert acc.wer == errors / (counts[S] + counts[D] + counts[H])
+
+
+def test_breakdown_counts_every_interval_once():
+    wer = WerBreakdown()
+    wer.add(["day1_consultation01_doctor_3.wav", "sample_7.wav"], ["no fever", "hello"], ["no fever", "yellow"])
+    assert wer.roles["doctor"].counts() == [0, 0, 0, 2]
+    assert wer.roles["unknown"].counts() == wer.transcripts["unknown"].counts() == [1, 0, 0, 0]
+    with pytest.raises(ValueError):
+        wer.add(["sample_7.wav"], ["hello"], ["hello"])
+    assert wer.total.counts() == [1, 0, 0, 2]